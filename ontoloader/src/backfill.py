@@ -0,0 +1,79 @@
+import argparse
+import logging
+
+from datetime import timedelta
+
+from config.config import CONFIGURATION
+from dataimport.backfill import BackfillCheckpoint, WindowedBackfill
+from dataimport.extraction import Neo4jTripSource
+from dataimport.load_new_knowledge import DataLoader
+from dataimport.snapshot import SnapshotStore
+from main import create_columnar_export, create_graphdb_cfg, create_load_throttle, create_repository_pointer
+from utils.date import to_utc
+from utils.profiling import StageProfiler
+from utils.timer import create_elapsed_timer_str
+
+
+logger = logging.getLogger(__name__)
+
+
+parser = argparse.ArgumentParser(description='Backfill trips written to Neo4j in [since, until) using concurrent extraction.')
+parser.add_argument('--since', type=to_utc, required=True,
+                    help='ISO datetime, inclusive, not later than the latest loaded trip')
+parser.add_argument('--until', type=to_utc, required=True,
+                    help='ISO datetime, exclusive')
+parser.add_argument('--window_hours', type=float, default=24,
+                    help='write_date window extracted by one Neo4j session')
+parser.add_argument('--workers', type=int, default=4,
+                    help='number of concurrent Neo4j sessions')
+parser.add_argument('--checkpoint', type=str, default=None,
+                    help='file to record completed windows in, an interrupted backfill resumes from it')
+parser.add_argument('--profile', type=str, default=None, metavar='DIR',
+                    help='write per batch cProfile and tracemalloc reports of loader stages into DIR')
+
+
+def run(args):
+    graphdb_cfg = create_graphdb_cfg()
+
+    repository_pointer = create_repository_pointer(graphdb_cfg)
+    active_repository = repository_pointer.get_active_repository() if repository_pointer is not None else None
+    repository_id = active_repository.repository_id if active_repository else graphdb_cfg['repository_id']
+
+    snapshot_cfg = CONFIGURATION.get('SNAPSHOT', None)
+    trip_source = Neo4jTripSource(neo4j_endpoint=CONFIGURATION['NEO4J_ENDPOINT'])
+    profiler = StageProfiler(profile_dir=args.profile)
+
+    loader = DataLoader(
+        data_graph_name=CONFIGURATION['GRAPHDB']['MAIN_TRIPS_DATA_GRAPH'],
+        batch_update_size=CONFIGURATION['BATCH_UPDATE_SIZE'],
+        neo4j_endpoint=CONFIGURATION['NEO4J_ENDPOINT'],
+        trip_source=trip_source,
+        assert_event_types=CONFIGURATION.get('ASSERT_EVENT_TYPES', False),
+        node_snap_tolerance_meters=CONFIGURATION.get('NODE_SNAP_TOLERANCE_METERS', None),
+        rollup_road_segment_stats=CONFIGURATION.get('ROLLUP_ROAD_SEGMENT_STATS', False),
+        load_throttle=create_load_throttle(graphdb_cfg, serving_repository_id=repository_id),
+        snapshot_store=SnapshotStore(snapshot_dir=snapshot_cfg['DIR']) if snapshot_cfg else None,
+        columnar_export=create_columnar_export(),
+        profiler=profiler,
+        **dict(graphdb_cfg, repository_id=repository_id)
+    )
+
+    backfill = WindowedBackfill(
+        trip_source=trip_source,
+        since=args.since,
+        until=args.until,
+        window=timedelta(hours=args.window_hours),
+        max_workers=args.workers,
+        checkpoint=BackfillCheckpoint(path=args.checkpoint) if args.checkpoint else None
+    )
+
+    sw = create_elapsed_timer_str('sec')
+
+    loader.backfill(backfill)
+    profiler.finish()
+
+    logger.info('Finished backfill of [%s, %s) into %s in %s', args.since, args.until, repository_id, sw())
+
+
+if __name__ == '__main__':
+    run(parser.parse_args())
@@ -44,3 +44,12 @@ if is_fresh_update == 'true':
     CONFIGURATION['DB_ONTOLOGY_PTH'] = basedir.parent.parent / 'ontologies' / 'dmsmodels' / 'tripOnto-0.0.1.ttl'
 else:
     CONFIGURATION['DB_FRESH_UPDATE'] = False
+
+
+snapshot_dir = os.environ.get('ONTOLOADER_SNAPSHOT_DIR', None)
+if snapshot_dir:
+    CONFIGURATION['SNAPSHOT'] = dict(CONFIGURATION.get('SNAPSHOT', None) or {}, DIR=snapshot_dir)
+
+is_snapshot_replay = os.environ.get('ONTOLOADER_SNAPSHOT_REPLAY', 'False').lower()
+if CONFIGURATION.get('SNAPSHOT', None) and is_snapshot_replay == 'true':
+    CONFIGURATION['SNAPSHOT']['REPLAY'] = True
@@ -1,11 +1,9 @@
-import pytz
 import uuid
 import logging
 
 from datetime import datetime
-from timezonefinder import TimezoneFinder
 
-from typing import List, Set, Optional
+from typing import List, Set, Dict, Optional
 
 from dbapi.prefixes import (
     declare_prefixes,
@@ -19,6 +17,8 @@ from dbapi.prefixes import (
 
 from utils.formatting import ignore_if_empty
 
+from .temporal import normalize_timestamps
+
 
 class GeoPoint:
     def __init__(self,
@@ -85,6 +85,7 @@ class Resource:
         if self._is_defined:
             return ''
         else:
+            self._is_defined = True
             return self.get_definition()
 
 
@@ -99,26 +100,18 @@ class TimeRes(Resource):
     def __init__(self,
                  at: datetime,
                  at_tz_id: str,
+                 at_utc: Optional[str] = None,
+                 at_tz_offset: Optional[int] = None,
                  **kwargs):
         super().__init__(**kwargs)
 
-        self.logger.debug('Creating instance using params individual_name=%s, at=%s, at_tz_id=%s',
-                          self.individual_name,
-                          at,
-                          at_tz_id)
+        if (at_utc is None) or (at_tz_offset is None):
+            # prefer normalize_moments() for the whole trip, this is a fallback for standalone instants
+            (at_utc,), (at_tz_offset,) = normalize_timestamps([at], at_tz_id)
 
-        self.at = at.astimezone(pytz.utc).isoformat()
+        self.at = at_utc
         self.at_tz_id = at_tz_id
-
-        try:
-            #  When using None and the datetime matches the moment of the DST change pytz
-            #  does not know how to handle the datetime and you get one of the exceptions shown above.
-            offset = pytz.timezone(at_tz_id).utcoffset(at.replace(tzinfo=None), is_dst=None)
-            self.at_tz_offset = int(offset.total_seconds())
-        except pytz.exceptions.NonExistentTimeError:
-            # Else just use Standard Time. But I am not sure this workaround is reliable
-            offset = pytz.timezone(at_tz_id).utcoffset(at.replace(tzinfo=None), is_dst=False)
-            self.at_tz_offset = int(offset.total_seconds())
+        self.at_tz_offset = at_tz_offset
 
     def get_definition(self) -> str:
         return (
@@ -159,6 +152,9 @@ class NodeRes(Resource):
         return (
             f"{def_geometry}"
             f"{self.IRI} a {TRIP.abbr}:Node, {OWL.abbr}:NamedIndividual ; "
+            # numeric coordinates are range filtered through the literal index, see DataLoader.get_node_snap_index
+            f"{TRIP.abbr}:hasLatitude \"{self.point.latitude}\"^^{XSD.abbr}:double ; "
+            f"{TRIP.abbr}:hasLongitude \"{self.point.longitude}\"^^{XSD.abbr}:double ; "
             f"{GEOSPARQL.abbr}:hasGeometry {geometry_iri} . "
         )
 
@@ -233,8 +229,8 @@ class MotionSegmentRes(Resource):
                  trip_id: str,
                  unique_suffix: int,
                  road_segment: RoadSegmentRes,
-                 shape: GeoLine,
-                 points_timestemps: List[datetime],
+                 start_time: TimeRes,
+                 end_time: TimeRes,
                  mmatch_points: List[GeoPoint],
                  min_speed_mps: Optional[float],
                  max_speed_mps: Optional[float],
@@ -247,7 +243,6 @@ class MotionSegmentRes(Resource):
         super().__init__(**kwargs)
 
         self.road_segment = road_segment
-        self.shape = shape
         self.min_speed_mps = min_speed_mps
         self.max_speed_mps = max_speed_mps
         self.avg_speed_mps = avg_speed_mps
@@ -258,22 +253,17 @@ class MotionSegmentRes(Resource):
         self.start_point = mmatch_points[0]
         self.end_point = mmatch_points[-1]
 
-        tf = TimezoneFinder(in_memory=False)
-
-        self.start_time = TimeRes(
-            at=points_timestemps[0],
-            at_tz_id=tf.timezone_at(lng=self.start_point.longitude, lat=self.start_point.latitude),
-            individual_name=str(uuid.uuid4())
-        )
-        self.end_time = TimeRes(
-            at=points_timestemps[-1],
-            at_tz_id=tf.timezone_at(lng=self.end_point.longitude, lat=self.end_point.latitude),
-            individual_name=str(uuid.uuid4())
-        )
+        self.start_time = start_time
+        self.end_time = end_time
 
         self.l1_labels = l1_labels
+        self.asserted_types = set()  # type: Set[str]
+
+    def set_asserted_types(self, asserted_types: Set[str]):
+        self.asserted_types = asserted_types
 
     def get_definition(self) -> str:
+        def_asserted_types = ''.join(f", {TRIP.abbr}:{t}" for t in sorted(self.asserted_types))
         def_sharp_speed_drop_mps = f"{TRIP.abbr}:sharpSpeedDropByValue {self.sharp_speed_drop_mps} ; " if self.sharp_speed_drop_mps else ''
         def_over_speed_mps = f"{TRIP.abbr}:overspeedByValue {self.over_speed_mps} ; " if self.over_speed_mps else ''
         def_min_speed_mps = f"{TRIP.abbr}:hasMinSpeed {self.min_speed_mps} ; " if self.min_speed_mps is not None else ''
@@ -285,23 +275,24 @@ class MotionSegmentRes(Resource):
             for l1l in self.l1_labels:
                 def_l1_labels += f"{TRIP.abbr}:hasL1Label {TRIP.abbr}:{l1l} ; "
 
+        # the step geometry is not copied here, it is shared via the road segment (trp:onRoadSegment/trp:hasShape)
+        # and the driven sub-range is bounded by the first and the last matched locations
         return (
             f"{self.start_time.define_once()}\n"
             f"{self.end_time.define_once()}\n"
             f"{self.road_segment.define_once()}\n"
-            f"{self.IRI} a {TRIP.abbr}:MotionSegment, {OWL.abbr}:NamedIndividual ; "
+            f"{self.IRI} a {TRIP.abbr}:MotionSegment, {OWL.abbr}:NamedIndividual{def_asserted_types} ; "
             f"{TRIP.abbr}:onRoadSegment {self.road_segment.IRI} ; "
             f"{TIME.abbr}:hasBeginning {self.start_time.IRI} ; "
             f"{TIME.abbr}:hasEnd {self.end_time.IRI} ; "
-            f"{TRIP.abbr}:hasFirstAbsLocation \"{self.start_point.as_WKT()}\"^^{GEOSPARQL.abbr}:wktLiteral ; "
-            f"{TRIP.abbr}:hasLastAbsLocation \"{self.end_point.as_WKT()}\"^^{GEOSPARQL.abbr}:wktLiteral ; "
             f"{def_sharp_speed_drop_mps}"
             f"{def_over_speed_mps}"
             f"{def_min_speed_mps}"
             f"{def_max_speed_mps}"
             f"{def_avg_speed_mps}"
             f"{def_l1_labels}"
-            f"{TRIP.abbr}:hasShape \"{self.shape.as_WKT()}\"^^{GEOSPARQL.abbr}:wktLiteral . "
+            f"{TRIP.abbr}:hasFirstAbsLocation \"{self.start_point.as_WKT()}\"^^{GEOSPARQL.abbr}:wktLiteral ; "
+            f"{TRIP.abbr}:hasLastAbsLocation \"{self.end_point.as_WKT()}\"^^{GEOSPARQL.abbr}:wktLiteral . "
         )
 
 
@@ -412,6 +403,7 @@ class TripRes(Resource):
                  vehicle: VehicleRes,
                  began_at: TimeRes,
                  end_at: TimeRes,
+                 l1_label_counts: Optional[Dict[str, int]] = None,
                  **kwargs):
         kwargs['individual_name'] = f'Trip_{trip_id}'
         super().__init__(**kwargs)
@@ -424,6 +416,7 @@ class TripRes(Resource):
         self.vehicle = vehicle
         self.began_at = began_at
         self.end_at = end_at
+        self.l1_label_counts = l1_label_counts
 
     def get_definition(self) -> str:
         average_speed_iri = f"{TRIP.abbr}:{str(uuid.uuid4())}"
@@ -440,9 +433,22 @@ class TripRes(Resource):
             f"{TIME.abbr}:unitTime {TIME.abbr}:unitSecond . "
         )
 
+        def_l1_label_counts = ''
+        def_trip_l1_label_counts = ''
+        if self.l1_label_counts:
+            for l1l, quantity in sorted(self.l1_label_counts.items()):
+                l1_label_count_iri = f"{TRIP.abbr}:L1LC_{self.trip_id}_{l1l}"
+                def_l1_label_counts += (
+                    f"{l1_label_count_iri} a {TRIP.abbr}:L1LabelCount, {OWL.abbr}:NamedIndividual ; "
+                    f"{TRIP.abbr}:ofL1Label {TRIP.abbr}:{l1l} ; "
+                    f"{TRIP.abbr}:ofQuantity {quantity} . "
+                )
+                def_trip_l1_label_counts += f"{TRIP.abbr}:hasL1LabelCount {l1_label_count_iri} ; "
+
         return (
             f"{def_average_speed}\n"
             f"{def_duration}\n"
+            f"{def_l1_label_counts}\n"
             f"{self.began_at.define_once()}\n"
             f"{self.end_at.define_once()}\n"
             f"{self.vehicle.define_once()}\n"
@@ -454,6 +460,7 @@ class TripRes(Resource):
             f"{TRIP.abbr}:drivenBy {self.driver.IRI} ; "
             f"{TRIP.abbr}:byVehicle {self.vehicle.IRI} ; "
             f"{TRIP.abbr}:hasAverageSpeed {average_speed_iri} ; "
+            f"{def_trip_l1_label_counts}"
             f"{TIME.abbr}:hasDuration {duration_iri} ; "
             f"{TIME.abbr}:hasBeginning {self.began_at.IRI} ; "
             f"{TIME.abbr}:hasEnd {self.end_at.IRI} . "
@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from typing import Iterator, List, Optional, Tuple
+
+from utils.date import to_utc
+
+from .extraction import Neo4jTripSource
+from .records import TripRecord
+
+
+class BackfillCheckpoint:
+    """Remembers up to which write_date a backfill of [since, until) was committed."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self, since: datetime, until: datetime) -> Optional[datetime]:
+        if not os.path.exists(self.path):
+            return None
+
+        with open(self.path, 'rt') as f:
+            checkpoint = json.load(f)
+
+        # checkpoint of another backfill range does not apply
+        if (to_utc(checkpoint['since']) != since) or (to_utc(checkpoint['until']) != until):
+            return None
+
+        return to_utc(checkpoint['completed_until'])
+
+    def save(self, since: datetime, until: datetime, completed_until: datetime) -> None:
+        tmp_path = self.path + '.tmp'
+
+        with open(tmp_path, 'wt') as f:
+            json.dump({
+                'since': since.isoformat(),
+                'until': until.isoformat(),
+                'completed_until': completed_until.isoformat()
+            }, f)
+
+        os.replace(tmp_path, self.path)
+
+
+class WindowedBackfill:
+    """Splits [since, until) into write_date windows and extracts up to `max_workers` of them concurrently.
+
+    Windows are still handed out in write_date order, so that trips are built and committed in the same order
+    as during sync and the checkpoint always marks a contiguous loaded range.
+    """
+
+    def __init__(self,
+                 trip_source: Neo4jTripSource,
+                 since: datetime,
+                 until: datetime,
+                 window: timedelta,
+                 max_workers: int,
+                 checkpoint: Optional[BackfillCheckpoint] = None):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        assert since < until
+        assert window > timedelta(0)
+        assert max_workers > 0
+
+        self.trip_source = trip_source
+        self.since = since
+        self.until = until
+        self.window = window
+        self.max_workers = max_workers
+        self.checkpoint = checkpoint
+
+    def get_windows(self) -> List[Tuple[datetime, datetime]]:
+        window_start = self.checkpoint.load(self.since, self.until) if self.checkpoint else None
+
+        if window_start is not None:
+            self.logger.info('Resuming backfill of [%s, %s) from %s', self.since, self.until, window_start)
+        else:
+            window_start = self.since
+
+        windows = []
+
+        while window_start < self.until:
+            window_end = min(window_start + self.window, self.until)
+            windows.append((window_start, window_end))
+            window_start = window_end
+
+        return windows
+
+    def iter_windows(self) -> Iterator[Tuple[datetime, datetime, List[TripRecord]]]:
+        windows = deque(self.get_windows())
+
+        self.logger.info('Backfilling %s windows with %s workers', len(windows), self.max_workers)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            extracting = deque()
+
+            # extract ahead only as many windows as there are workers, to bound memory
+            while windows or extracting:
+                while windows and (len(extracting) < self.max_workers):
+                    since, until = windows.popleft()
+                    extracting.append((since, until, executor.submit(self.trip_source.extract_window, since, until)))
+
+                since, until, future = extracting.popleft()
+                yield since, until, future.result()
+
+    def complete_window(self, until: datetime) -> None:
+        if self.checkpoint:
+            self.checkpoint.save(self.since, self.until, completed_until=until)
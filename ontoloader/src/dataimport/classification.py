@@ -0,0 +1,21 @@
+from typing import Callable, List, Set, Tuple
+
+from .autology import MotionSegmentRes
+
+
+# Motion step classes which the loader can assert itself instead of leaving them to the repository reasoner.
+# Every rule mirrors the corresponding tripOnto axiom, so query results are the same either way.
+MOTION_STEP_CLASSIFICATION_RULES = [
+    # :onRoadSegment rdfs:domain :RoadMatchedMotionStep
+    ('RoadMatchedMotionStep', lambda mp: mp.road_segment is not None),
+    # :MotionStep and (:overspeedByValue exactly 1 rdfs:Literal)
+    ('DriverOverspeedingEvent', lambda mp: bool(mp.over_speed_mps)),
+    # :MotionStep and (:sharpSpeedDropByValue exactly 1 rdfs:Literal)
+    ('DriverHardBrakingEvent', lambda mp: bool(mp.sharp_speed_drop_mps)),
+    # :MotionStep and ((:hasSpeed value :zero_speed) or (:hasMinSpeed value 0.0))
+    ('DriverStoppedEvent', lambda mp: (mp.min_speed_mps is not None) and (mp.min_speed_mps == 0)),
+]  # type: List[Tuple[str, Callable[[MotionSegmentRes], bool]]]
+
+
+def classify_motion_step(motion_step: MotionSegmentRes) -> Set[str]:
+    return {class_name for class_name, rule in MOTION_STEP_CLASSIFICATION_RULES if rule(motion_step)}
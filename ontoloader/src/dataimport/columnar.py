@@ -0,0 +1,147 @@
+import logging
+import os
+import uuid
+
+from datetime import datetime, timezone
+
+from typing import Dict, List
+
+from utils.timer import create_elapsed_timer_str
+
+from .autology import TripRes
+from .records import L1_CATEGORY_FIELDS, TripRecord
+
+
+def _l1_bits(category_indexes: List[int]) -> int:
+    # bit i is set when label i of the category (see L1_CATEGORY_LABELS) is assigned to the step
+    bits = 0
+    for cat_idx in category_indexes:
+        bits |= 1 << cat_idx
+    return bits
+
+
+class ColumnarExport:
+    """Parquet copy of loaded trips and their motion steps for aggregate analytics.
+
+    Every batch adds one file per day partition to `trips/day=YYYY-MM-DD/` and `motion_steps/day=YYYY-MM-DD/`,
+    days are the UTC start days of trips. Rows carry `exported_at`, so readers can drop earlier exports
+    of reloaded trips. pyarrow is only required when the export is configured.
+    """
+
+    def __init__(self, export_dir: str):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.export_dir = export_dir
+
+        import pyarrow
+        import pyarrow.parquet
+
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+
+        # explicit schemas, so every file has the same column types even when a batch has only nulls in a column
+        ts = pyarrow.timestamp('us', tz='UTC')
+        self.schemas = {
+            'trips': pyarrow.schema([
+                ('trip_id', pyarrow.string()),
+                ('write_date', ts),
+                ('start_time', ts),
+                ('end_time', ts),
+                ('driver_id', pyarrow.string()),
+                ('vehicle_id', pyarrow.string()),
+                ('avg_speed', pyarrow.float64()),
+                ('duration', pyarrow.int64()),
+                ('distance', pyarrow.float64()),
+                ('motion_steps_count', pyarrow.int32()),
+                ('exported_at', ts)
+            ]),
+            'motion_steps': pyarrow.schema([
+                ('trip_id', pyarrow.string()),
+                ('step_order', pyarrow.int32()),
+                ('driver_id', pyarrow.string()),
+                ('segment_id', pyarrow.string()),
+                ('start_time', ts),
+                ('end_time', ts),
+                ('min_speed', pyarrow.float64()),
+                ('max_speed', pyarrow.float64()),
+                ('avg_speed', pyarrow.float64()),
+                ('speed_limit', pyarrow.float64()),
+                ('exported_at', ts)
+            ] + [
+                (field.replace('_categories', '_l1_bits'), pyarrow.int64()) for field in L1_CATEGORY_FIELDS
+            ])
+        }
+
+        os.makedirs(export_dir, exist_ok=True)
+
+    def write_batch(self, trips: List[TripRecord], trips_resources: List[TripRes]) -> None:
+        sw = create_elapsed_timer_str('sec')
+
+        exported_at = datetime.now(timezone.utc)
+
+        trips_rows = {}  # type: Dict[str, List[dict]]
+        motion_steps_rows = {}  # type: Dict[str, List[dict]]
+
+        # BatchUpdate creates exactly one TripRes per record, in the same order
+        for trip, trip_res in zip(trips, trips_resources):
+            day = trip.start_time.astimezone(timezone.utc).strftime('%Y-%m-%d')
+
+            trips_rows.setdefault(day, []).append({
+                'trip_id': trip.trip_id,
+                'write_date': trip.write_date,
+                'start_time': trip.start_time,
+                'end_time': trip.end_time,
+                'driver_id': trip_res.driver.driver_id,
+                'vehicle_id': trip_res.vehicle.vehicle_id,
+                'avg_speed': trip.avg_speed,
+                'duration': trip.duration,
+                'distance': trip.distance,
+                'motion_steps_count': len(trip.route_segments),
+                'exported_at': exported_at
+            })
+
+            day_steps = motion_steps_rows.setdefault(day, [])
+
+            for rs in sorted(trip.route_segments, key=lambda x: x.order):
+                row = {
+                    'trip_id': trip.trip_id,
+                    'step_order': rs.order,
+                    'driver_id': trip_res.driver.driver_id,
+                    'segment_id': str(rs.segment_id),
+                    'start_time': rs.timestamps[0],
+                    'end_time': rs.timestamps[-1],
+                    'min_speed': rs.min_speed,
+                    'max_speed': rs.max_speed,
+                    'avg_speed': rs.avg_speed,
+                    'speed_limit': rs.speed_limit,
+                    'exported_at': exported_at
+                }
+
+                for field in L1_CATEGORY_FIELDS:
+                    row[field.replace('_categories', '_l1_bits')] = _l1_bits(rs.l1_categories[field])
+
+                day_steps.append(row)
+
+        self._write_partitions('trips', trips_rows)
+        self._write_partitions('motion_steps', motion_steps_rows)
+
+        self.logger.info(
+            'Exported %s trips, %s motion steps in %s',
+            sum(len(rows) for rows in trips_rows.values()),
+            sum(len(rows) for rows in motion_steps_rows.values()),
+            sw()
+        )
+
+    def _write_partitions(self, dataset: str, rows_by_day: Dict[str, List[dict]]) -> None:
+        file_name = f'{uuid.uuid4().hex}.parquet'
+
+        for day, rows in rows_by_day.items():
+            if not rows:
+                continue
+
+            partition_dir = os.path.join(self.export_dir, dataset, f'day={day}')
+            os.makedirs(partition_dir, exist_ok=True)
+
+            # written aside and renamed, readers never see a partial file
+            tmp_path = os.path.join(partition_dir, f'.{file_name}.tmp')
+            self.pq.write_table(self.pa.Table.from_pylist(rows, schema=self.schemas[dataset]), tmp_path)
+            os.replace(tmp_path, os.path.join(partition_dir, file_name))
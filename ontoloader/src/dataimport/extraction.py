@@ -0,0 +1,139 @@
+import logging
+
+from datetime import datetime
+
+from typing import Iterator, List, Optional
+
+from neomodel import db
+from shared.db import Trip, RouteSegment, Segment
+
+from utils.timer import create_elapsed_timer_str
+
+from .records import L1_CATEGORY_FIELDS, NodeRecord, SegmentRecord, RouteSegmentRecord, TripRecord
+
+
+def is_after(trip: TripRecord, after_write_date: Optional[datetime], after_trip_id: Optional[str]) -> bool:
+    if after_write_date is None:
+        return True
+    return (trip.write_date > after_write_date) or ((trip.write_date == after_write_date) and (trip.trip_id > after_trip_id))
+
+
+class TripSource:
+    """Yields batches of trips written after the given (write_date, trip_id), ordered by them."""
+
+    def iter_batches(self,
+                     after_write_date: Optional[datetime],
+                     after_trip_id: Optional[str],
+                     batch_size: int) -> Iterator[List[TripRecord]]:
+        raise NotImplementedError()
+
+
+class Neo4jTripSource(TripSource):
+    def __init__(self, neo4j_endpoint: str):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.neo4j_endpoint = neo4j_endpoint
+
+    def iter_batches(self,
+                     after_write_date: Optional[datetime],
+                     after_trip_id: Optional[str],
+                     batch_size: int) -> Iterator[List[TripRecord]]:
+        db.set_connection(self.neo4j_endpoint)
+
+        try:
+            sw = create_elapsed_timer_str('sec')
+
+            if after_write_date is not None:
+                trips = Trip.nodes.filter(write_date__gte=after_write_date)  # type: List[Trip]
+            else:
+                trips = Trip.nodes.all()
+
+            self.logger.info('Got %s new trips in %s', len(trips), sw())
+
+            trips = sorted(trips, key=lambda x: (x.write_date, x.trip_id))
+
+            if after_write_date is not None:
+                assert (not trips) or (trips[0].write_date >= after_write_date)
+                # skip already added trips
+                trips = [t for t in trips if (t.write_date > after_write_date) or (t.trip_id > after_trip_id)]
+
+            batch_sz = batch_size if batch_size > 0 else max(len(trips), 1)
+
+            for i in range(0, len(trips), batch_sz):
+                sw = create_elapsed_timer_str('sec')
+                trips_batch = [self.extract_trip(trip) for trip in trips[i:i+batch_sz]]
+                self.logger.info('Extracted batch of %s trips in %s', len(trips_batch), sw())
+
+                yield trips_batch
+        finally:
+            db.driver.close()
+
+    def extract_window(self, since: datetime, until: datetime) -> List[TripRecord]:
+        """Extracts trips written in [since, until) over its own Neo4j connection, so windows can be extracted concurrently."""
+        # neomodel keeps the connection per thread
+        db.set_connection(self.neo4j_endpoint)
+
+        try:
+            sw = create_elapsed_timer_str('sec')
+
+            trips = Trip.nodes.filter(write_date__gte=since, write_date__lt=until)  # type: List[Trip]
+            trips = sorted(trips, key=lambda x: (x.write_date, x.trip_id))
+            trips = [self.extract_trip(trip) for trip in trips]
+
+            self.logger.info('Extracted %s trips written in [%s, %s) in %s', len(trips), since, until, sw())
+
+            return trips
+        finally:
+            db.driver.close()
+
+    def extract_trips(self, trip_ids: List[str]) -> List[TripRecord]:
+        db.set_connection(self.neo4j_endpoint)
+
+        try:
+            trips = Trip.nodes.filter(trip_id__in=trip_ids)  # type: List[Trip]
+            trips = sorted(trips, key=lambda x: (x.write_date, x.trip_id))
+            return [self.extract_trip(trip) for trip in trips]
+        finally:
+            db.driver.close()
+
+    def extract_trip(self, trip: Trip) -> TripRecord:
+        return TripRecord(
+            trip_id=trip.trip_id,
+            write_date=trip.write_date,
+            start_time=trip.start_time,
+            start_local_tz=trip.start_local_tz,
+            end_time=trip.end_time,
+            end_local_tz=trip.end_local_tz,
+            avg_speed=trip.avg_speed,
+            duration=trip.duration,
+            distance=trip.distance,
+            start_location=trip.start_location,
+            end_location=trip.end_location,
+            route_segments=[self._extract_route_segment(rs) for rs in trip.route_segments.all()],
+            segments=[self._extract_segment(seg) for seg in trip.segments.all()]
+        )
+
+    def _extract_route_segment(self, rs: RouteSegment) -> RouteSegmentRecord:
+        return RouteSegmentRecord(
+            route_segment_id=rs.route_segment_id,
+            segment_id=rs.segment[0].segment_id,  # TODO performance issue
+            speed_limit=rs.speed_limit,
+            min_speed=rs.min_speed,
+            max_speed=rs.max_speed,
+            avg_speed=rs.avg_speed,
+            timestamps=list(rs.timestamps),
+            matched_points=[NodeRecord(latitude=p.latitude, longitude=p.longitude) for p in rs.matched_points] if rs.matched_points else [],
+            l1_categories={field: list(getattr(rs, field) or []) for field in L1_CATEGORY_FIELDS}
+        )
+
+    def _extract_segment(self, seg: Segment) -> SegmentRecord:
+        start_node = seg.start_node.get()
+        end_node = seg.end_node.get()
+
+        return SegmentRecord(
+            segment_id=seg.segment_id,
+            shape=seg.shape,
+            length=seg.length,
+            location=seg.location,
+            start_node=NodeRecord(latitude=start_node.coordinates.latitude, longitude=start_node.coordinates.longitude),
+            end_node=NodeRecord(latitude=end_node.coordinates.latitude, longitude=end_node.coordinates.longitude)
+        )
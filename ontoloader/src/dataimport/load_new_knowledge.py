@@ -4,11 +4,14 @@ import io
 import random
 import uuid
 
+from collections import Counter
 from datetime import datetime
 
-from typing import List, Set, Dict, Optional
+from typing import Iterable, List, Set, Dict, Optional, Tuple
 
 from dbapi.graphdb_api import GraphDBApi, GraphDBApiException
+from dbapi.load_throttle import LoadThrottle
+from dbapi.ontology_version import bump_modification_count_SPARQL
 from dbapi.prefixes import (
     declare_prefixes,
     TRIP,
@@ -21,6 +24,7 @@ from dbapi.prefixes import (
 
 from utils.date import to_utc
 from utils.formatting import ignore_if_empty
+from utils.profiling import StageProfiler
 from utils.timer import create_elapsed_timer_str
 
 from .autology import (
@@ -36,16 +40,39 @@ from .autology import (
     GeoLine,
     GeoPoint
 )
-
+from .classification import classify_motion_step
+from .columnar import ColumnarExport
+from .backfill import WindowedBackfill
+from .extraction import TripSource
+from .records import L1_CATEGORY_FIELDS, TripRecord, RouteSegmentRecord
+from .rollup import collect_road_segment_stats, road_segment_stats_SPARQL
+from .snapshot import SnapshotStore
+from .spatial import NodeSnapIndex
+from .temporal import normalize_moments
+
+from timezonefinder import TimezoneFinder
 from neomodel import db
-from neomodel.contrib.spatial_properties import PointProperty
-from shared.db import Trip, RouteSegment, Segment, Node
 from shared.db.trip_L1_labels import TripOntologyRecord
 
 
 logger = logging.getLogger(__name__)
 
 
+L1_CATEGORY_LABELS = {
+    'throttle_categories': TripOntologyRecord.THROTTLE_CATEGORY,
+    'brake_categories': TripOntologyRecord.BRAKE_CATEGORY,
+    'steering_categories': TripOntologyRecord.STEERING_CATEGORY,
+    'speed_categories': TripOntologyRecord.SPEED_CATEGORY,
+    'dthrottle_categories': TripOntologyRecord.DTHROTTLE_CATEGORY,
+    'dbrake_categories': TripOntologyRecord.DBRAKE_CATEGORY,
+    'dsteering_categories': TripOntologyRecord.DSTEERING_CATEGORY,
+    'dspeed_categories': TripOntologyRecord.DSPEED_CATEGORY,
+    'acc_lat_categories': TripOntologyRecord.ACC_LAT_CATEGORY,
+    'acc_lon_categories': TripOntologyRecord.ACC_LON_CATEGORY,
+    'acc_vert_categories': TripOntologyRecord.ACC_VERT_CATEGORY,
+}
+
+
 class OntologyVersionInfo:
     def __init__(self, latest_write_date: datetime, latest_trip_id: str):
         self._latest_trip_id = latest_trip_id
@@ -64,15 +91,33 @@ class OntologyVersionInfo:
     
     
 class BatchUpdate:
-    def __init__(self, data_graph_name: str, trips: List[Trip], curr_ontology_version: OntologyVersionInfo):
+    def __init__(self,
+                 data_graph_name: str,
+                 trips: List[TripRecord],
+                 curr_ontology_version: OntologyVersionInfo,
+                 assert_event_types: bool = False,
+                 node_snap_index: Optional[NodeSnapIndex] = None,
+                 rollup_road_segment_stats: bool = False,
+                 rolled_up_trip_ids: Optional[Set[str]] = None):
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
 
         self.data_graph_name = data_graph_name
+        self.assert_event_types = assert_event_types
+        self.node_snap_index = node_snap_index
+        self.rollup_road_segment_stats = rollup_road_segment_stats
+        # trips which are already counted in the statistics, e.g. reloaded ones
+        self.rolled_up_trip_ids = rolled_up_trip_ids or set()
 
         self.trips = trips
         self.curr_ontology_version = curr_ontology_version
         self.next_ontology_version = OntologyVersionInfo(latest_trip_id=trips[-1].trip_id, latest_write_date=trips[-1].write_date)
 
+        # backfilled trips can be older than the ones already loaded, the version never goes back
+        if curr_ontology_version and (
+                (curr_ontology_version.latest_write_date, curr_ontology_version.latest_trip_id) >=
+                (self.next_ontology_version.latest_write_date, self.next_ontology_version.latest_trip_id)):
+            self.next_ontology_version = curr_ontology_version
+
         self.logger.info(
             'Got batch of %s new trips. Current ontology version %s. Next ontology version %s',
             len(trips),
@@ -82,12 +127,14 @@ class BatchUpdate:
 
         self.road_segments_res_cache = {}  # type: Dict[str, RoadSegmentRes]
         self.segment_nodes_res_cache = {}  # type: Dict[NodeRes, NodeRes]
+        self.points_tz_cache = {}  # type: Dict[GeoPoint, str]
+        self.timezone_finder = TimezoneFinder(in_memory=False)
         self.trips_resources = self._create_trip(trips)
 
     def get_next_ontology_version(self):
         return self.next_ontology_version
 
-    def _create_trip(self, trips: List[Trip]):
+    def _create_trip(self, trips: List[TripRecord]):
         sw = create_elapsed_timer_str('sec')
 
         trips_resources = []  # List[TripRes]
@@ -108,9 +155,12 @@ class BatchUpdate:
             try:
                 self._update_road_segments_cache(trip)
 
+                ordered_rss = self._get_ordered_route_segments(trip)
+                trip_instants = self._create_trip_instants(trip, ordered_rss)
+
                 driver_res = random.choice(drivers_res)
                 vehicle_res = random.choice(vehicles_res)
-                route_res = self._create_trip_route(trip)
+                route_res = self._create_trip_route(trip, ordered_rss, trip_instants)
 
                 trip_res = TripRes(
                     trip_id=trip.trip_id,
@@ -119,16 +169,9 @@ class BatchUpdate:
                     route=route_res,
                     driver=driver_res,
                     vehicle=vehicle_res,
-                    began_at=TimeRes(
-                         at=trip.start_time,
-                         at_tz_id=trip.start_local_tz,
-                         individual_name=str(uuid.uuid4())
-                    ),
-                    end_at=TimeRes(
-                         at=trip.end_time,
-                         at_tz_id=trip.end_local_tz,
-                         individual_name=str(uuid.uuid4())
-                    )
+                    began_at=trip_instants[(trip.start_time, trip.start_local_tz)],
+                    end_at=trip_instants[(trip.end_time, trip.end_local_tz)],
+                    l1_label_counts=self._count_l1_labels(route_res)
                 )
 
                 trips_resources.append(trip_res)
@@ -142,26 +185,62 @@ class BatchUpdate:
 
         return trips_resources
 
+    def _create_trip_instants(self, trip: TripRecord, ordered_rss: List[RouteSegmentRecord]) -> Dict[Tuple[datetime, str], TimeRes]:
+        # one instant per distinct moment, so adjacent motion steps and the trip boundaries share it
+        moments = [
+            (trip.start_time, trip.start_local_tz),
+            (trip.end_time, trip.end_local_tz)
+        ]
+
+        for rs in ordered_rss:
+            first_point, last_point = rs.matched_points[0], rs.matched_points[-1]
+            moments.append((rs.timestamps[0], self._get_timezone_at(GeoPoint(latitude=first_point.latitude, longitude=first_point.longitude))))
+            moments.append((rs.timestamps[-1], self._get_timezone_at(GeoPoint(latitude=last_point.latitude, longitude=last_point.longitude))))
+
+        return {
+            (at, at_tz_id): TimeRes(
+                at=at,
+                at_tz_id=at_tz_id,
+                at_utc=at_utc,
+                at_tz_offset=at_tz_offset,
+                individual_name=str(uuid.uuid4())
+            )
+            for (at, at_tz_id), (at_utc, at_tz_offset) in normalize_moments(moments).items()
+        }
+
+    def _get_timezone_at(self, point: GeoPoint) -> str:
+        tz_id = self.points_tz_cache.get(point, None)
+
+        if tz_id is None:
+            tz_id = self.timezone_finder.timezone_at(lng=point.longitude, lat=point.latitude)
+            self.points_tz_cache[point] = tz_id
+
+        return tz_id
+
+    def _count_l1_labels(self, route_res: RouteRes) -> Dict[str, int]:
+        l1_label_counts = Counter()
+
+        for mp in route_res.motion_points:
+            if mp.l1_labels:
+                l1_label_counts.update(mp.l1_labels)
+
+        return dict(l1_label_counts)
+
     def _set_l1_labels(self, category: List[str], category_indexes: List[int], out_l1_labels: Set[str]):
         for cat_idx in category_indexes:
             out_l1_labels.add(category[cat_idx])
 
-    def _create_trip_route(self, trip: Trip):
+    def _get_ordered_route_segments(self, trip: TripRecord) -> List[RouteSegmentRecord]:
+        return sorted(trip.route_segments, key=lambda x: x.order)
+
+    def _create_trip_route(self, trip: TripRecord, ordered_rss: List[RouteSegmentRecord], instants: Dict[Tuple[datetime, str], TimeRes]):
         motion_segments_res = []  # type: List[MotionSegmentRes]
         mmatch_points_all = []    # type: List[GeoPoint]
 
         sw = create_elapsed_timer_str('sec')
 
-        ordered_rss = trip.route_segments.all()  # type: List[RouteSegment]
-        ordered_rss = sorted(ordered_rss, key=lambda x: int(x.route_segment_id.split('#')[1]))
-
-        self.logger.debug('Got %s route segments for trip_id=%s in %s', len(ordered_rss), trip.trip_id, sw())
-
-        sw = create_elapsed_timer_str('sec')
-
         for i, rs in enumerate(ordered_rss):
-            segment_id = rs.segment[0].segment_id  # TODO performance issue
-            road_seg_res = self.road_segments_res_cache[segment_id]
+            road_seg_res = self.road_segments_res_cache[rs.segment_id]
             road_seg_res.set_speed_limit_mps(rs.speed_limit)
 
             if rs.max_speed is not None and rs.speed_limit and (rs.max_speed > rs.speed_limit):
@@ -170,61 +249,12 @@ class BatchUpdate:
                 over_speed_mps = None
 
             l1_labels = set()  # type: Set[str]
-            self._set_l1_labels(
-                category=TripOntologyRecord.THROTTLE_CATEGORY,
-                category_indexes=rs.throttle_categories,
-                out_l1_labels=l1_labels
-            )
-            self._set_l1_labels(
-                category=TripOntologyRecord.BRAKE_CATEGORY,
-                category_indexes=rs.brake_categories,
-                out_l1_labels=l1_labels
-            )
-            self._set_l1_labels(
-                category=TripOntologyRecord.STEERING_CATEGORY,
-                category_indexes=rs.steering_categories,
-                out_l1_labels=l1_labels
-            )
-            self._set_l1_labels(
-                category=TripOntologyRecord.SPEED_CATEGORY,
-                category_indexes=rs.speed_categories,
-                out_l1_labels=l1_labels
-            )
-            self._set_l1_labels(
-                category=TripOntologyRecord.DTHROTTLE_CATEGORY,
-                category_indexes=rs.dthrottle_categories,
-                out_l1_labels=l1_labels
-            )
-            self._set_l1_labels(
-                category=TripOntologyRecord.DBRAKE_CATEGORY,
-                category_indexes=rs.dbrake_categories,
-                out_l1_labels=l1_labels
-            )
-            self._set_l1_labels(
-                category=TripOntologyRecord.DSTEERING_CATEGORY,
-                category_indexes=rs.dsteering_categories,
-                out_l1_labels=l1_labels
-            )
-            self._set_l1_labels(
-                category=TripOntologyRecord.DSPEED_CATEGORY,
-                category_indexes=rs.dspeed_categories,
-                out_l1_labels=l1_labels
-            )
-            self._set_l1_labels(
-                category=TripOntologyRecord.ACC_LAT_CATEGORY,
-                category_indexes=rs.acc_lat_categories,
-                out_l1_labels=l1_labels
-            )
-            self._set_l1_labels(
-                category=TripOntologyRecord.ACC_LON_CATEGORY,
-                category_indexes=rs.acc_lon_categories,
-                out_l1_labels=l1_labels
-            )
-            self._set_l1_labels(
-                category=TripOntologyRecord.ACC_VERT_CATEGORY,
-                category_indexes=rs.acc_vert_categories,
-                out_l1_labels=l1_labels
-            )
+            for field in L1_CATEGORY_FIELDS:
+                self._set_l1_labels(
+                    category=L1_CATEGORY_LABELS[field],
+                    category_indexes=rs.l1_categories[field],
+                    out_l1_labels=l1_labels
+                )
 
             mmatch_points = [GeoPoint(latitude=p.latitude, longitude=p.longitude) for p in rs.matched_points] if rs.matched_points else []
             mmatch_points_all += mmatch_points
@@ -233,17 +263,20 @@ class BatchUpdate:
                 unique_suffix=i,
                 trip_id=trip.trip_id,
                 road_segment=road_seg_res,
-                shape=road_seg_res.shape,
+                start_time=instants[(rs.timestamps[0], self._get_timezone_at(mmatch_points[0]))],
+                end_time=instants[(rs.timestamps[-1], self._get_timezone_at(mmatch_points[-1]))],
                 min_speed_mps=rs.min_speed,
                 max_speed_mps=rs.max_speed,
                 avg_speed_mps=rs.avg_speed,
                 sharp_speed_drop_mps=None,
                 over_speed_mps=over_speed_mps,
                 l1_labels=l1_labels,
-                points_timestemps=rs.timestamps,
                 mmatch_points=mmatch_points,
             )
 
+            if self.assert_event_types:
+                mp_res.set_asserted_types(classify_motion_step(mp_res))
+
             motion_segments_res.append(mp_res)
 
         route_res = RouteRes(
@@ -259,14 +292,13 @@ class BatchUpdate:
 
         return route_res
 
-    def _update_road_segments_cache(self, trip: Trip):
-        sw = create_elapsed_timer_str('sec')
-
-        segments = trip.segments.all()  # type: List[Segment]
+    def _snap(self, point: GeoPoint) -> GeoPoint:
+        return self.node_snap_index.snap(point) if self.node_snap_index is not None else point
 
-        self.logger.debug('Got %s segments for trip_id=%s in %s', len(segments), trip.trip_id, sw())
+    def _update_road_segments_cache(self, trip: TripRecord):
+        sw = create_elapsed_timer_str('sec')
 
-        for seg in segments:  # type: Segment
+        for seg in trip.segments:
             road_seg_res = self.road_segments_res_cache.get(seg.segment_id, None)
 
             if not road_seg_res:
@@ -274,17 +306,15 @@ class BatchUpdate:
                 seg_pts = [GeoPoint(latitude=seg_pts[i], longitude=seg_pts[i + 1]) for i in range(0, len(seg_pts), 2)]
                 shape = GeoLine(seg_pts)
 
-                start_node = seg.start_node.get()
-                start_node_res = NodeRes(point=GeoPoint(
-                    longitude=start_node.coordinates.longitude,
-                    latitude=start_node.coordinates.latitude
-                ))
+                start_node_res = NodeRes(point=self._snap(GeoPoint(
+                    longitude=seg.start_node.longitude,
+                    latitude=seg.start_node.latitude
+                )))
 
-                end_node = seg.end_node.get()
-                end_node_res = NodeRes(point=GeoPoint(
-                    longitude=end_node.coordinates.longitude,
-                    latitude=end_node.coordinates.latitude
-                ))
+                end_node_res = NodeRes(point=self._snap(GeoPoint(
+                    longitude=seg.end_node.longitude,
+                    latitude=seg.end_node.latitude
+                )))
 
                 if start_node_res not in self.segment_nodes_res_cache:
                     self.segment_nodes_res_cache[start_node_res] = start_node_res
@@ -311,6 +341,27 @@ class BatchUpdate:
         self.logger.debug('Updated road segments cache for trip_id=%s in %s', trip.trip_id, sw())
 
     def as_SPARQL(self) -> str:
+        update_sparql = self._trips_SPARQL()
+
+        if self.rollup_road_segment_stats:
+            trips_resources = [t for t in self.trips_resources if t.trip_id not in self.rolled_up_trip_ids]
+            stats_sparql = road_segment_stats_SPARQL(collect_road_segment_stats(trips_resources), self.data_graph_name)
+            if stats_sparql:
+                update_sparql = f"{update_sparql} ; {stats_sparql}"
+
+        return update_sparql
+
+    def _trips_SPARQL(self) -> str:
+        if self.next_ontology_version is self.curr_ontology_version:
+            return (
+                f"{declare_prefixes(TIME, XSD, TRIP, OWL, GEOSPARQL, SF)} "
+                "INSERT DATA { "
+                    f"{ignore_if_empty('GRAPH <{}> {{', self.data_graph_name)} "
+                        f"{define_resources(self.trips_resources)}"
+                    f"{ignore_if_empty('}}', self.data_graph_name)} "
+                "}"
+            )
+
         def_delete_old_version = (
             "DELETE DATA { "
                 f"{ignore_if_empty('GRAPH <{}> ', self.data_graph_name)} "
@@ -340,6 +391,14 @@ class DataLoader(GraphDBApi):
                  data_graph_name: str,
                  neo4j_endpoint: str,
                  batch_update_size: int,
+                 trip_source: TripSource,
+                 assert_event_types: bool = False,
+                 load_throttle: Optional[LoadThrottle] = None,
+                 snapshot_store: Optional[SnapshotStore] = None,
+                 node_snap_tolerance_meters: Optional[float] = None,
+                 rollup_road_segment_stats: bool = False,
+                 columnar_export: Optional[ColumnarExport] = None,
+                 profiler: Optional[StageProfiler] = None,
                  **kwargs):
 
         super().__init__(**kwargs)
@@ -347,6 +406,17 @@ class DataLoader(GraphDBApi):
         self.data_graph_name = data_graph_name
         self.batch_update_size = batch_update_size if batch_update_size > 0 else 0
         self.neo4j_endpoint = neo4j_endpoint
+        self.assert_event_types = assert_event_types
+        self.load_throttle = load_throttle
+        self.trip_source = trip_source
+        # keeps a local copy of every extracted batch, so later runs can replay it instead of Neo4j
+        self.snapshot_store = snapshot_store
+        self.node_snap_tolerance_meters = node_snap_tolerance_meters
+        self.node_snap_index = None  # type: Optional[NodeSnapIndex]
+        self.rollup_road_segment_stats = rollup_road_segment_stats
+        # Parquet copy of committed batches for aggregate analytics
+        self.columnar_export = columnar_export
+        self.profiler = profiler if profiler is not None else StageProfiler()
 
     def get_ontology_version(self) -> Optional[OntologyVersionInfo]:
         query = (
@@ -376,45 +446,253 @@ class DataLoader(GraphDBApi):
         else:
             raise GraphDBApiException('Unexpected format ' + result['format'])
 
-    def sync(self):
+    def count_loaded_trips(self) -> int:
+        query = (
+            f"{declare_prefixes(TRIP)} "
+             "SELECT (COUNT(DISTINCT ?trip) AS ?tripsCount) "
+             "WHERE { "
+                f"{ignore_if_empty('GRAPH <{}> {{', self.data_graph_name)} "
+                    f"?trip a {TRIP.abbr}:Trip . "
+                f"{ignore_if_empty('}}', self.data_graph_name)} "
+             "}"
+        )
+
+        result = self.query(sparql=query)
+
+        if result['format'] == 'text/csv':
+            reader = list(csv.DictReader(io.StringIO(result['result'])))
+            return int(reader[0]['tripsCount'])
+        else:
+            raise GraphDBApiException('Unexpected format ' + result['format'])
+
+    def count_source_trips(self, until: datetime) -> int:
         db.set_connection(self.neo4j_endpoint)
 
-        ontology_version = self.get_ontology_version()
+        try:
+            # neomodel keeps DateTimeProperty as UTC epoch seconds
+            results, _ = db.cypher_query(
+                'MATCH (t:Trip) WHERE t.write_date <= $until RETURN count(t)',
+                {'until': until.timestamp()}
+            )
+            return results[0][0]
+        finally:
+            db.driver.close()
+
+    def get_node_snap_index(self, trips: List[TripRecord]) -> Optional[NodeSnapIndex]:
+        """Seeds the index with nodes which are already in the repository around the junctions of `trips`,
+        every area is read once and kept across batches.
+        """
+        if not self.node_snap_tolerance_meters:
+            return None
+
+        if self.node_snap_index is None:
+            self.node_snap_index = NodeSnapIndex(tolerance_meters=self.node_snap_tolerance_meters)
+
+        junctions = [
+            GeoPoint(latitude=float(node.latitude), longitude=float(node.longitude))
+            for trip in trips for seg in trip.segments for node in (seg.start_node, seg.end_node)
+        ]
+
+        cells, boxes = self.node_snap_index.get_unseeded_areas(junctions)
+
+        if not cells:
+            return self.node_snap_index
+
         sw = create_elapsed_timer_str('sec')
 
-        if ontology_version:
-            trips = Trip.nodes.filter(write_date__gte=ontology_version.latest_write_date)  # type: List[Trip]
+        # one pattern per box, so both coordinates are looked up by range in the literal index
+        boxes_patterns = ' UNION '.join(
+            "{ "
+                f"?node {TRIP.abbr}:hasLatitude ?lat . "
+                f"FILTER(?lat >= {min_lat} && ?lat <= {max_lat}) "
+                f"?node {TRIP.abbr}:hasLongitude ?lon . "
+                f"FILTER(?lon >= {min_lon} && ?lon <= {max_lon}) "
+            "}"
+            for min_lat, max_lat, min_lon, max_lon in boxes
+        )
+
+        # nodes loaded before coordinates were materialized get them by the 0.0.2 migrations
+        query = (
+            f"{declare_prefixes(TRIP)} "
+             "SELECT ?lat ?lon "
+             "WHERE { "
+                f"{ignore_if_empty('GRAPH <{}> {{', self.data_graph_name)} "
+                    f"{boxes_patterns} "
+                f"{ignore_if_empty('}}', self.data_graph_name)} "
+             "}"
+        )
+
+        result = self.query(sparql=query, post=True)
+
+        if result['format'] != 'text/csv':
+            raise GraphDBApiException('Unexpected format ' + result['format'])
+
+        known_points = [
+            GeoPoint(latitude=float(row['lat']), longitude=float(row['lon']))
+            for row in csv.DictReader(io.StringIO(result['result']))
+        ]
+
+        self.node_snap_index.seed(cells, known_points)
+
+        self.logger.info(
+            'Seeded node snap index with %s nodes around %s junctions in %s, it has %s nodes',
+            len(known_points), len(junctions), sw(), len(self.node_snap_index)
+        )
+
+        return self.node_snap_index
+
+    def get_loaded_trip_ids(self, trip_ids: List[str]) -> Set[str]:
+        trip_ids_values = ' '.join(f'"{trip_id}"' for trip_id in trip_ids)
+
+        query = (
+            f"{declare_prefixes(TRIP)} "
+             "SELECT ?tripID "
+             "WHERE { "
+                f"VALUES ?tripID {{ {trip_ids_values} }} "
+                f"BIND(IRI(CONCAT(STR({TRIP.abbr}:), 'Trip_', ?tripID)) AS ?trip) "
+                f"{ignore_if_empty('GRAPH <{}> {{', self.data_graph_name)} "
+                    f"?trip a {TRIP.abbr}:Trip . "
+                f"{ignore_if_empty('}}', self.data_graph_name)} "
+             "}"
+        )
+
+        result = self.query(sparql=query)
+
+        if result['format'] == 'text/csv':
+            return {row['tripID'] for row in csv.DictReader(io.StringIO(result['result']))}
         else:
-            trips = Trip.nodes.all()
+            raise GraphDBApiException('Unexpected format ' + result['format'])
+
+    def delete_trips_sparql(self, trip_ids: List[str]) -> str:
+        """Deletes trips together with the resources they own, shared drivers, vehicles and road segments stay."""
+        trip_ids_values = ' '.join(f'"{trip_id}"' for trip_id in trip_ids)
+
+        return (
+            f"{declare_prefixes(TRIP, TIME)} "
+            "DELETE { "
+                f"{ignore_if_empty('GRAPH <{}> {{', self.data_graph_name)} "
+                    "?s ?p ?o . "
+                f"{ignore_if_empty('}}', self.data_graph_name)} "
+            "} "
+            "WHERE { "
+                f"{ignore_if_empty('GRAPH <{}> {{', self.data_graph_name)} "
+                    f"VALUES ?tripID {{ {trip_ids_values} }} "
+                    f"{{ ?s {TRIP.abbr}:hasTripID ?tripID . }} "
+                    f"UNION {{ ?trip {TRIP.abbr}:hasTripID ?tripID ; "
+                        f"{TRIP.abbr}:hasAverageSpeed|{TIME.abbr}:hasDuration|{TRIP.abbr}:hasL1LabelCount|{TIME.abbr}:hasBeginning|{TIME.abbr}:hasEnd|{TRIP.abbr}:hasRoute ?s . }} "
+                    f"UNION {{ ?trip {TRIP.abbr}:hasTripID ?tripID ; "
+                        f"{TRIP.abbr}:hasRoute/({TRIP.abbr}:hasRouteLength|{TRIP.abbr}:hasMotionStep) ?s . }} "
+                    f"UNION {{ ?trip {TRIP.abbr}:hasTripID ?tripID ; "
+                        f"{TRIP.abbr}:hasRoute/{TRIP.abbr}:hasMotionStep/({TIME.abbr}:hasBeginning|{TIME.abbr}:hasEnd) ?s . }} "
+                    "?s ?p ?o . "
+                f"{ignore_if_empty('}}', self.data_graph_name)} "
+            "}"
+        )
 
-        self.logger.info('Got %s new trips in %s', len(trips), sw())
+    def sync(self):
+        ontology_version = self.get_ontology_version()
 
-        if trips:
-            trips = sorted(trips, key=lambda x: (x.write_date, x.trip_id))
+        trips_batches = self.trip_source.iter_batches(
+            after_write_date=ontology_version.latest_write_date if ontology_version else None,
+            after_trip_id=ontology_version.latest_trip_id if ontology_version else None,
+            batch_size=self.batch_update_size
+        )
 
-            if ontology_version is not None:
-                assert trips[0].write_date >= ontology_version.latest_write_date
-                # skip already added trips
-                trips = [t for t in trips if (t.write_date > ontology_version.latest_write_date) or (t.trip_id > ontology_version.latest_trip_id)]
+        self.load_batches(trips_batches, ontology_version)
 
-            batch_sz = self.batch_update_size if self.batch_update_size > 0 else len(trips)
+    def backfill(self, backfill: WindowedBackfill):
+        ontology_version = self.get_ontology_version()
 
-            trips_batches = [trips[i:i+batch_sz] for i in range(0, len(trips), batch_sz)]
+        # backfilled trips advance the version, trips written between it and `since` would never be synced
+        if (ontology_version is not None) and (backfill.since > ontology_version.latest_write_date):
+            raise ValueError(
+                f'Backfill since {backfill.since.isoformat()} is later than the latest loaded trip {ontology_version}, '
+                f'trips written in between would be skipped by sync'
+            )
 
-            try:
-                for trips_batch in trips_batches:
-                    if trips_batch:
-                        batch_update = BatchUpdate(
-                            data_graph_name=self.data_graph_name,
-                            trips=trips_batch,
-                            curr_ontology_version=ontology_version
-                        )
-                        update_sparql = batch_update.as_SPARQL()
-
-                        self.update_in_transaction(sparql=update_sparql)
-
-                        ontology_version = batch_update.get_next_ontology_version()
-                    else:
-                        self.logger.info('Got 0 new trips')
-            finally:
-                db.driver.close()
+        for since, until, trips in backfill.iter_windows():
+            sw = create_elapsed_timer_str('sec')
+
+            batch_sz = self.batch_update_size if self.batch_update_size > 0 else max(len(trips), 1)
+            trips_batches = (trips[i:i+batch_sz] for i in range(0, len(trips), batch_sz))
+
+            # windows can be partially loaded when a previous run was interrupted
+            ontology_version = self.load_batches(trips_batches, ontology_version, skip_loaded=True)
+            backfill.complete_window(until)
+
+            self.logger.info('Backfilled %s trips written in [%s, %s) in %s', len(trips), since, until, sw())
+
+    def load_batches(self,
+                     trips_batches: Iterable[List[TripRecord]],
+                     ontology_version: Optional[OntologyVersionInfo],
+                     skip_loaded: bool = False,
+                     replace_loaded: bool = False) -> Optional[OntologyVersionInfo]:
+        trips_batches = iter(trips_batches)
+
+        while True:
+            self.profiler.start_batch()
+
+            # batches are extracted lazily, so this is where Neo4j is read
+            with self.profiler.stage('fetch'):
+                trips_batch = next(trips_batches, None)
+
+            if trips_batch is None:
+                break
+
+            loaded_trip_ids = set()  # type: Set[str]
+
+            if skip_loaded or (replace_loaded and self.rollup_road_segment_stats):
+                loaded_trip_ids = self.get_loaded_trip_ids([t.trip_id for t in trips_batch])
+
+            if skip_loaded:
+                trips_batch = [t for t in trips_batch if t.trip_id not in loaded_trip_ids]
+
+                if not trips_batch:
+                    continue
+
+            if self.snapshot_store is not None:
+                self.snapshot_store.write_batch(
+                    trips_batch,
+                    kind=SnapshotStore.BACKFILL if skip_loaded else SnapshotStore.REPAIR if replace_loaded else SnapshotStore.SYNC
+                )
+
+            with self.profiler.stage('build'):
+                batch_update = BatchUpdate(
+                    data_graph_name=self.data_graph_name,
+                    trips=trips_batch,
+                    curr_ontology_version=ontology_version,
+                    assert_event_types=self.assert_event_types,
+                    node_snap_index=self.get_node_snap_index(trips_batch),
+                    rollup_road_segment_stats=self.rollup_road_segment_stats,
+                    # reloaded trips were already counted, statistics are merged incrementally and never recomputed,
+                    # trips loaded for the first time by replace_loaded (e.g. missing ones repaired) are counted
+                    rolled_up_trip_ids=loaded_trip_ids
+                )
+
+            with self.profiler.stage('as_sparql'):
+                update_sparql = batch_update.as_SPARQL()
+
+            if replace_loaded:
+                # delete and insert in the same transaction, so queries never see the trip missing
+                update_sparql = f"{self.delete_trips_sparql([t.trip_id for t in trips_batch])} ; {update_sparql}"
+
+            # backfills and repairs can keep the latest trip, readers follow the modification count
+            update_sparql = f"{update_sparql} ; {bump_modification_count_SPARQL(self.data_graph_name)}"
+
+            if self.load_throttle is not None:
+                self.load_throttle.wait()
+
+            sw = create_elapsed_timer_str('sec')
+            with self.profiler.stage('commit'):
+                self.update_in_transaction(sparql=update_sparql)
+            self.logger.info(
+                'Committed batch of %s trips (assert_event_types=%s) in %s',
+                len(trips_batch), self.assert_event_types, sw()
+            )
+
+            if self.columnar_export is not None:
+                self.columnar_export.write_batch(batch_update.trips, batch_update.trips_resources)
+
+            ontology_version = batch_update.get_next_ontology_version()
+
+        return ontology_version
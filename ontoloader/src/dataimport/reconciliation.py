@@ -0,0 +1,263 @@
+import csv
+import hashlib
+import io
+import logging
+
+from datetime import date, datetime, timedelta, timezone
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from neomodel import db
+
+from dbapi.graphdb_api import GraphDBApiException
+from dbapi.prefixes import declare_prefixes, TRIP, TIME, XSD
+from utils.formatting import ignore_if_empty
+from utils.timer import create_elapsed_timer_str
+
+from .extraction import Neo4jTripSource
+from .load_new_knowledge import DataLoader
+
+
+EPOCH = date(1970, 1, 1)
+
+
+
+def hash_trip_ids(trip_ids: Iterable[str]) -> int:
+    """Order-independent hash of trip IDs: the sum of their SHA-1 prefixes modulo 2^64.
+
+    Both stores only return the IDs, they are hashed here, so the function is the same on both sides.
+    """
+    return sum(int.from_bytes(hashlib.sha1(trip_id.encode('utf-8')).digest()[:8], 'big') for trip_id in trip_ids) % (1 << 64)
+
+
+class TripsDigest:
+    """Order-independent fingerprint of a set of trips: how many there are, how many motion steps
+    they have, their total duration and the hash of their trip IDs, see `hash_trip_ids`, so that a day holding
+    other trips with the same totals still differs."""
+
+    def __init__(self, trips_count: int, steps_count: int, duration_sum: float, trip_ids_hash: int):
+        self.trips_count = trips_count
+        self.steps_count = steps_count
+        self.duration_sum = duration_sum
+        self.trip_ids_hash = trip_ids_hash
+
+    def __str__(self):
+        return (
+            f"(trips_count={self.trips_count}, steps_count={self.steps_count}, duration_sum={self.duration_sum}, "
+            f"trip_ids_hash={self.trip_ids_hash})"
+        )
+
+    def __eq__(self, obj):
+        # sums of float durations depend on the summation order
+        return isinstance(obj, TripsDigest) and \
+            (obj.trips_count == self.trips_count) and \
+            (obj.steps_count == self.steps_count) and \
+            (obj.trip_ids_hash == self.trip_ids_hash) and \
+            (abs(obj.duration_sum - self.duration_sum) < 1e-3)
+
+
+class ReconciliationReport:
+    def __init__(self):
+        self.days_checked = 0
+        self.differing_days = []  # type: List[date]
+        self.missing_trip_ids = []  # type: List[str]
+        self.stale_trip_ids = []  # type: List[str]
+        self.extra_trip_ids = []  # type: List[str]
+
+    def __str__(self):
+        return (
+            f"(days_checked={self.days_checked}, differing_days={len(self.differing_days)}, "
+            f"missing={len(self.missing_trip_ids)}, stale={len(self.stale_trip_ids)}, extra={len(self.extra_trip_ids)})"
+        )
+
+
+class Reconciliation:
+    """Checks that GraphDB holds the same trips as Neo4j.
+
+    Both sides first return one digest per UTC day of trip start, only days with differing digests
+    are compared trip by trip, so a clean range costs one aggregate query per side.
+    """
+
+    def __init__(self, loader: DataLoader, trip_source: Neo4jTripSource):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.loader = loader
+        self.trip_source = trip_source
+
+    def reconcile(self, since: datetime, until: datetime) -> ReconciliationReport:
+        sw = create_elapsed_timer_str('sec')
+
+        report = ReconciliationReport()
+
+        neo4j_digests = self._get_neo4j_day_digests(since, until)
+        graphdb_digests = self._get_graphdb_day_digests(since, until)
+
+        days = sorted(set(neo4j_digests) | set(graphdb_digests))
+        report.days_checked = len(days)
+
+        for day in days:
+            neo4j_digest, graphdb_digest = neo4j_digests.get(day, None), graphdb_digests.get(day, None)
+
+            if neo4j_digest == graphdb_digest:
+                continue
+
+            self.logger.info('Day %s differs, Neo4j %s, GraphDB %s', day, neo4j_digest, graphdb_digest)
+            report.differing_days.append(day)
+
+            day_since = max(since, datetime(day.year, day.month, day.day, tzinfo=timezone.utc))
+            day_until = min(until, day_since + timedelta(days=1))
+
+            neo4j_trips = self._get_neo4j_trips(day_since, day_until)
+            graphdb_trips = self._get_graphdb_trips(day_since, day_until)
+
+            for trip_id, neo4j_trip in neo4j_trips.items():
+                graphdb_trip = graphdb_trips.get(trip_id, None)
+
+                if graphdb_trip is None:
+                    report.missing_trip_ids.append(trip_id)
+                elif graphdb_trip != neo4j_trip:
+                    report.stale_trip_ids.append(trip_id)
+
+            report.extra_trip_ids += [trip_id for trip_id in graphdb_trips if trip_id not in neo4j_trips]
+
+        self.logger.info('Reconciled trips started in [%s, %s): %s in %s', since, until, report, sw())
+
+        return report
+
+    def repair(self, report: ReconciliationReport) -> None:
+        """Loads missing trips and reloads stale ones, trips which are only in GraphDB are left to the operator."""
+        trip_ids = report.missing_trip_ids + report.stale_trip_ids
+
+        if report.extra_trip_ids:
+            self.logger.warning('Trips %s are in GraphDB only, they are not removed', report.extra_trip_ids)
+
+        if not trip_ids:
+            return
+
+        sw = create_elapsed_timer_str('sec')
+
+        trips = self.trip_source.extract_trips(trip_ids)
+
+        batch_sz = self.loader.batch_update_size if self.loader.batch_update_size > 0 else max(len(trips), 1)
+        trips_batches = (trips[i:i+batch_sz] for i in range(0, len(trips), batch_sz))
+
+        self.loader.load_batches(trips_batches, self.loader.get_ontology_version(), replace_loaded=True)
+
+        self.logger.info('Reloaded %s missing and %s stale trips in %s', len(report.missing_trip_ids), len(report.stale_trip_ids), sw())
+
+    def _get_neo4j_day_digests(self, since: datetime, until: datetime) -> Dict[date, TripsDigest]:
+        rows = self._cypher_query(
+            'MATCH (t:Trip) WHERE t.start_time >= $since AND t.start_time < $until '
+            'OPTIONAL MATCH (t)--(rs:RouteSegment) '
+            'WITH t, count(DISTINCT rs) AS stepsCount '
+            # neomodel keeps DateTimeProperty as UTC epoch seconds
+            'RETURN toInteger(floor(t.start_time / 86400)) AS day, count(t), sum(stepsCount), sum(t.duration), '
+            'collect(t.trip_id)',
+            since, until
+        )
+
+        return {
+            EPOCH + timedelta(days=day): TripsDigest(
+                trips_count=trips_count,
+                steps_count=steps_count,
+                duration_sum=duration_sum or 0,
+                trip_ids_hash=hash_trip_ids(trip_ids)
+            )
+            for day, trips_count, steps_count, duration_sum, trip_ids in rows
+        }
+
+    def _get_neo4j_trips(self, since: datetime, until: datetime) -> Dict[str, TripsDigest]:
+        rows = self._cypher_query(
+            'MATCH (t:Trip) WHERE t.start_time >= $since AND t.start_time < $until '
+            'OPTIONAL MATCH (t)--(rs:RouteSegment) '
+            'RETURN t.trip_id, count(DISTINCT rs), t.duration',
+            since, until
+        )
+
+        return {
+            trip_id: TripsDigest(
+                trips_count=1,
+                steps_count=steps_count,
+                duration_sum=duration or 0,
+                trip_ids_hash=hash_trip_ids([trip_id])
+            )
+            for trip_id, steps_count, duration in rows
+        }
+
+    def _cypher_query(self, cypher: str, since: datetime, until: datetime) -> List[Tuple]:
+        db.set_connection(self.trip_source.neo4j_endpoint)
+
+        try:
+            results, _ = db.cypher_query(cypher, {'since': since.timestamp(), 'until': until.timestamp()})
+            return results
+        finally:
+            db.driver.close()
+
+    def _graphdb_trips_subquery(self, since: datetime, until: datetime) -> str:
+        return (
+            "SELECT ?tripID ?day ?duration (COUNT(DISTINCT ?mp) AS ?stepsCount) "
+            "WHERE { "
+                f"{ignore_if_empty('GRAPH <{}> {{', self.loader.data_graph_name)} "
+                    f"?trip a {TRIP.abbr}:Trip ; "
+                        f"{TRIP.abbr}:hasTripID ?tripID ; "
+                        f"{TIME.abbr}:hasBeginning/{TRIP.abbr}:hasTimestamp ?ts ; "
+                        f"{TIME.abbr}:hasDuration/{TIME.abbr}:numericDuration ?duration . "
+                    f'FILTER(?ts >= "{since.isoformat()}"^^{XSD.abbr}:dateTime && ?ts < "{until.isoformat()}"^^{XSD.abbr}:dateTime) '
+                    f"OPTIONAL {{ ?trip {TRIP.abbr}:hasRoute/{TRIP.abbr}:hasMotionStep ?mp . }} "
+                f"{ignore_if_empty('}}', self.loader.data_graph_name)} "
+                # timestamps are kept in UTC, so the first 10 characters are the UTC day
+                "BIND(SUBSTR(STR(?ts), 1, 10) AS ?day) "
+            "} "
+            "GROUP BY ?tripID ?day ?duration"
+        )
+
+    def _get_graphdb_day_digests(self, since: datetime, until: datetime) -> Dict[date, TripsDigest]:
+        query = (
+            f"{declare_prefixes(TRIP, TIME, XSD)} "
+            "SELECT ?day (COUNT(?tripID) AS ?tripsCount) (SUM(?stepsCount) AS ?stepsSum) (SUM(?duration) AS ?durationSum) "
+                   "(GROUP_CONCAT(?tripID; separator=' ') AS ?tripIDs) "
+            "WHERE { "
+                f"{{ {self._graphdb_trips_subquery(since, until)} }} "
+            "} "
+            "GROUP BY ?day"
+        )
+
+        return {
+            date.fromisoformat(row['day']): TripsDigest(
+                trips_count=int(row['tripsCount']),
+                steps_count=int(row['stepsSum']),
+                duration_sum=float(row['durationSum']),
+                # trip IDs have no whitespace
+                trip_ids_hash=hash_trip_ids(row['tripIDs'].split())
+            )
+            for row in self._graphdb_query(query)
+        }
+
+    def _get_graphdb_trips(self, since: datetime, until: datetime) -> Dict[str, TripsDigest]:
+        query = f"{declare_prefixes(TRIP, TIME, XSD)} {self._graphdb_trips_subquery(since, until)}"
+
+        trips = {}  # type: Dict[str, TripsDigest]
+
+        for row in self._graphdb_query(query):
+            trip_digest = TripsDigest(
+                trips_count=1,
+                steps_count=int(row['stepsCount']),
+                duration_sum=float(row['duration']),
+                trip_ids_hash=hash_trip_ids([row['tripID']])
+            )
+
+            if row['tripID'] in trips:
+                # the same trip loaded twice, make it differ from its Neo4j counterpart
+                trip_digest.trips_count += trips[row['tripID']].trips_count
+
+            trips[row['tripID']] = trip_digest
+
+        return trips
+
+    def _graphdb_query(self, query: str) -> List[Dict[str, Optional[str]]]:
+        result = self.loader.query(sparql=query)
+
+        if result['format'] == 'text/csv':
+            return list(csv.DictReader(io.StringIO(result['result'])))
+        else:
+            raise GraphDBApiException('Unexpected format ' + result['format'])
@@ -0,0 +1,199 @@
+from datetime import datetime
+
+from typing import Dict, List, Optional
+
+from dateutil.parser import isoparse
+
+
+# route segment fields holding L1 label indexes, in the order the loader applies them
+L1_CATEGORY_FIELDS = [
+    'throttle_categories',
+    'brake_categories',
+    'steering_categories',
+    'speed_categories',
+    'dthrottle_categories',
+    'dbrake_categories',
+    'dsteering_categories',
+    'dspeed_categories',
+    'acc_lat_categories',
+    'acc_lon_categories',
+    'acc_vert_categories',
+]
+
+
+def _to_iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def _from_iso(value: Optional[str]) -> Optional[datetime]:
+    return isoparse(value) if value is not None else None
+
+
+class NodeRecord:
+    def __init__(self, latitude: float, longitude: float):
+        self.latitude = latitude
+        self.longitude = longitude
+
+    def to_dict(self) -> dict:
+        return {'latitude': self.latitude, 'longitude': self.longitude}
+
+    @staticmethod
+    def from_dict(d: dict) -> 'NodeRecord':
+        return NodeRecord(latitude=d['latitude'], longitude=d['longitude'])
+
+
+class SegmentRecord:
+    def __init__(self,
+                 segment_id: str,
+                 shape: Optional[str],
+                 length: float,
+                 location: Optional[str],
+                 start_node: NodeRecord,
+                 end_node: NodeRecord):
+        self.segment_id = segment_id
+        self.shape = shape
+        self.length = length
+        self.location = location
+        self.start_node = start_node
+        self.end_node = end_node
+
+    def to_dict(self) -> dict:
+        return {
+            'segment_id': self.segment_id,
+            'shape': self.shape,
+            'length': self.length,
+            'location': self.location,
+            'start_node': self.start_node.to_dict(),
+            'end_node': self.end_node.to_dict()
+        }
+
+    @staticmethod
+    def from_dict(d: dict) -> 'SegmentRecord':
+        return SegmentRecord(
+            segment_id=d['segment_id'],
+            shape=d['shape'],
+            length=d['length'],
+            location=d['location'],
+            start_node=NodeRecord.from_dict(d['start_node']),
+            end_node=NodeRecord.from_dict(d['end_node'])
+        )
+
+
+class RouteSegmentRecord:
+    def __init__(self,
+                 route_segment_id: str,
+                 segment_id: str,
+                 speed_limit: Optional[float],
+                 min_speed: Optional[float],
+                 max_speed: Optional[float],
+                 avg_speed: Optional[float],
+                 timestamps: List[datetime],
+                 matched_points: List[NodeRecord],
+                 l1_categories: Dict[str, List[int]]):
+        self.route_segment_id = route_segment_id
+        self.segment_id = segment_id
+        self.speed_limit = speed_limit
+        self.min_speed = min_speed
+        self.max_speed = max_speed
+        self.avg_speed = avg_speed
+        self.timestamps = timestamps
+        self.matched_points = matched_points
+        self.l1_categories = l1_categories
+
+    @property
+    def order(self) -> int:
+        return int(self.route_segment_id.split('#')[1])
+
+    def to_dict(self) -> dict:
+        return {
+            'route_segment_id': self.route_segment_id,
+            'segment_id': self.segment_id,
+            'speed_limit': self.speed_limit,
+            'min_speed': self.min_speed,
+            'max_speed': self.max_speed,
+            'avg_speed': self.avg_speed,
+            'timestamps': [_to_iso(ts) for ts in self.timestamps],
+            'matched_points': [[p.latitude, p.longitude] for p in self.matched_points],
+            'l1_categories': self.l1_categories
+        }
+
+    @staticmethod
+    def from_dict(d: dict) -> 'RouteSegmentRecord':
+        return RouteSegmentRecord(
+            route_segment_id=d['route_segment_id'],
+            segment_id=d['segment_id'],
+            speed_limit=d['speed_limit'],
+            min_speed=d['min_speed'],
+            max_speed=d['max_speed'],
+            avg_speed=d['avg_speed'],
+            timestamps=[_from_iso(ts) for ts in d['timestamps']],
+            matched_points=[NodeRecord(latitude=lat, longitude=lon) for lat, lon in d['matched_points']],
+            l1_categories=d['l1_categories']
+        )
+
+
+class TripRecord:
+    """Everything the loader reads about one trip, detached from Neo4j so it can be snapshotted and replayed."""
+
+    def __init__(self,
+                 trip_id: str,
+                 write_date: datetime,
+                 start_time: datetime,
+                 start_local_tz: str,
+                 end_time: datetime,
+                 end_local_tz: str,
+                 avg_speed: float,
+                 duration: int,
+                 distance: float,
+                 start_location: Optional[str],
+                 end_location: Optional[str],
+                 route_segments: List[RouteSegmentRecord],
+                 segments: List[SegmentRecord]):
+        self.trip_id = trip_id
+        self.write_date = write_date
+        self.start_time = start_time
+        self.start_local_tz = start_local_tz
+        self.end_time = end_time
+        self.end_local_tz = end_local_tz
+        self.avg_speed = avg_speed
+        self.duration = duration
+        self.distance = distance
+        self.start_location = start_location
+        self.end_location = end_location
+        self.route_segments = route_segments
+        self.segments = segments
+
+    def to_dict(self) -> dict:
+        return {
+            'trip_id': self.trip_id,
+            'write_date': _to_iso(self.write_date),
+            'start_time': _to_iso(self.start_time),
+            'start_local_tz': self.start_local_tz,
+            'end_time': _to_iso(self.end_time),
+            'end_local_tz': self.end_local_tz,
+            'avg_speed': self.avg_speed,
+            'duration': self.duration,
+            'distance': self.distance,
+            'start_location': self.start_location,
+            'end_location': self.end_location,
+            'route_segments': [rs.to_dict() for rs in self.route_segments],
+            'segments': [seg.to_dict() for seg in self.segments]
+        }
+
+    @staticmethod
+    def from_dict(d: dict) -> 'TripRecord':
+        return TripRecord(
+            trip_id=d['trip_id'],
+            write_date=_from_iso(d['write_date']),
+            start_time=_from_iso(d['start_time']),
+            start_local_tz=d['start_local_tz'],
+            end_time=_from_iso(d['end_time']),
+            end_local_tz=d['end_local_tz'],
+            avg_speed=d['avg_speed'],
+            duration=d['duration'],
+            distance=d['distance'],
+            start_location=d['start_location'],
+            end_location=d['end_location'],
+            route_segments=[RouteSegmentRecord.from_dict(rs) for rs in d['route_segments']],
+            segments=[SegmentRecord.from_dict(seg) for seg in d['segments']]
+        )
@@ -0,0 +1,151 @@
+from collections import Counter
+
+from typing import Dict, List, Optional
+
+from dbapi.prefixes import declare_prefixes, TRIP, OWL
+from utils.formatting import ignore_if_empty
+
+from .autology import RoadSegmentRes, TripRes
+
+
+class RoadSegmentStatsDelta:
+    """What one batch adds to the running statistics of a road segment."""
+
+    def __init__(self, road_segment: RoadSegmentRes):
+        self.road_segment = road_segment
+        self.traversal_count = 0
+        self.speed_sample_count = 0
+        self.speed_sum = 0.0
+        self.max_speed = None  # type: Optional[float]
+        self.overspeed_count = 0
+        self.l1_label_counts = Counter()
+
+    @property
+    def stats_IRI(self) -> str:
+        return f"{TRIP.abbr}:RDSS_{str(self.road_segment.segment_id).replace('-', 'n')}"
+
+    def l1_label_count_IRI(self, l1_label: str) -> str:
+        return f"{TRIP.abbr}:RDSL1LC_{str(self.road_segment.segment_id).replace('-', 'n')}_{l1_label}"
+
+
+def collect_road_segment_stats(trips_resources: List[TripRes]) -> Dict[str, RoadSegmentStatsDelta]:
+    deltas = {}  # type: Dict[str, RoadSegmentStatsDelta]
+
+    for trip_res in trips_resources:
+        for mp in trip_res.route.motion_points:
+            delta = deltas.get(mp.road_segment.segment_id, None)
+
+            if delta is None:
+                delta = RoadSegmentStatsDelta(mp.road_segment)
+                deltas[mp.road_segment.segment_id] = delta
+
+            delta.traversal_count += 1
+
+            if mp.avg_speed_mps is not None:
+                delta.speed_sample_count += 1
+                delta.speed_sum += mp.avg_speed_mps
+
+            if (mp.max_speed_mps is not None) and ((delta.max_speed is None) or (mp.max_speed_mps > delta.max_speed)):
+                delta.max_speed = mp.max_speed_mps
+
+            if mp.over_speed_mps:
+                delta.overspeed_count += 1
+
+            if mp.l1_labels:
+                delta.l1_label_counts.update(mp.l1_labels)
+
+    return deltas
+
+
+def road_segment_stats_SPARQL(deltas: Dict[str, RoadSegmentStatsDelta], data_graph_name: str) -> str:
+    """Merges batch deltas into the stored statistics server-side, so nothing has to be read back first."""
+    if not deltas:
+        return ''
+
+    graph_open = ignore_if_empty('GRAPH <{}> {{', data_graph_name)
+    graph_close = ignore_if_empty('}}', data_graph_name)
+
+    stats_values = ' '.join(
+        f"({d.road_segment.IRI} {d.stats_IRI} {d.traversal_count} {d.speed_sample_count} {d.speed_sum} "
+        f"{d.overspeed_count} {d.max_speed if d.max_speed is not None else 'UNDEF'})"
+        for d in deltas.values()
+    )
+
+    def_stats = (
+        f"{declare_prefixes(TRIP, OWL)} "
+        "DELETE { "
+            f"{graph_open} "
+                f"?stats {TRIP.abbr}:traversalCount ?oldTraversalCount ; "
+                    f"{TRIP.abbr}:speedSampleCount ?oldSpeedSampleCount ; "
+                    f"{TRIP.abbr}:speedSum ?oldSpeedSum ; "
+                    f"{TRIP.abbr}:overspeedCount ?oldOverspeedCount ; "
+                    f"{TRIP.abbr}:hasAvgSpeed ?oldAvgSpeed ; "
+                    f"{TRIP.abbr}:hasMaxSpeed ?oldMaxSpeed . "
+            f"{graph_close} "
+        "} "
+        "INSERT { "
+            f"{graph_open} "
+                f"?roadSegment {TRIP.abbr}:hasStatistics ?stats . "
+                f"?stats a {TRIP.abbr}:RoadSegmentStatistics, {OWL.abbr}:NamedIndividual ; "
+                    f"{TRIP.abbr}:traversalCount ?traversalCount ; "
+                    f"{TRIP.abbr}:speedSampleCount ?speedSampleCount ; "
+                    f"{TRIP.abbr}:speedSum ?speedSum ; "
+                    f"{TRIP.abbr}:overspeedCount ?overspeedCount ; "
+                    f"{TRIP.abbr}:hasAvgSpeed ?avgSpeed ; "
+                    f"{TRIP.abbr}:hasMaxSpeed ?maxSpeed . "
+            f"{graph_close} "
+        "} "
+        "WHERE { "
+            "VALUES (?roadSegment ?stats ?dTraversalCount ?dSpeedSampleCount ?dSpeedSum ?dOverspeedCount ?dMaxSpeed) { "
+                f"{stats_values} "
+            "} "
+            f"OPTIONAL {{ {graph_open} "
+                f"?stats {TRIP.abbr}:traversalCount ?oldTraversalCount ; "
+                    f"{TRIP.abbr}:speedSampleCount ?oldSpeedSampleCount ; "
+                    f"{TRIP.abbr}:speedSum ?oldSpeedSum ; "
+                    f"{TRIP.abbr}:overspeedCount ?oldOverspeedCount . "
+            f"{graph_close} }} "
+            f"OPTIONAL {{ {graph_open} ?stats {TRIP.abbr}:hasAvgSpeed ?oldAvgSpeed . {graph_close} }} "
+            f"OPTIONAL {{ {graph_open} ?stats {TRIP.abbr}:hasMaxSpeed ?oldMaxSpeed . {graph_close} }} "
+            "BIND(COALESCE(?oldTraversalCount, 0) + ?dTraversalCount AS ?traversalCount) "
+            "BIND(COALESCE(?oldSpeedSampleCount, 0) + ?dSpeedSampleCount AS ?speedSampleCount) "
+            "BIND(COALESCE(?oldSpeedSum, 0) + ?dSpeedSum AS ?speedSum) "
+            "BIND(COALESCE(?oldOverspeedCount, 0) + ?dOverspeedCount AS ?overspeedCount) "
+            # stays unbound, i.e. is not written, while there are no speed samples
+            "BIND(?speedSum / ?speedSampleCount AS ?avgSpeed) "
+            "BIND(IF(BOUND(?oldMaxSpeed) && (!BOUND(?dMaxSpeed) || (?oldMaxSpeed > ?dMaxSpeed)), ?oldMaxSpeed, ?dMaxSpeed) AS ?maxSpeed) "
+        "}"
+    )
+
+    l1_label_counts_values = ' '.join(
+        f"({d.stats_IRI} {d.l1_label_count_IRI(l1l)} {TRIP.abbr}:{l1l} {quantity})"
+        for d in deltas.values()
+        for l1l, quantity in sorted(d.l1_label_counts.items())
+    )
+
+    if not l1_label_counts_values:
+        return def_stats
+
+    def_l1_label_counts = (
+        f"{declare_prefixes(TRIP, OWL)} "
+        "DELETE { "
+            f"{graph_open} ?l1LabelCount {TRIP.abbr}:ofQuantity ?oldQuantity . {graph_close} "
+        "} "
+        "INSERT { "
+            f"{graph_open} "
+                f"?stats {TRIP.abbr}:hasL1LabelCount ?l1LabelCount . "
+                f"?l1LabelCount a {TRIP.abbr}:L1LabelCount, {OWL.abbr}:NamedIndividual ; "
+                    f"{TRIP.abbr}:ofL1Label ?l1Label ; "
+                    f"{TRIP.abbr}:ofQuantity ?quantity . "
+            f"{graph_close} "
+        "} "
+        "WHERE { "
+            "VALUES (?stats ?l1LabelCount ?l1Label ?dQuantity) { "
+                f"{l1_label_counts_values} "
+            "} "
+            f"OPTIONAL {{ {graph_open} ?l1LabelCount {TRIP.abbr}:ofQuantity ?oldQuantity . {graph_close} }} "
+            "BIND(COALESCE(?oldQuantity, 0) + ?dQuantity AS ?quantity) "
+        "}"
+    )
+
+    return f"{def_stats} ; {def_l1_label_counts}"
@@ -0,0 +1,164 @@
+import gzip
+import heapq
+import json
+import logging
+import os
+
+from datetime import datetime
+
+from typing import Dict, Iterator, List, Optional
+
+from utils.date import to_utc
+from utils.timer import create_elapsed_timer_str
+
+from .extraction import TripSource, is_after
+from .records import TripRecord
+
+
+class SnapshotStore:
+    """Local append-only copy of extracted trips.
+
+    Every batch is one gzipped JSON lines file, the manifest lists files together with the kind of the load
+    which wrote them and the range of trips each of them holds. Files of `SYNC` follow each other in
+    (write_date, trip_id) order, trips of a sync which are already in the snapshot are not written again.
+    Files of `BACKFILL` and `REPAIR` hold older trips or trips reloaded from Neo4j, they are merged into the
+    order on replay, where a trip is replayed from the latest written file holding it.
+    """
+
+    MANIFEST_FILE = 'manifest.json'
+
+    SYNC = 'sync'
+    BACKFILL = 'backfill'
+    REPAIR = 'repair'
+
+    def __init__(self, snapshot_dir: str):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.snapshot_dir = snapshot_dir
+
+        os.makedirs(snapshot_dir, exist_ok=True)
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.snapshot_dir, self.MANIFEST_FILE)
+
+    def _read_manifest(self) -> List[dict]:
+        if not os.path.exists(self._manifest_path()):
+            return []
+
+        with open(self._manifest_path(), 'rt') as f:
+            return json.load(f)['files']
+
+    def _write_manifest(self, files: List[dict]):
+        tmp_path = self._manifest_path() + '.tmp'
+
+        with open(tmp_path, 'wt') as f:
+            json.dump({'files': files}, f, indent=2)
+
+        os.replace(tmp_path, self._manifest_path())
+
+    def write_batch(self, trips: List[TripRecord], kind: str = SYNC) -> None:
+        files = self._read_manifest()
+        sync_files = [entry for entry in files if entry.get('kind', self.SYNC) == self.SYNC]
+
+        if (kind == self.SYNC) and sync_files:
+            # trips which are already in the snapshot, e.g. when a fresh repository is loaded from Neo4j again
+            last_write_date, last_trip_id = to_utc(sync_files[-1]['last_write_date']), sync_files[-1]['last_trip_id']
+            trips = [t for t in trips if is_after(t, last_write_date, last_trip_id)]
+        elif kind != self.SYNC:
+            # replay merges the files by (write_date, trip_id)
+            trips = sorted(trips, key=lambda t: (t.write_date, t.trip_id))
+
+        if not trips:
+            return
+
+        sw = create_elapsed_timer_str('sec')
+
+        file_name = (
+            f"{len(files):06d}_"
+            f"{trips[0].write_date.strftime('%Y%m%dT%H%M%S%f')}_"
+            f"{trips[-1].write_date.strftime('%Y%m%dT%H%M%S%f')}.jsonl.gz"
+        )
+
+        with gzip.open(os.path.join(self.snapshot_dir, file_name), 'wt', encoding='utf-8') as f:
+            for trip in trips:
+                f.write(json.dumps(trip.to_dict()))
+                f.write('\n')
+
+        files.append({
+            'file': file_name,
+            'first_write_date': trips[0].write_date.isoformat(),
+            'first_trip_id': trips[0].trip_id,
+            'last_write_date': trips[-1].write_date.isoformat(),
+            'last_trip_id': trips[-1].trip_id,
+            'trips_count': len(trips),
+            'kind': kind
+        })
+
+        self._write_manifest(files)
+
+        self.logger.info('Wrote %s trips of %s into snapshot file %s in %s', len(trips), kind, file_name, sw())
+
+    def _read_file(self, entry: dict, position: int) -> Iterator[tuple]:
+        with gzip.open(os.path.join(self.snapshot_dir, entry['file']), 'rt', encoding='utf-8') as f:
+            for line in f:
+                trip = TripRecord.from_dict(json.loads(line))
+                yield trip.write_date, trip.trip_id, -position, trip
+
+    def read_trips(self, after_write_date: Optional[datetime], after_trip_id: Optional[str]) -> Iterator[TripRecord]:
+        manifest = list(enumerate(self._read_manifest()))
+
+        # trips in the snapshot more than once are replayed from the latest written file, a repaired trip
+        # can have another write_date than its older copy, so copies are not necessarily next to each other
+        latest_positions = {}  # type: Dict[str, int]
+
+        for position, entry in manifest:
+            if entry.get('kind', self.SYNC) != self.SYNC:
+                for _, trip_id, _, _ in self._read_file(entry, position):
+                    latest_positions[trip_id] = position
+
+        sync_files, other_files = [], []
+
+        for position, entry in manifest:
+            last_write_date, last_trip_id = to_utc(entry['last_write_date']), entry['last_trip_id']
+
+            if (after_write_date is not None) and \
+                    ((last_write_date, last_trip_id) <= (after_write_date, after_trip_id)):
+                continue
+
+            if entry.get('kind', self.SYNC) == self.SYNC:
+                sync_files.append(self._read_file(entry, position))
+            else:
+                other_files.append(self._read_file(entry, position))
+
+        # sync files do not overlap and are in order, so they are read one after another
+        sync_trips = (item for sync_file in sync_files for item in sync_file)
+
+        for _, trip_id, negative_position, trip in heapq.merge(sync_trips, *other_files, key=lambda item: item[:3]):
+            if latest_positions.get(trip_id, -negative_position) != -negative_position:
+                continue
+
+            if is_after(trip, after_write_date, after_trip_id):
+                yield trip
+
+
+class SnapshotTripSource(TripSource):
+    """Replays trips from a SnapshotStore instead of Neo4j."""
+
+    def __init__(self, snapshot_store: SnapshotStore):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.snapshot_store = snapshot_store
+
+    def iter_batches(self,
+                     after_write_date: Optional[datetime],
+                     after_trip_id: Optional[str],
+                     batch_size: int) -> Iterator[List[TripRecord]]:
+        trips_batch = []  # type: List[TripRecord]
+
+        for trip in self.snapshot_store.read_trips(after_write_date, after_trip_id):
+            trips_batch.append(trip)
+
+            if (batch_size > 0) and (len(trips_batch) >= batch_size):
+                yield trips_batch
+                trips_batch = []
+
+        if trips_batch:
+            yield trips_batch
@@ -0,0 +1,118 @@
+import math
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .autology import GeoPoint
+
+
+METERS_PER_LAT_DEGREE = 110540
+METERS_PER_LON_DEGREE_AT_EQUATOR = 111320
+
+
+class NodeSnapIndex:
+    """Grid hash of canonical junction points.
+
+    Points within `tolerance_meters` of an already known point are snapped to it, so float noise
+    between segments sharing a junction does not produce distinct nodes. Cells are `tolerance_meters` wide,
+    thus a match can only be in the cell of the point or in one of its 8 neighbours.
+
+    Points which are already known elsewhere, e.g. nodes in the repository, are seeded lazily for the cells
+    around the points about to be snapped, see `get_unseeded_areas` and `seed`.
+    """
+
+    def __init__(self, tolerance_meters: float):
+        assert tolerance_meters > 0
+
+        self.tolerance_meters = tolerance_meters
+        self.cells = {}  # type: Dict[Tuple[int, int], List[GeoPoint]]
+        self.seeded_cells = set()  # type: Set[Tuple[int, int]]
+
+    def __len__(self):
+        return sum(len(points) for points in self.cells.values())
+
+    @staticmethod
+    def _to_meters(point: GeoPoint) -> Tuple[float, float]:
+        # equirectangular projection, accurate enough at tolerance distances
+        latitude, longitude = float(point.latitude), float(point.longitude)
+        return (
+            longitude * METERS_PER_LON_DEGREE_AT_EQUATOR * math.cos(math.radians(latitude)),
+            latitude * METERS_PER_LAT_DEGREE
+        )
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return int(math.floor(x / self.tolerance_meters)), int(math.floor(y / self.tolerance_meters))
+
+    def _neighbourhood(self, point: GeoPoint) -> Set[Tuple[int, int]]:
+        cx, cy = self._cell(*self._to_meters(point))
+        return {(cx + dx, cy + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)}
+
+    def get_unseeded_areas(self,
+                           points: Iterable[GeoPoint],
+                           tile_cells: int = 256) -> Tuple[Set[Tuple[int, int]], List[Tuple[float, float, float, float]]]:
+        """Returns cells around the points which were not seeded yet and (min latitude, max latitude,
+        min longitude, max longitude) boxes covering them, one per `tile_cells` wide tile of the points.
+        """
+        unseeded_cells = set()  # type: Set[Tuple[int, int]]
+        tiles = {}  # type: Dict[Tuple[int, int], List[float]]
+
+        for point in points:
+            cells = self._neighbourhood(point) - self.seeded_cells
+            if not cells:
+                continue
+
+            unseeded_cells.update(cells)
+
+            latitude, longitude = float(point.latitude), float(point.longitude)
+            cx, cy = self._cell(*self._to_meters(point))
+            tile = tiles.setdefault((cx // tile_cells, cy // tile_cells), [latitude, latitude, longitude, longitude, 0])
+            tile[0], tile[1] = min(tile[0], latitude), max(tile[1], latitude)
+            tile[2], tile[3] = min(tile[2], longitude), max(tile[3], longitude)
+            tile[4] = max(tile[4], abs(latitude))
+
+        boxes = []
+
+        for min_lat, max_lat, min_lon, max_lon, max_abs_lat in tiles.values():
+            # neighbour cells end at most 2 cells away from a point, one more cell absorbs the projection error
+            lat_margin = 3 * self.tolerance_meters / METERS_PER_LAT_DEGREE
+            lon_margin = 3 * self.tolerance_meters / (METERS_PER_LON_DEGREE_AT_EQUATOR * max(math.cos(math.radians(max_abs_lat)), 1e-6))
+            boxes.append((min_lat - lat_margin, max_lat + lat_margin, min_lon - lon_margin, max_lon + lon_margin))
+
+        return unseeded_cells, boxes
+
+    def seed(self, cells: Set[Tuple[int, int]], known_points: Iterable[GeoPoint]) -> None:
+        """Adds the known points in `cells`, e.g. read from the boxes of `get_unseeded_areas`, others are ignored."""
+        for point in known_points:
+            if self._cell(*self._to_meters(point)) in cells:
+                self.add(point)
+
+        self.seeded_cells.update(cells)
+
+    def find(self, point: GeoPoint) -> Optional[GeoPoint]:
+        x, y = self._to_meters(point)
+        cx, cy = self._cell(x, y)
+
+        nearest, nearest_distance = None, self.tolerance_meters
+
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for candidate in self.cells.get((cx + dx, cy + dy), ()):
+                    candidate_x, candidate_y = self._to_meters(candidate)
+                    distance = math.hypot(candidate_x - x, candidate_y - y)
+
+                    if distance <= nearest_distance:
+                        nearest, nearest_distance = candidate, distance
+
+        return nearest
+
+    def add(self, point: GeoPoint) -> None:
+        self.cells.setdefault(self._cell(*self._to_meters(point)), []).append(point)
+
+    def snap(self, point: GeoPoint) -> GeoPoint:
+        """Returns the canonical point for the given one, which becomes canonical itself when nothing is near."""
+        canonical = self.find(point)
+
+        if canonical is None:
+            self.add(point)
+            canonical = point
+
+        return canonical
@@ -0,0 +1,77 @@
+import numpy as np
+import pytz
+
+from datetime import datetime
+from functools import lru_cache
+
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+
+@lru_cache(maxsize=None)
+def get_zone_transitions(tz_id: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns UTC transition moments (`datetime64[us]`, ascending) and the UTC offsets in seconds
+    which are in effect starting from each transition for the given IANA timezone.
+    """
+    tz = pytz.timezone(tz_id)
+
+    utc_transition_times = getattr(tz, '_utc_transition_times', None)
+
+    if utc_transition_times:
+        transitions = np.array(utc_transition_times, dtype='datetime64[us]')
+        offsets = np.array([int(utcoffset.total_seconds()) for utcoffset, _, _ in tz._transition_info], dtype=np.int64)
+    else:
+        # static zones (UTC, Etc/GMT+N, ...) have the only offset
+        transitions = np.array([datetime.min], dtype='datetime64[us]')
+        offsets = np.array([int(tz.utcoffset(datetime.min).total_seconds())], dtype=np.int64)
+
+    return transitions, offsets
+
+
+def to_utc_datetime64(timestamps: Sequence[datetime]) -> np.ndarray:
+    return np.array([ts.astimezone(pytz.utc).replace(tzinfo=None) for ts in timestamps], dtype='datetime64[us]')
+
+
+def normalize_timestamps(timestamps: Sequence[datetime], tz_id: str) -> Tuple[List[str], List[int]]:
+    """Converts timestamps into UTC ISO strings and finds timezone offsets in seconds in one pass.
+
+    Offsets are looked up by the UTC moment itself, so local DST gaps and overlaps
+    can not make the result ambiguous.
+    """
+    if not timestamps:
+        return [], []
+
+    utc = to_utc_datetime64(timestamps)
+    transitions, offsets = get_zone_transitions(tz_id)
+
+    transition_idx = np.searchsorted(transitions, utc, side='right') - 1
+    tz_offsets = offsets[np.clip(transition_idx, 0, None)]
+
+    # keep datetime.isoformat() layout, i.e. omit microseconds when there are none
+    whole_seconds = (utc.astype(np.int64) % 1000000) == 0
+    utc_iso = np.where(
+        whole_seconds,
+        np.datetime_as_string(utc, unit='s'),
+        np.datetime_as_string(utc, unit='us')
+    )
+    utc_iso = np.char.add(utc_iso.astype(str), '+00:00')
+
+    return utc_iso.tolist(), tz_offsets.tolist()
+
+
+def normalize_moments(moments: Iterable[Tuple[datetime, str]]) -> Dict[Tuple[datetime, str], Tuple[str, int]]:
+    """Normalizes distinct (timestamp, timezone id) pairs doing one vectorized pass per timezone."""
+    timestamps_by_tz = {}  # type: Dict[str, Dict[datetime, None]]
+
+    for at, at_tz_id in moments:
+        timestamps_by_tz.setdefault(at_tz_id, {})[at] = None
+
+    normalized = {}  # type: Dict[Tuple[datetime, str], Tuple[str, int]]
+
+    for at_tz_id, timestamps in timestamps_by_tz.items():
+        timestamps = list(timestamps)
+        utc_iso, tz_offsets = normalize_timestamps(timestamps, at_tz_id)
+
+        for at, at_utc, at_tz_offset in zip(timestamps, utc_iso, tz_offsets):
+            normalized[(at, at_tz_id)] = (at_utc, at_tz_offset)
+
+    return normalized
@@ -80,12 +80,20 @@ class GraphDBApi:
             else:
                 return response
 
-    def query(self, sparql: str) -> dict:
-        response = self._do_authorized_call(
-            func=requests.get,
-            url=self.query_endpoint,
-            params={'query': sparql}
-        )
+    def query(self, sparql: str, post: bool = False) -> dict:
+        """`post` sends the query as a form, for queries too long for the URL."""
+        if post:
+            response = self._do_authorized_call(
+                func=requests.post,
+                url=self.query_endpoint,
+                data={'query': sparql}
+            )
+        else:
+            response = self._do_authorized_call(
+                func=requests.get,
+                url=self.query_endpoint,
+                params={'query': sparql}
+            )
 
         if response.status_code < 400:
             content_type_declarations = response.headers['Content-Type'].split(';')
@@ -0,0 +1,116 @@
+import logging
+import time
+
+import requests
+
+from .graphdb_api import GraphDBApi
+
+
+class GraphDBLatencyProbe(GraphDBApi):
+    """Measures how long a cheap query takes on the repository which serves QA traffic."""
+
+    def __init__(self, probe_query: str = 'ASK { ?s ?p ?o }', timeout_sec: float = 10, **kwargs):
+        super().__init__(**kwargs)
+
+        self.probe_query = probe_query
+        self.timeout_sec = timeout_sec
+
+    def measure_latency(self) -> float:
+        tic = time.perf_counter()
+
+        try:
+            response = self._do_authorized_call(
+                func=requests.get,
+                url=self.query_endpoint,
+                params={'query': self.probe_query},
+                timeout=self.timeout_sec
+            )
+        except Exception:
+            # saturated store times out, treat it the same way as the slowest possible answer
+            self.logger.warning('Latency probe failed on %s', self.repository_id, exc_info=True)
+            return self.timeout_sec
+
+        latency_sec = time.perf_counter() - tic
+
+        if response.status_code >= 400:
+            self.logger.warning('Latency probe got response [%s] from [%s]', response.text, response.url)
+
+        return latency_sec
+
+
+class LoadThrottle:
+    """Delays loader commits while probe latency is above the budget.
+
+    The delay grows by `backoff_factor` every time the budget is exceeded and shrinks by
+    `recovery_factor` every time it is not, dropping to zero below `min_delay_sec`.
+    Once the delay reaches `max_delay_sec` commits are paused until the probe gets back under the budget
+    or `max_pause_sec` passes.
+    """
+
+    def __init__(self,
+                 latency_probe: GraphDBLatencyProbe,
+                 latency_budget_sec: float,
+                 min_delay_sec: float = 1,
+                 max_delay_sec: float = 60,
+                 max_pause_sec: float = 600,
+                 backoff_factor: float = 2,
+                 recovery_factor: float = 0.5):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        assert backoff_factor > 1
+        assert 0 <= recovery_factor < 1
+
+        self.latency_probe = latency_probe
+        self.latency_budget_sec = latency_budget_sec
+        self.min_delay_sec = min_delay_sec
+        self.max_delay_sec = max_delay_sec
+        self.max_pause_sec = max_pause_sec
+        self.backoff_factor = backoff_factor
+        self.recovery_factor = recovery_factor
+        self.delay_sec = 0
+
+    def _adjust_delay(self, latency_sec: float) -> bool:
+        is_over_budget = latency_sec > self.latency_budget_sec
+
+        if is_over_budget:
+            self.delay_sec = min(self.max_delay_sec, max(self.min_delay_sec, self.delay_sec * self.backoff_factor))
+        else:
+            self.delay_sec = self.delay_sec * self.recovery_factor
+            if self.delay_sec < self.min_delay_sec:
+                self.delay_sec = 0
+
+        return is_over_budget
+
+    def wait(self) -> float:
+        """Blocks before the next commit, returns the number of seconds waited."""
+        waited_sec = 0
+
+        latency_sec = self.latency_probe.measure_latency()
+        self._adjust_delay(latency_sec)
+
+        if self.delay_sec > 0:
+            self.logger.info(
+                'Probe latency %.3f sec (budget %.3f sec), delaying commit by %.3f sec',
+                latency_sec, self.latency_budget_sec, self.delay_sec
+            )
+
+        while self.delay_sec > 0:
+            time.sleep(self.delay_sec)
+            waited_sec += self.delay_sec
+
+            if self.delay_sec < self.max_delay_sec:
+                break
+
+            if waited_sec >= self.max_pause_sec:
+                self.logger.warning('Commits were paused for %.3f sec, resuming anyway', waited_sec)
+                break
+
+            latency_sec = self.latency_probe.measure_latency()
+            is_over_budget = self._adjust_delay(latency_sec)
+
+            if not is_over_budget:
+                break
+
+            self.logger.info('Commits paused, probe latency %.3f sec', latency_sec)
+
+        return waited_sec
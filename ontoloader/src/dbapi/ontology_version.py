@@ -0,0 +1,30 @@
+from .prefixes import declare_prefixes, TRIP, OWL
+from utils.formatting import ignore_if_empty
+
+
+def bump_modification_count_SPARQL(data_graph_name: str) -> str:
+    """Increments `trp:modificationCount` of `trp:ontologyVersionInfo`.
+
+    Appended to every update transaction of the data graph, so readers can tell the data changed also when
+    `trp:latestTripID` and `trp:latestTripTS` stay, e.g. after backfills, repairs or migrations.
+    """
+    return (
+        f"{declare_prefixes(TRIP, OWL)} "
+        "DELETE { "
+            f"{ignore_if_empty('GRAPH <{}> {{', data_graph_name)} "
+                f"{TRIP.abbr}:ontologyVersionInfo {TRIP.abbr}:modificationCount ?count . "
+            f"{ignore_if_empty('}}', data_graph_name)} "
+        "} "
+        "INSERT { "
+            f"{ignore_if_empty('GRAPH <{}> {{', data_graph_name)} "
+                f"{TRIP.abbr}:ontologyVersionInfo a {OWL.abbr}:NamedIndividual ; "
+                    f"{TRIP.abbr}:modificationCount ?nextCount . "
+            f"{ignore_if_empty('}}', data_graph_name)} "
+        "} "
+        "WHERE { "
+            f"OPTIONAL {{ {ignore_if_empty('GRAPH <{}> {{', data_graph_name)} "
+                f"{TRIP.abbr}:ontologyVersionInfo {TRIP.abbr}:modificationCount ?count . "
+            f"{ignore_if_empty('}}', data_graph_name)} }} "
+            "BIND(COALESCE(?count, 0) + 1 AS ?nextCount) "
+        "}"
+    )
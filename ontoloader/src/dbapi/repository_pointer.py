@@ -0,0 +1,113 @@
+import csv
+import io
+import json
+import logging
+import os
+
+from typing import Optional
+
+from .graphdb_api import GraphDBApi, GraphDBApiException
+from .prefixes import declare_prefixes, TRIP
+
+
+class ActiveRepository:
+    def __init__(self, repository_id: str, version: Optional[str] = None):
+        self._repository_id = repository_id
+        self._version = version
+
+    def __str__(self):
+        return f"(repository_id={self._repository_id}, version={self._version})"
+
+    @property
+    def repository_id(self):
+        return self._repository_id
+
+    @property
+    def version(self):
+        return self._version
+
+
+class RepositoryPointer:
+    """Names the repository which currently serves QA traffic and the loader version which built it."""
+
+    def get_active_repository(self) -> Optional[ActiveRepository]:
+        raise NotImplementedError()
+
+    def set_active_repository(self, active_repository: ActiveRepository) -> None:
+        raise NotImplementedError()
+
+
+class GraphDBRepositoryPointer(GraphDBApi, RepositoryPointer):
+    """Keeps the pointer document in a small dedicated repository, so that switching it is one atomic SPARQL update."""
+
+    def get_active_repository(self) -> Optional[ActiveRepository]:
+        query = (
+            f"{declare_prefixes(TRIP)} "
+            "SELECT ?repositoryID ?repositoryVersion "
+            "WHERE { "
+                f"{TRIP.abbr}:activeRepository {TRIP.abbr}:repositoryID ?repositoryID . "
+                f"OPTIONAL {{ {TRIP.abbr}:activeRepository {TRIP.abbr}:repositoryVersion ?repositoryVersion . }} "
+            "}"
+        )
+
+        result = self.query(sparql=query)
+
+        if result['format'] == 'text/csv':
+            reader = list(csv.DictReader(io.StringIO(result['result'])))
+            assert len(reader) < 2
+            if reader:
+                return ActiveRepository(
+                    repository_id=reader[0]['repositoryID'],
+                    version=reader[0]['repositoryVersion'] or None
+                )
+            else:
+                return None
+        else:
+            raise GraphDBApiException('Unexpected format ' + result['format'])
+
+    def set_active_repository(self, active_repository: ActiveRepository) -> None:
+        self.update(sparql=(
+            f"{declare_prefixes(TRIP)} "
+            "DELETE { "
+                f"{TRIP.abbr}:activeRepository {TRIP.abbr}:repositoryID ?repositoryID . "
+                f"{TRIP.abbr}:activeRepository {TRIP.abbr}:repositoryVersion ?repositoryVersion . "
+            "} "
+            "INSERT { "
+                f"{TRIP.abbr}:activeRepository {TRIP.abbr}:repositoryID \"{active_repository.repository_id}\" ; "
+                    f"{TRIP.abbr}:repositoryVersion \"{active_repository.version or ''}\" . "
+            "} "
+            "WHERE { "
+                f"OPTIONAL {{ {TRIP.abbr}:activeRepository {TRIP.abbr}:repositoryID ?repositoryID . }} "
+                f"OPTIONAL {{ {TRIP.abbr}:activeRepository {TRIP.abbr}:repositoryVersion ?repositoryVersion . }} "
+            "}"
+        ))
+
+        self.logger.info('Switched active repository to %s', active_repository)
+
+
+class FileRepositoryPointer(RepositoryPointer):
+    """Local stand-in for GraphDBRepositoryPointer, keeps the pointer document in a JSON file."""
+
+    def __init__(self, path: str):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.path = path
+
+    def get_active_repository(self) -> Optional[ActiveRepository]:
+        if not os.path.exists(self.path):
+            return None
+
+        with open(self.path, 'rt') as f:
+            pointer = json.load(f)
+
+        return ActiveRepository(repository_id=pointer['repository_id'], version=pointer.get('version', None))
+
+    def set_active_repository(self, active_repository: ActiveRepository) -> None:
+        tmp_path = self.path + '.tmp'
+
+        with open(tmp_path, 'wt') as f:
+            json.dump({'repository_id': active_repository.repository_id, 'version': active_repository.version}, f)
+
+        # rename is atomic, readers see either the old or the new pointer
+        os.replace(tmp_path, self.path)
+
+        self.logger.info('Switched active repository to %s', active_repository)
@@ -1,3 +1,4 @@
+import re
 import requests
 
 from dbapi.graphdb_api import GraphDBApi, GraphDBApiException, GraphDBUpdateException
@@ -28,16 +29,74 @@ class DbUpdater(GraphDBApi):
         pass
 
     def create_ontology(self, statements_path: str):
-        pass
+        self.logger.info('Loading ontology %s into repository %s', statements_path, self.repository_id)
+
+        with open(statements_path, 'rb') as f:
+            response = self._do_authorized_call(
+                func=requests.post,
+                url=self.update_endpoint,
+                headers={'Content-Type': 'text/turtle'},
+                data=f.read()
+            )
+
+        if response.status_code >= 400:
+            self.logger.error(
+                'Failed to load ontology %s, got response [%s] from [%s]',
+                statements_path, response.text, response.url
+            )
+            raise GraphDBUpdateException(response.text)
+
+    def export_graph(self, graph_name: str) -> bytes:
+        response = self._do_authorized_call(
+            func=requests.get,
+            url=self.query_endpoint + '/rdf-graphs/service',
+            params={'graph': graph_name},
+            headers={'Accept': 'text/turtle'}
+        )
+
+        if response.status_code >= 400:
+            self.logger.error('Failed to export graph %s, got response [%s] from [%s]', graph_name, response.text, response.url)
+            raise GraphDBApiException(response.text)
+
+        return response.content
+
+    def import_graph(self, graph_name: str, statements: bytes):
+        response = self._do_authorized_call(
+            func=requests.post,
+            url=self.query_endpoint + '/rdf-graphs/service',
+            params={'graph': graph_name},
+            headers={'Content-Type': 'text/turtle'},
+            data=statements
+        )
+
+        if response.status_code >= 400:
+            self.logger.error('Failed to import graph %s, got response [%s] from [%s]', graph_name, response.text, response.url)
+            raise GraphDBUpdateException(response.text)
+
+    def repo_exists(self) -> bool:
+        response = self._do_authorized_call(
+            func=requests.get,
+            url=self.repo_ops_endpoint + f'/{self.repository_id}'
+        )
+
+        return response.status_code < 400
 
     def create_repo(self, repo_config_path: str, version: str):
         self.logger.info('Creating repository %s', repo_config_path)
 
         try:
+            with open(repo_config_path, 'rt') as f:
+                # the same config template is used for every repository, e.g. for blue/green shadow repositories
+                repo_config = re.sub(
+                    r'(rep:repositoryID\s+)"[^"]*"',
+                    lambda m: f'{m.group(1)}"{self.repository_id}"',
+                    f.read()
+                )
+
             response = self._do_authorized_call(
                 func=requests.post,
                 url=self.repo_ops_endpoint,
-                files=dict(config=open(repo_config_path, 'rb'))
+                files=dict(config=('repo-config.ttl', repo_config.encode('utf-8')))
             )
 
             if response.status_code < 400:
@@ -0,0 +1,224 @@
+import csv
+import io
+import os
+
+from datetime import datetime, timedelta
+from string import Template
+
+from typing import List, Optional, Tuple
+
+from dbapi.graphdb_api import GraphDBApi, GraphDBApiException
+from dbapi.ontology_version import bump_modification_count_SPARQL
+from dbapi.prefixes import declare_prefixes, TRIP, TIME, XSD, OWL, RDF, GEOSPARQL, SF
+from utils.date import to_utc
+from utils.formatting import ignore_if_empty
+from utils.timer import create_elapsed_timer_str
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+
+class Migration:
+    """SPARQL UPDATE script `migrations/<version>/<name>.rq`.
+
+    Scripts referring to `$since` and `$until` are applied to trips started in one chunk of days at a time,
+    others are applied at once. `$prefixes`, `$graph_open` and `$graph_close` are substituted as well.
+    """
+
+    def __init__(self, version: str, name: str, script: str):
+        self.version = version
+        self.name = name
+        self.script = Template(script)
+        self.is_chunked = ('$since' in script) and ('$until' in script)
+
+    @property
+    def migration_id(self):
+        return f'{self.version}/{self.name}'
+
+    def __str__(self):
+        return self.migration_id
+
+    def as_SPARQL(self, data_graph_name: str, since: Optional[datetime] = None, until: Optional[datetime] = None) -> str:
+        return self.script.substitute(
+            prefixes=declare_prefixes(TRIP, TIME, XSD, OWL, RDF, GEOSPARQL, SF),
+            graph_open=ignore_if_empty('GRAPH <{}> {{', data_graph_name),
+            graph_close=ignore_if_empty('}}', data_graph_name),
+            since=since.isoformat() if since else '',
+            until=until.isoformat() if until else ''
+        )
+
+
+def list_migrations(target_version: str, migrations_dir: str = MIGRATIONS_DIR) -> List[Migration]:
+    """Returns migrations of every version up to and including the target one, in the order they must be applied."""
+    def version_key(version: str):
+        return tuple(int(v) for v in version.split('.'))
+
+    migrations = []
+
+    for version in sorted(os.listdir(migrations_dir), key=version_key):
+        if version_key(version) > version_key(target_version):
+            continue
+
+        for file_name in sorted(os.listdir(os.path.join(migrations_dir, version))):
+            if file_name.endswith('.rq'):
+                with open(os.path.join(migrations_dir, version, file_name), 'rt') as f:
+                    migrations.append(Migration(version=version, name=file_name[:-len('.rq')], script=f.read()))
+
+    return migrations
+
+
+class MigrationEngine(GraphDBApi):
+    """Applies migrations in place, chunk by chunk.
+
+    Every chunk is committed in one transaction together with its progress record, kept in the repository
+    next to the ontology version info, so an interrupted migration resumes after the last committed chunk.
+    """
+
+    def __init__(self, data_graph_name: str, chunk_days: int = 7, **kwargs):
+        super().__init__(**kwargs)
+
+        assert chunk_days > 0
+
+        self.data_graph_name = data_graph_name
+        self.chunk_days = chunk_days
+
+    def migrate(self, target_version: str):
+        sw = create_elapsed_timer_str('sec')
+
+        migrations = list_migrations(target_version)
+        trips_period = self._get_trips_period()
+
+        self.logger.info('Migrating repository %s to %s with %s migrations', self.repository_id, target_version, len(migrations))
+
+        for migration in migrations:
+            completed, completed_until = self._get_progress(migration)
+
+            if completed:
+                self.logger.info('Migration %s is already applied', migration)
+                continue
+
+            if migration.is_chunked:
+                self._apply_chunked(migration, trips_period, completed_until)
+            else:
+                self._apply(migration, since=None, until=None, completed=True)
+
+        self.logger.info('Migrated repository %s to %s in %s', self.repository_id, target_version, sw())
+
+    def _apply_chunked(self, migration: Migration, trips_period: Optional[Tuple[datetime, datetime]], completed_until: Optional[datetime]):
+        if trips_period is None:
+            self._apply(migration, since=None, until=None, completed=True, sparql='')
+            return
+
+        first_day = trips_period[0].replace(hour=0, minute=0, second=0, microsecond=0)
+        last_ts = trips_period[1]
+
+        since = completed_until if completed_until else first_day
+
+        if completed_until:
+            self.logger.info('Resuming migration %s from %s', migration, completed_until)
+
+        while since <= last_ts:
+            until = since + timedelta(days=self.chunk_days)
+            self._apply(migration, since=since, until=until, completed=(until > last_ts))
+            since = until
+
+    def _apply(self,
+               migration: Migration,
+               since: Optional[datetime],
+               until: Optional[datetime],
+               completed: bool,
+               sparql: Optional[str] = None):
+        sw = create_elapsed_timer_str('sec')
+
+        if sparql is None:
+            sparql = migration.as_SPARQL(self.data_graph_name, since=since, until=until)
+
+        progress_sparql = self._set_progress_sparql(migration, completed=completed, completed_until=until)
+
+        if sparql:
+            sparql = f'{sparql} ; {progress_sparql} ; {bump_modification_count_SPARQL(self.data_graph_name)}'
+        else:
+            sparql = progress_sparql
+
+        self.update_in_transaction(sparql=sparql)
+
+        if since is not None:
+            self.logger.info('Applied migration %s to trips started in [%s, %s) in %s', migration, since, until, sw())
+        else:
+            self.logger.info('Applied migration %s in %s', migration, sw())
+
+    def _get_trips_period(self) -> Optional[Tuple[datetime, datetime]]:
+        query = (
+            f"{declare_prefixes(TRIP, TIME)} "
+            "SELECT (MIN(?ts) AS ?firstTS) (MAX(?ts) AS ?lastTS) "
+            "WHERE { "
+                f"{ignore_if_empty('GRAPH <{}> {{', self.data_graph_name)} "
+                    f"?trip a {TRIP.abbr}:Trip ; "
+                        f"{TIME.abbr}:hasBeginning/{TRIP.abbr}:hasTimestamp ?ts . "
+                f"{ignore_if_empty('}}', self.data_graph_name)} "
+            "}"
+        )
+
+        rows = self._query_csv(query)
+
+        if rows and rows[0]['firstTS']:
+            return to_utc(rows[0]['firstTS']), to_utc(rows[0]['lastTS'])
+        else:
+            return None
+
+    def _progress_IRI(self, migration: Migration) -> str:
+        return f"{TRIP.abbr}:migration_{migration.version.replace('.', '_')}_{migration.name}"
+
+    def _get_progress(self, migration: Migration) -> Tuple[bool, Optional[datetime]]:
+        query = (
+            f"{declare_prefixes(TRIP)} "
+            "SELECT ?completed ?completedUntil "
+            "WHERE { "
+                f"{ignore_if_empty('GRAPH <{}> {{', self.data_graph_name)} "
+                    f"{self._progress_IRI(migration)} {TRIP.abbr}:migrationCompleted ?completed . "
+                    f"OPTIONAL {{ {self._progress_IRI(migration)} {TRIP.abbr}:migrationCompletedUntil ?completedUntil . }} "
+                f"{ignore_if_empty('}}', self.data_graph_name)} "
+            "}"
+        )
+
+        rows = self._query_csv(query)
+
+        if not rows:
+            return False, None
+
+        return rows[0]['completed'] == 'true', to_utc(rows[0]['completedUntil']) if rows[0]['completedUntil'] else None
+
+    def _set_progress_sparql(self, migration: Migration, completed: bool, completed_until: Optional[datetime]) -> str:
+        progress_IRI = self._progress_IRI(migration)
+
+        def_completed_until = (
+            f'{TRIP.abbr}:migrationCompletedUntil "{completed_until.isoformat()}"^^{XSD.abbr}:dateTime ; '
+        ) if completed_until else ''
+
+        return (
+            f"{declare_prefixes(TRIP, XSD, OWL)} "
+            "DELETE { "
+                f"{ignore_if_empty('GRAPH <{}> {{', self.data_graph_name)} "
+                    f"{progress_IRI} ?p ?o . "
+                f"{ignore_if_empty('}}', self.data_graph_name)} "
+            "} "
+            "INSERT { "
+                f"{ignore_if_empty('GRAPH <{}> {{', self.data_graph_name)} "
+                    f"{progress_IRI} a {OWL.abbr}:NamedIndividual ; "
+                        f'{TRIP.abbr}:migrationID "{migration.migration_id}" ; '
+                        f"{def_completed_until}"
+                        f"{TRIP.abbr}:migrationCompleted {'true' if completed else 'false'} . "
+                f"{ignore_if_empty('}}', self.data_graph_name)} "
+            "} "
+            "WHERE { "
+                f"OPTIONAL {{ {ignore_if_empty('GRAPH <{}> {{', self.data_graph_name)} {progress_IRI} ?p ?o . {ignore_if_empty('}}', self.data_graph_name)} }} "
+            "}"
+        )
+
+    def _query_csv(self, query: str) -> List[dict]:
+        result = self.query(sparql=query)
+
+        if result['format'] == 'text/csv':
+            return list(csv.DictReader(io.StringIO(result['result'])))
+        else:
+            raise GraphDBApiException('Unexpected format ' + result['format'])
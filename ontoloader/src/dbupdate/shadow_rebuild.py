@@ -0,0 +1,110 @@
+import logging
+import time
+
+from typing import Callable, List, Optional
+
+from dataimport.load_new_knowledge import DataLoader
+from dbapi.repository_pointer import ActiveRepository, RepositoryPointer
+from utils.timer import create_elapsed_timer_str
+
+from .db_update import DbUpdater
+
+
+class ShadowRebuildException(Exception):
+    pass
+
+
+class ShadowRebuild:
+    """Blue/green rebuild: loads everything into the repository which is not active,
+    verifies it against Neo4j and only then switches the repository pointer to it.
+    QA traffic keeps using the active repository until the switch.
+
+    Preserved graphs, e.g. asked questions stored by the QA webapi, are copied before the switch and again after
+    `recopy_delay_sec`, by which the QA webapi follows the pointer. Graphs are copied by adding statements, so
+    the second copy only adds the ones written into the previously active repository meanwhile.
+    """
+
+    def __init__(self,
+                 repository_pointer: RepositoryPointer,
+                 repository_ids: List[str],
+                 create_updater: Callable[[str], DbUpdater],
+                 create_loader: Callable[[str], DataLoader],
+                 preserved_graphs: Optional[List[str]] = None,
+                 recopy_delay_sec: float = 60):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        if len(set(repository_ids)) < 2:
+            raise ShadowRebuildException(f'At least two repositories are required, got {repository_ids}')
+
+        self.repository_pointer = repository_pointer
+        self.repository_ids = repository_ids
+        self.create_updater = create_updater
+        self.create_loader = create_loader
+        self.preserved_graphs = preserved_graphs if preserved_graphs else []
+        self.recopy_delay_sec = recopy_delay_sec
+
+    def is_rebuild_required(self, version: str) -> bool:
+        active_repository = self.repository_pointer.get_active_repository()
+        return (active_repository is None) or (active_repository.version != version)
+
+    def rebuild(self, repo_config_path: str, ontology_path: str, version: str) -> ActiveRepository:
+        sw = create_elapsed_timer_str('sec')
+
+        active_repository = self.repository_pointer.get_active_repository()
+        active_repository_id = active_repository.repository_id if active_repository else None
+        shadow_repository_id = next(r for r in self.repository_ids if r != active_repository_id)
+
+        self.logger.info('Rebuilding shadow repository %s, active repository is %s', shadow_repository_id, active_repository)
+
+        shadow_updater = self.create_updater(shadow_repository_id)
+        shadow_updater.delete_repo()
+        shadow_updater.create_repo(repo_config_path=repo_config_path, version=version)
+
+        if not shadow_updater.repo_exists():
+            raise ShadowRebuildException(f'Can not create shadow repository {shadow_repository_id}')
+
+        shadow_updater.create_ontology(statements_path=ontology_path)
+
+        shadow_loader = self.create_loader(shadow_repository_id)
+        shadow_loader.sync()
+
+        self._verify(shadow_loader)
+
+        if active_repository_id:
+            self._copy_preserved_graphs(self.create_updater(active_repository_id), shadow_updater)
+
+        shadow_repository = ActiveRepository(repository_id=shadow_repository_id, version=version)
+        self.repository_pointer.set_active_repository(shadow_repository)
+
+        if active_repository_id and self.preserved_graphs:
+            time.sleep(self.recopy_delay_sec)
+
+            try:
+                self._copy_preserved_graphs(self.create_updater(active_repository_id), shadow_updater)
+            except Exception:
+                # the new repository is already active, it only misses what was written during the switch
+                self.logger.exception('Can not copy preserved graphs again after switching to %s', shadow_repository)
+
+        self.logger.info('Rebuilt and activated repository %s in %s', shadow_repository, sw())
+
+        return shadow_repository
+
+    def _verify(self, shadow_loader: DataLoader):
+        ontology_version = shadow_loader.get_ontology_version()
+
+        loaded_trips = shadow_loader.count_loaded_trips()
+        # trips written to Neo4j while the shadow was loading are picked up by the next sync
+        source_trips = shadow_loader.count_source_trips(until=ontology_version.latest_write_date) if ontology_version else 0
+
+        if loaded_trips != source_trips:
+            raise ShadowRebuildException(
+                f'Shadow repository {shadow_loader.repository_id} has {loaded_trips} trips, '
+                f'but Neo4j has {source_trips} trips written until {ontology_version}'
+            )
+
+        self.logger.info('Verified shadow repository %s has all %s trips', shadow_loader.repository_id, loaded_trips)
+
+    def _copy_preserved_graphs(self, active_updater: DbUpdater, shadow_updater: DbUpdater):
+        for graph_name in self.preserved_graphs:
+            self.logger.info('Copying graph %s from %s into %s', graph_name, active_updater.repository_id, shadow_updater.repository_id)
+            shadow_updater.import_graph(graph_name, active_updater.export_graph(graph_name))
@@ -1,42 +1,174 @@
+import argparse
 import logging
 
+from typing import Optional, Tuple
+
 from config.config import CONFIGURATION
+from dataimport.columnar import ColumnarExport
+from dataimport.extraction import TripSource, Neo4jTripSource
 from dataimport.load_new_knowledge import DataLoader
+from dataimport.snapshot import SnapshotStore, SnapshotTripSource
+from dbapi.load_throttle import GraphDBLatencyProbe, LoadThrottle
+from dbapi.repository_pointer import RepositoryPointer, GraphDBRepositoryPointer, FileRepositoryPointer
 from dbupdate.db_update import DbUpdater
+from dbupdate.shadow_rebuild import ShadowRebuild
+from utils.profiling import StageProfiler
 from utils.timer import create_elapsed_timer_str
 
 
 logger = logging.getLogger(__name__)
 
 
-def run():
-    graphdb_cfg = dict(
+parser = argparse.ArgumentParser(description='Load trips written to Neo4j since the last sync into GraphDB.')
+parser.add_argument('--profile', type=str, default=None, metavar='DIR',
+                    help='write per batch cProfile and tracemalloc reports of loader stages into DIR')
+
+
+def create_repository_pointer(graphdb_cfg: dict) -> Optional[RepositoryPointer]:
+    shadow_rebuild_cfg = CONFIGURATION['GRAPHDB'].get('SHADOW_REBUILD', None)
+
+    if not shadow_rebuild_cfg:
+        return None
+    elif shadow_rebuild_cfg.get('POINTER_FILE', None):
+        return FileRepositoryPointer(path=shadow_rebuild_cfg['POINTER_FILE'])
+    else:
+        pointer_repository_id = shadow_rebuild_cfg['POINTER_REPOSITORY_ID']
+
+        if CONFIGURATION.get('DB_FRESH_UPDATE', False):
+            pointer_updater = DbUpdater(**dict(graphdb_cfg, repository_id=pointer_repository_id))
+            if not pointer_updater.repo_exists():
+                pointer_updater.create_repo(repo_config_path=str(CONFIGURATION['DB_REPOS_CONFIG']), version=CONFIGURATION['VERSION'])
+
+        return GraphDBRepositoryPointer(**dict(graphdb_cfg, repository_id=pointer_repository_id))
+
+
+def create_load_throttle(graphdb_cfg: dict, serving_repository_id: str) -> Optional[LoadThrottle]:
+    throttling_cfg = CONFIGURATION.get('LOAD_THROTTLING', None)
+
+    if not throttling_cfg:
+        return None
+
+    latency_probe = GraphDBLatencyProbe(
+        probe_query=throttling_cfg.get('PROBE_QUERY', 'ASK { ?s ?p ?o }'),
+        timeout_sec=throttling_cfg.get('PROBE_TIMEOUT_SEC', 10),
+        **dict(graphdb_cfg, repository_id=throttling_cfg.get('PROBE_REPOSITORY_ID', None) or serving_repository_id)
+    )
+
+    return LoadThrottle(
+        latency_probe=latency_probe,
+        latency_budget_sec=throttling_cfg['LATENCY_BUDGET_SEC'],
+        min_delay_sec=throttling_cfg.get('MIN_DELAY_SEC', 1),
+        max_delay_sec=throttling_cfg.get('MAX_DELAY_SEC', 60),
+        max_pause_sec=throttling_cfg.get('MAX_PAUSE_SEC', 600)
+    )
+
+
+def create_trip_source() -> Tuple[TripSource, Optional[SnapshotStore]]:
+    snapshot_cfg = CONFIGURATION.get('SNAPSHOT', None)
+
+    if not snapshot_cfg:
+        return Neo4jTripSource(neo4j_endpoint=CONFIGURATION['NEO4J_ENDPOINT']), None
+
+    snapshot_store = SnapshotStore(snapshot_dir=snapshot_cfg['DIR'])
+
+    if snapshot_cfg.get('REPLAY', False):
+        logger.info('Replaying trips from snapshot %s', snapshot_cfg['DIR'])
+        return SnapshotTripSource(snapshot_store=snapshot_store), None
+    else:
+        return Neo4jTripSource(neo4j_endpoint=CONFIGURATION['NEO4J_ENDPOINT']), snapshot_store
+
+
+def create_columnar_export() -> Optional[ColumnarExport]:
+    columnar_export_cfg = CONFIGURATION.get('COLUMNAR_EXPORT', None)
+
+    return ColumnarExport(export_dir=columnar_export_cfg['DIR']) if columnar_export_cfg else None
+
+
+def create_graphdb_cfg() -> dict:
+    return dict(
         graphdb_endpoint=CONFIGURATION['GRAPHDB']['ENDPOINT'],
         repository_id=CONFIGURATION['GRAPHDB']['REPOSITORY_ID'],
         username=CONFIGURATION['GRAPHDB']['USERNAME'],
         password=CONFIGURATION['GRAPHDB']['PASSWORD']
     )
 
-    if CONFIGURATION.get('DB_FRESH_UPDATE', False):
-        db_updater = DbUpdater(**graphdb_cfg)
-        # TODO finish DbUpdater
-        # db_updater.fresh_update(
-        #     repo_config_path=str(CONFIGURATION['DB_REPOS_CONFIG']),
-        #     version=CONFIGURATION['VERSION']
-        # )
-
-    load_new_knowledge = DataLoader(
-        data_graph_name=CONFIGURATION['GRAPHDB']['MAIN_TRIPS_DATA_GRAPH'],
-        batch_update_size=CONFIGURATION['BATCH_UPDATE_SIZE'],
-        neo4j_endpoint=CONFIGURATION['NEO4J_ENDPOINT'],
-        **graphdb_cfg
+
+def run(args):
+    graphdb_cfg = create_graphdb_cfg()
+    profiler = StageProfiler(profile_dir=args.profile)
+
+    trip_source, snapshot_store = create_trip_source()
+    columnar_export = create_columnar_export()
+
+    def create_loader(repository_id: str) -> DataLoader:
+        return DataLoader(
+            data_graph_name=CONFIGURATION['GRAPHDB']['MAIN_TRIPS_DATA_GRAPH'],
+            batch_update_size=CONFIGURATION['BATCH_UPDATE_SIZE'],
+            neo4j_endpoint=CONFIGURATION['NEO4J_ENDPOINT'],
+            trip_source=trip_source,
+            assert_event_types=CONFIGURATION.get('ASSERT_EVENT_TYPES', False),
+            node_snap_tolerance_meters=CONFIGURATION.get('NODE_SNAP_TOLERANCE_METERS', None),
+            rollup_road_segment_stats=CONFIGURATION.get('ROLLUP_ROAD_SEGMENT_STATS', False),
+            load_throttle=load_throttle,
+            snapshot_store=snapshot_store,
+            columnar_export=columnar_export,
+            profiler=profiler,
+            **dict(graphdb_cfg, repository_id=repository_id)
+        )
+
+    repository_pointer = create_repository_pointer(graphdb_cfg)
+    active_repository = repository_pointer.get_active_repository() if repository_pointer is not None else None
+
+    # always probe the repository which serves QA traffic, also while a shadow one is being loaded
+    load_throttle = create_load_throttle(
+        graphdb_cfg,
+        serving_repository_id=active_repository.repository_id if active_repository else graphdb_cfg['repository_id']
     )
 
+    if repository_pointer is not None:
+        shadow_rebuild = ShadowRebuild(
+            repository_pointer=repository_pointer,
+            repository_ids=CONFIGURATION['GRAPHDB']['SHADOW_REBUILD']['REPOSITORY_IDS'],
+            create_updater=lambda repository_id: DbUpdater(**dict(graphdb_cfg, repository_id=repository_id)),
+            create_loader=create_loader,
+            preserved_graphs=CONFIGURATION['GRAPHDB']['SHADOW_REBUILD'].get('PRESERVED_GRAPHS', None),
+            recopy_delay_sec=CONFIGURATION['GRAPHDB']['SHADOW_REBUILD'].get('RECOPY_DELAY_SEC', 60)
+        )
+
+        if CONFIGURATION.get('DB_FRESH_UPDATE', False) and shadow_rebuild.is_rebuild_required(CONFIGURATION['VERSION']):
+            sw = create_elapsed_timer_str('sec')
+
+            shadow_rebuild.rebuild(
+                repo_config_path=str(CONFIGURATION['DB_REPOS_CONFIG']),
+                ontology_path=str(CONFIGURATION['DB_ONTOLOGY_PTH']),
+                version=CONFIGURATION['VERSION']
+            )
+
+            profiler.finish()
+            logger.info('Finished shadow rebuild in %s', sw())
+            return
+
+        repository_id = active_repository.repository_id if active_repository else graphdb_cfg['repository_id']
+    else:
+        if CONFIGURATION.get('DB_FRESH_UPDATE', False):
+            db_updater = DbUpdater(**graphdb_cfg)
+            # TODO finish DbUpdater
+            # db_updater.fresh_update(
+            #     repo_config_path=str(CONFIGURATION['DB_REPOS_CONFIG']),
+            #     version=CONFIGURATION['VERSION']
+            # )
+
+        repository_id = graphdb_cfg['repository_id']
+
+    load_new_knowledge = create_loader(repository_id)
+
     sw = create_elapsed_timer_str('sec')
 
     load_new_knowledge.sync()
+    profiler.finish()
 
     logger.info('Finished sync in %s', sw())
 
 
-run()
+if __name__ == '__main__':
+    run(parser.parse_args())
@@ -0,0 +1,36 @@
+import argparse
+import logging
+
+from config.config import CONFIGURATION
+from dbupdate.migration import MigrationEngine
+from main import create_graphdb_cfg, create_repository_pointer
+
+
+logger = logging.getLogger(__name__)
+
+
+parser = argparse.ArgumentParser(description='Migrate loaded trips in place to a newer tripOnto version.')
+parser.add_argument('--target_version', type=str, required=True,
+                    help='tripOnto version, e.g. 0.0.2')
+parser.add_argument('--chunk_days', type=int, default=CONFIGURATION.get('MIGRATION_CHUNK_DAYS', 7),
+                    help='days of trips migrated in one transaction')
+
+
+def run(args):
+    graphdb_cfg = create_graphdb_cfg()
+
+    repository_pointer = create_repository_pointer(graphdb_cfg)
+    active_repository = repository_pointer.get_active_repository() if repository_pointer is not None else None
+    repository_id = active_repository.repository_id if active_repository else graphdb_cfg['repository_id']
+
+    migration_engine = MigrationEngine(
+        data_graph_name=CONFIGURATION['GRAPHDB']['MAIN_TRIPS_DATA_GRAPH'],
+        chunk_days=args.chunk_days,
+        **dict(graphdb_cfg, repository_id=repository_id)
+    )
+
+    migration_engine.migrate(target_version=args.target_version)
+
+
+if __name__ == '__main__':
+    run(parser.parse_args())
@@ -0,0 +1,64 @@
+import argparse
+import logging
+
+from config.config import CONFIGURATION
+from dataimport.extraction import Neo4jTripSource
+from dataimport.load_new_knowledge import DataLoader
+from dataimport.reconciliation import Reconciliation
+from dataimport.snapshot import SnapshotStore
+from main import create_columnar_export, create_graphdb_cfg, create_repository_pointer
+from utils.date import to_utc
+
+
+logger = logging.getLogger(__name__)
+
+
+parser = argparse.ArgumentParser(description='Compare trips started in [since, until) in Neo4j and GraphDB day by day.')
+parser.add_argument('--since', type=to_utc, required=True,
+                    help='ISO datetime, inclusive')
+parser.add_argument('--until', type=to_utc, required=True,
+                    help='ISO datetime, exclusive')
+parser.add_argument('--repair', action='store_true',
+                    help='load missing trips and reload stale ones')
+
+
+def run(args):
+    graphdb_cfg = create_graphdb_cfg()
+
+    repository_pointer = create_repository_pointer(graphdb_cfg)
+    active_repository = repository_pointer.get_active_repository() if repository_pointer is not None else None
+    repository_id = active_repository.repository_id if active_repository else graphdb_cfg['repository_id']
+
+    snapshot_cfg = CONFIGURATION.get('SNAPSHOT', None)
+    trip_source = Neo4jTripSource(neo4j_endpoint=CONFIGURATION['NEO4J_ENDPOINT'])
+
+    loader = DataLoader(
+        data_graph_name=CONFIGURATION['GRAPHDB']['MAIN_TRIPS_DATA_GRAPH'],
+        batch_update_size=CONFIGURATION['BATCH_UPDATE_SIZE'],
+        neo4j_endpoint=CONFIGURATION['NEO4J_ENDPOINT'],
+        trip_source=trip_source,
+        assert_event_types=CONFIGURATION.get('ASSERT_EVENT_TYPES', False),
+        node_snap_tolerance_meters=CONFIGURATION.get('NODE_SNAP_TOLERANCE_METERS', None),
+        rollup_road_segment_stats=CONFIGURATION.get('ROLLUP_ROAD_SEGMENT_STATS', False),
+        # repaired trips are kept in the snapshot too, so replays have them
+        snapshot_store=SnapshotStore(snapshot_dir=snapshot_cfg['DIR']) if snapshot_cfg else None,
+        columnar_export=create_columnar_export(),
+        **dict(graphdb_cfg, repository_id=repository_id)
+    )
+
+    reconciliation = Reconciliation(loader=loader, trip_source=trip_source)
+    report = reconciliation.reconcile(since=args.since, until=args.until)
+
+    if report.missing_trip_ids:
+        logger.info('Missing trips: %s', report.missing_trip_ids)
+    if report.stale_trip_ids:
+        logger.info('Stale trips: %s', report.stale_trip_ids)
+    if report.extra_trip_ids:
+        logger.info('Trips not in Neo4j: %s', report.extra_trip_ids)
+
+    if args.repair:
+        reconciliation.repair(report)
+
+
+if __name__ == '__main__':
+    run(parser.parse_args())
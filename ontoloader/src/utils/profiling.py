@@ -0,0 +1,103 @@
+import cProfile
+import logging
+import os
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+
+class StageProfiler:
+    """Profiles loader stages batch by batch.
+
+    For every stage of a batch it writes `batch_<n>_<stage>.prof` (cProfile stats, open them with snakeviz,
+    flameprof or gprof2dot) and `batch_<n>_<stage>.alloc.txt` (top allocation sites by tracemalloc),
+    `batch_<n>.txt` sums up stage times and traced memory. Without `profile_dir` stages are not profiled.
+    """
+
+    def __init__(self, profile_dir: Optional[str] = None, top_allocations: int = 25, traceback_frames: int = 10):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.profile_dir = profile_dir
+        self.top_allocations = top_allocations
+        self.batch_no = 0
+        self.stage_times = {}  # type: Dict[str, float]
+
+        if self.enabled:
+            os.makedirs(profile_dir, exist_ok=True)
+            tracemalloc.start(traceback_frames)
+            self.logger.info('Profiling loader stages into %s', profile_dir)
+
+    @property
+    def enabled(self) -> bool:
+        return self.profile_dir is not None
+
+    def start_batch(self) -> None:
+        if not self.enabled:
+            return
+
+        self._write_batch_summary()
+
+        self.batch_no += 1
+        self.stage_times = {}
+
+    def finish(self) -> None:
+        if not self.enabled:
+            return
+
+        self._write_batch_summary()
+        self.stage_times = {}
+        tracemalloc.stop()
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+
+        snapshot_before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        tic = time.perf_counter()
+
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+
+            self.stage_times[name] = self.stage_times.get(name, 0) + time.perf_counter() - tic
+
+            file_prefix = os.path.join(self.profile_dir, f'batch_{self.batch_no:06d}_{name}')
+            profile.dump_stats(file_prefix + '.prof')
+            self._write_allocations(file_prefix + '.alloc.txt', snapshot_before, tracemalloc.take_snapshot())
+
+    def _write_allocations(self, path: str, snapshot_before, snapshot_after) -> None:
+        snapshot_filters = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        )
+        stats = snapshot_after.filter_traces(snapshot_filters).compare_to(
+            snapshot_before.filter_traces(snapshot_filters), 'lineno'
+        )
+
+        with open(path, 'wt') as f:
+            for stat in stats[:self.top_allocations]:
+                f.write(f'{stat}\n')
+
+    def _write_batch_summary(self) -> None:
+        if not self.stage_times:
+            return
+
+        current, peak = tracemalloc.get_traced_memory()
+
+        with open(os.path.join(self.profile_dir, f'batch_{self.batch_no:06d}.txt'), 'wt') as f:
+            for name, elapsed in self.stage_times.items():
+                f.write(f'{name}: {elapsed:.3f} sec\n')
+            f.write(f'traced memory: {current / 2**20:.1f} MiB, peak so far {peak / 2**20:.1f} MiB\n')
+
+        self.logger.info(
+            'Profiled batch %s: %s',
+            self.batch_no,
+            ', '.join(f'{name} {elapsed:.3f} sec' for name, elapsed in self.stage_times.items())
+        )
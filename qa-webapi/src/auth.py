@@ -1,17 +1,85 @@
 import logging
 
-from requests.exceptions import HTTPError
+from requests.exceptions import HTTPError, RequestException
 from functools import wraps
 from flask import request
 from flask import current_app as app
 
 from utils import http
 from security.dms_client import authorize
+from security.jwks import JWKSException, JWKSKeyStore, LocalJwtVerifier
+from security.token_cache import TokenValidationCache
+
+from config.config import CONFIGURATION
 
 
 logger = logging.getLogger(__name__)
 
 
+DMS_TIMEOUT_SEC = CONFIGURATION['DMS'].get('TIMEOUT_SEC', 5)
+
+TOKEN_CACHE_CFG = CONFIGURATION['DMS'].get('TOKEN_CACHE', None) or {}
+
+TOKEN_CACHE = TokenValidationCache(
+    max_size=TOKEN_CACHE_CFG.get('MAX_SIZE', 10000),
+    max_ttl_sec=TOKEN_CACHE_CFG.get('MAX_TTL_SEC', 3600),
+    default_ttl_sec=TOKEN_CACHE_CFG.get('DEFAULT_TTL_SEC', 300),
+    negative_ttl_sec=TOKEN_CACHE_CFG.get('NEGATIVE_TTL_SEC', 30),
+    shared_cache_name=TOKEN_CACHE_CFG.get('UWSGI_CACHE', None)
+)
+
+
+LOCAL_JWT_CFG = CONFIGURATION['DMS'].get('LOCAL_JWT', None) or {}
+
+LOCAL_JWT_VERIFIER = LocalJwtVerifier(
+    key_store=JWKSKeyStore(
+        jwks_url=LOCAL_JWT_CFG['JWKS_URL'],
+        refresh_sec=LOCAL_JWT_CFG.get('JWKS_REFRESH_SEC', 3600),
+        timeout_sec=DMS_TIMEOUT_SEC
+    ),
+    algorithms=LOCAL_JWT_CFG.get('ALGORITHMS', ['RS256']),
+    audience=LOCAL_JWT_CFG.get('AUDIENCE', None),
+    issuer=LOCAL_JWT_CFG.get('ISSUER', None),
+    leeway_sec=LOCAL_JWT_CFG.get('LEEWAY_SEC', 0)
+) if LOCAL_JWT_CFG else None
+
+# 'fallback' asks DMS only for tokens which can not be verified locally,
+# 'always' asks DMS about locally valid tokens too (e.g. for revocation) unless it is not available
+REMOTE_VALIDATION = LOCAL_JWT_CFG.get('REMOTE_VALIDATION', 'fallback')
+
+
+def authenticate(jwt_token: str):
+    def validate_remotely():
+        return TOKEN_CACHE.get_or_validate(
+            jwt_token,
+            lambda: authorize(base_url=app.config['DMS']['ENDPOINT'], jwt_token=jwt_token, timeout_sec=DMS_TIMEOUT_SEC)
+        )
+
+    if LOCAL_JWT_VERIFIER is None:
+        return validate_remotely()
+
+    try:
+        claims = LOCAL_JWT_VERIFIER.verify(jwt_token)
+    except JWKSException:
+        if REMOTE_VALIDATION == 'never':
+            logger.warning('Can not verify token locally, signing key is not known')
+            return None
+
+        try:
+            return validate_remotely()
+        except RequestException:
+            logger.warning('DMS is not available, rejecting token which can not be verified locally', exc_info=True)
+            return None
+
+    if claims and (REMOTE_VALIDATION == 'always'):
+        try:
+            return validate_remotely()
+        except RequestException:
+            logger.warning('DMS is not available, accepting locally verified token', exc_info=True)
+
+    return claims
+
+
 def jwt_auth():
     def _jwt_auth(f):
         @wraps(f)
@@ -23,7 +91,7 @@ def jwt_auth():
                 try:
                     jwt_token = auth_header[len(auth_prefix):].strip()
 
-                    user = authorize(base_url=app.config['DMS']['ENDPOINT'], jwt_token=jwt_token)
+                    user = authenticate(jwt_token)
 
                     if not user:
                         return http.response_error_401()
@@ -49,3 +49,14 @@ if not os.environ.get(google_creds_var_name, None):
             os.environ[google_creds_var_name] = str(gcp_key_path)
         else:
             os.environ[google_creds_var_name] = str(Path(basedir) / gcp_key_path)
+
+
+dialogflow_cache_cfg = CONFIGURATION['DIALOGFLOW'].get('RESULT_CACHE', None)
+if dialogflow_cache_cfg and not Path(dialogflow_cache_cfg['AGENT_EXPORT']).is_absolute():
+    dialogflow_cache_cfg['AGENT_EXPORT'] = str(Path(basedir).parent / dialogflow_cache_cfg['AGENT_EXPORT'])
+
+local_classifier_cfg = CONFIGURATION['DIALOGFLOW'].get('LOCAL_CLASSIFIER', None)
+if local_classifier_cfg:
+    for path_key in ('MODEL', 'AGENT_EXPORT'):
+        if local_classifier_cfg.get(path_key, None) and not Path(local_classifier_cfg[path_key]).is_absolute():
+            local_classifier_cfg[path_key] = str(Path(basedir).parent / local_classifier_cfg[path_key])
@@ -0,0 +1,120 @@
+import logging
+import os
+import threading
+
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from utils.timer import create_elapsed_timer_str
+
+
+class DBColumnarApiException(Exception):
+    pass
+
+
+SPEED_GROUPS = {
+    'driver': 'ms.driver_id',
+    # start_time is TIMESTAMPTZ, its hour would follow the session TimeZone (the local one when ICU is loaded)
+    'hour': "EXTRACT(hour FROM timezone('UTC', ms.start_time))",
+    'day': 'CAST(ms.day AS VARCHAR)',
+    'segment': 'ms.segment_id'
+}
+
+
+class DBColumnarApi:
+    """Aggregate queries over the Parquet export of the loader, run in-process by DuckDB.
+
+    Trips reloaded by the loader are exported again, only rows of the latest export of every trip are used.
+    duckdb is only required when the export directory is configured.
+    """
+
+    def __init__(self, dataset_dir: str):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        import duckdb
+
+        self.dataset_dir = dataset_dir
+        self.connection = duckdb.connect(database=':memory:')
+        # one connection shared by request threads, each of them queries its own cursor
+        self._local = threading.local()
+
+    def latest_export_sql(self, dataset: str, day_criteria: str = '') -> str:
+        """Subquery over `trips` or `motion_steps`, files are globbed on every query, so new exports are visible at once.
+
+        `day_criteria` on the `day` partition column is applied before the ranking, so DuckDB skips other partitions.
+        """
+        path = os.path.join(self.dataset_dir, dataset, '*', '*.parquet').replace("'", "''")
+
+        return (
+            "SELECT * EXCLUDE (export_rank) FROM ( "
+                "SELECT *, DENSE_RANK() OVER (PARTITION BY trip_id ORDER BY exported_at DESC) AS export_rank "
+                f"FROM read_parquet('{path}', hive_partitioning = true, union_by_name = true) "
+                f"{'WHERE ' + day_criteria if day_criteria else ''} "
+            ") WHERE export_rank = 1"
+        )
+
+    def _cursor(self):
+        cursor = getattr(self._local, 'cursor', None)
+
+        if cursor is None:
+            cursor = self.connection.cursor()
+            self._local.cursor = cursor
+
+        return cursor
+
+    def query(self, sql: str, params: Optional[list] = None) -> List[dict]:
+        sw = create_elapsed_timer_str('sec')
+
+        try:
+            cursor = self._cursor().execute(sql, params or [])
+            columns = [d[0] for d in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except Exception as ex:
+            raise DBColumnarApiException(f'Columnar query failed: {ex}') from ex
+
+        self.logger.debug('Columnar query returned %s rows in %s', len(rows), sw())
+
+        return rows
+
+    def speed_distribution(self,
+                           group_by: str,
+                           since: Optional[datetime] = None,
+                           until: Optional[datetime] = None,
+                           driver_id: Optional[str] = None) -> List[dict]:
+        """Motion step speed statistics per driver, hour of day (UTC), day or road segment."""
+        if group_by not in SPEED_GROUPS:
+            raise DBColumnarApiException(f'Unknown speed group {group_by}, expected one of {sorted(SPEED_GROUPS)}')
+
+        day_criteria, day_params = [], []
+        criteria, params = [], []
+
+        # trips are partitioned by their start day, motion steps can go on past midnight
+        if since is not None:
+            day_criteria.append('day >= ?')
+            day_params.append(since.date() - timedelta(days=1))
+            criteria.append('ms.start_time >= ?')
+            params.append(since)
+        if until is not None:
+            day_criteria.append('day <= ?')
+            day_params.append(until.date())
+            criteria.append('ms.start_time < ?')
+            params.append(until)
+        if driver_id is not None:
+            criteria.append('ms.driver_id = ?')
+            params.append(driver_id)
+
+        sql = (
+            f"SELECT {SPEED_GROUPS[group_by]} AS group_key, "
+                "COUNT(*) AS motion_steps_count, "
+                "AVG(ms.avg_speed) AS avg_speed, "
+                "MAX(ms.max_speed) AS max_speed, "
+                "QUANTILE_CONT(ms.avg_speed, 0.5) AS median_speed, "
+                "QUANTILE_CONT(ms.avg_speed, 0.9) AS p90_speed, "
+                "COUNT(*) FILTER (WHERE ms.max_speed > ms.speed_limit) AS overspeed_count "
+            f"FROM ({self.latest_export_sql('motion_steps', ' AND '.join(day_criteria))}) ms "
+            f"{'WHERE ' + ' AND '.join(criteria) if criteria else ''} "
+            "GROUP BY group_key "
+            "ORDER BY group_key"
+        )
+
+        return self.query(sql, day_params + params)
@@ -0,0 +1,190 @@
+import codecs
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Iterator, Optional, Tuple
+
+from .data_version import DataVersionPoller
+from .db_sparql_api import DBSparqlApi
+
+
+class SparqlAnswerCache:
+    """Caches SPARQL query results until the loader commits changes.
+
+    Entries are keyed by the kind of the query (e.g. the intent class), the query text, which is built from the
+    intent parameters and the graph name, and the data version, see `DataVersionPoller`, which changes with
+    every loader transaction. `ttl_sec` only bounds the memory held by answers nobody asks for anymore.
+
+    Results are kept in a per process LRU of `max_size` items and, when the app runs under uwsgi with
+    `shared_cache_name` configured (see `cache2` in uwsgi.ini), in the uwsgi cache shared by all workers.
+    Results over `max_entry_bytes` are not cached.
+    """
+
+    def __init__(self,
+                 db_api: DBSparqlApi,
+                 data_version: DataVersionPoller,
+                 ttl_sec: float = 3600,
+                 max_size: int = 1000,
+                 max_entry_bytes: int = 1024 * 1024,
+                 shared_cache_name: Optional[str] = None):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.db_api = db_api
+        self.data_version = data_version
+        self.ttl_sec = ttl_sec
+        self.max_size = max_size
+        self.max_entry_bytes = max_entry_bytes
+
+        self._entries = OrderedDict()  # type: OrderedDict[str, Tuple[float, dict]]
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        self._uwsgi = None
+        self.shared_cache_name = shared_cache_name
+
+        if shared_cache_name:
+            try:
+                import uwsgi
+                self._uwsgi = uwsgi
+            except ImportError:
+                self.logger.warning('Not running under uwsgi, answer cache %s is not shared', shared_cache_name)
+
+    def _key(self, sparql: str, accept: str, kind: str) -> Optional[str]:
+        version = self.data_version.get_data_version()
+
+        if version is None:
+            return None
+
+        return hashlib.sha256(
+            json.dumps([kind, self.data_version.data_graph_name, version, accept, sparql]).encode('utf-8')
+        ).hexdigest()
+
+    def _get(self, key: str, now: float) -> Optional[dict]:
+        response = self._get_local(key, now)
+        if response is None:
+            response = self._get_shared(key, now)
+
+        if response is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        return response
+
+    def _put(self, key: str, now: float, response: dict):
+        if len(response['result']) <= self.max_entry_bytes:
+            self._put_local(key, now + self.ttl_sec, response)
+            self._put_shared(key, now + self.ttl_sec, response)
+
+    def query(self, sparql: str, accept: str = 'text/n3', kind: str = '') -> dict:
+        """Returns the result of `DBSparqlApi.query`, from the cache when the data did not change since."""
+        key = self._key(sparql, accept, kind)
+
+        if key is None:
+            return self.db_api.query(sparql=sparql, accept=accept)
+
+        now = time.time()
+        response = self._get(key, now)
+
+        if response is None:
+            response = self.db_api.query(sparql=sparql, accept=accept)
+            self._put(key, now, response)
+
+        return response
+
+    def query_stream(self, sparql: str, accept: str = 'text/n3', kind: str = '') -> Iterator[bytes]:
+        """Yields the result as `DBSparqlApi.query_stream`, results which fit into `max_entry_bytes` are cached."""
+        key = self._key(sparql, accept, kind)
+
+        if key is None:
+            yield from self.db_api.query_stream(sparql=sparql, accept=accept)
+            return
+
+        now = time.time()
+        response = self._get(key, now)
+
+        if response is not None:
+            yield response['result'].encode('utf-8')
+            return
+
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        parts = []
+        size = 0
+
+        for chunk in self.db_api.query_stream(sparql=sparql, accept=accept):
+            if parts is not None:
+                size += len(chunk)
+
+                if size <= self.max_entry_bytes:
+                    parts.append(decoder.decode(chunk))
+                else:
+                    parts = None
+
+            yield chunk
+
+        if parts is not None:
+            parts.append(decoder.decode(b'', final=True))
+            self._put(key, now, {'result': ''.join(parts), 'format': accept})
+
+    def _get_local(self, key: str, now: float) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key, None)
+
+            if entry is None:
+                return None
+
+            if entry[0] <= now:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _put_local(self, key: str, expires_at: float, response: dict):
+        with self._lock:
+            self._entries[key] = (expires_at, response)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _get_shared(self, key: str, now: float) -> Optional[dict]:
+        if self._uwsgi is None:
+            return None
+
+        try:
+            value = self._uwsgi.cache_get(key, self.shared_cache_name)
+        except Exception:
+            self.logger.exception('Can not read shared answer cache %s', self.shared_cache_name)
+            return None
+
+        if value is None:
+            return None
+
+        entry = json.loads(value)
+
+        if entry['expires_at'] <= now:
+            return None
+
+        self._put_local(key, entry['expires_at'], entry['response'])
+
+        return entry['response']
+
+    def _put_shared(self, key: str, expires_at: float, response: dict):
+        if self._uwsgi is None:
+            return
+
+        value = json.dumps({'expires_at': expires_at, 'response': response}).encode('utf-8')
+
+        try:
+            # fails when the cache has no free blocks left, the answer stays in the local cache only
+            if not self._uwsgi.cache_update(key, value, int(expires_at - time.time()) + 1, self.shared_cache_name):
+                self.logger.debug('Answer of %s bytes does not fit into shared answer cache', len(value))
+        except Exception:
+            self.logger.exception('Can not update shared answer cache %s', self.shared_cache_name)
@@ -0,0 +1,82 @@
+import csv
+import io
+import logging
+import threading
+import time
+
+from typing import Optional
+
+from .db_sparql_api import DBSparqlApi
+from .prefixes import declare_prefixes, OWL, TRIP
+from utils.formatting import ignore_if_empty
+
+
+class DataVersionPoller:
+    """Version of the trips data, it changes on every commit of the loader.
+
+    The version is the active repository with `trp:ontologyVersionInfo`: the latest loaded trip and the
+    modification count, which the loader increments in every update transaction, also in the ones keeping
+    the latest trip (backfills, repairs, migrations).
+    It is polled at most every `poll_sec` by a single request, others use the previous version meanwhile.
+    """
+
+    def __init__(self, db_api: DBSparqlApi, data_graph_name: str, poll_sec: float = 10):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.db_api = db_api
+        self.data_graph_name = data_graph_name
+        self.poll_sec = poll_sec
+
+        self._version = None  # type: Optional[str]
+        self._polled_at = None  # type: Optional[float]
+        self._lock = threading.Lock()
+
+    def _poll(self) -> str:
+        query = (
+            f"{declare_prefixes(OWL, TRIP)} "
+             "SELECT ?latestTripID ?latestTripTS ?modificationCount "
+             "WHERE { "
+                f"{ignore_if_empty('GRAPH <{}> {{', self.data_graph_name)} "
+                    f"{TRIP.abbr}:ontologyVersionInfo a {OWL.abbr}:NamedIndividual . "
+                    f"OPTIONAL {{ {TRIP.abbr}:ontologyVersionInfo {TRIP.abbr}:latestTripTS ?latestTripTS ; "
+                        f"{TRIP.abbr}:latestTripID ?latestTripID . }} "
+                    f"OPTIONAL {{ {TRIP.abbr}:ontologyVersionInfo {TRIP.abbr}:modificationCount ?modificationCount . }} "
+                f"{ignore_if_empty('}}', self.data_graph_name)} "
+             "}"
+        )
+
+        result = self.db_api.query(sparql=query, accept='text/csv')
+        reader = list(csv.DictReader(io.StringIO(result['result'])))
+        version = (
+            f"{reader[0]['latestTripID']}|{reader[0]['latestTripTS']}|{reader[0]['modificationCount']}" if reader else ''
+        )
+
+        # the query follows the repository pointer, so the repository is the one which answered it
+        return f'{self.db_api.repository_id}|{version}'
+
+    def get_data_version(self) -> Optional[str]:
+        """Returns the cached data version, `None` when it could never be polled."""
+        now = time.monotonic()
+
+        if (self._polled_at is not None) and (now - self._polled_at < self.poll_sec):
+            return self._version
+
+        if not self._lock.acquire(blocking=self._version is None):
+            return self._version
+
+        try:
+            if (self._polled_at is None) or (now - self._polled_at >= self.poll_sec):
+                version = self._poll()
+
+                if version != self._version:
+                    self.logger.info('Data version changed from %s to %s', self._version, version)
+
+                self._version = version
+                self._polled_at = time.monotonic()
+        except Exception:
+            self.logger.exception('Can not poll data version, keep using %s', self._version)
+            self._polled_at = time.monotonic()
+        finally:
+            self._lock.release()
+
+        return self._version
@@ -1,7 +1,12 @@
 import logging
+import threading
+import time
 import requests
 from requests import Response
-from typing import Callable, Optional
+from requests.adapters import HTTPAdapter
+from typing import Iterator, Optional
+
+from utils.metrics import LatencyHistogram
 
 #from SPARQLWrapper import RDFXML
 
@@ -19,60 +24,131 @@ class DBSparqlUpdateException(DBSparqlApiException):
 
 
 class DBSparqlApi:
-    def __init__(self, graphdb_endpoint: str, repository_id: str, username: str = None, password: str = None):
+    """GraphDB SPARQL endpoint client, safe to share between request threads.
+
+    Requests go through one keep-alive connection pool. GraphDB is logged in lazily and the token is renewed
+    `token_refresh_sec` after the login, before GraphDB expires it, so queries do not pay a rejected round trip.
+    """
+
+    def __init__(self,
+                 graphdb_endpoint: str,
+                 repository_id: str,
+                 username: str = None,
+                 password: str = None,
+                 repository_pointer=None,  # Optional[RepositoryPointer]
+                 repository_pointer_refresh_sec: float = 30,
+                 connect_timeout_sec: float = 5,
+                 read_timeout_sec: float = 60,
+                 pool_size: int = 16,
+                 token_refresh_sec: float = 3600,
+                 latency_histogram: Optional[LatencyHistogram] = None):
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
 
         self.graphdb_endpoint = graphdb_endpoint
-        self.query_endpoint = graphdb_endpoint + f'/repositories/{repository_id}'
-        self.update_endpoint = graphdb_endpoint + f'/repositories/{repository_id}/statements'
+        self.repository_pointer = repository_pointer
+        self.repository_pointer_refresh_sec = repository_pointer_refresh_sec
+        self._repository_pointer_checked_at = None
+        self.__set_repository(repository_id)
         self.login_endpoint = graphdb_endpoint + f"/rest/login/{username if username else 'admin'}"
         self.username = username
         self.password = password
+        self.timeout = (connect_timeout_sec, read_timeout_sec)
+        self.token_refresh_sec = token_refresh_sec
+        self.latency_histogram = latency_histogram
+
         self.jwt_header = None
+        self._jwt_obtained_at = None
+        self._jwt_lock = threading.Lock()
 
-        self.__authorize()
+        self.session = requests.Session()
+        self.session.verify = False
+        self.session.mount(graphdb_endpoint, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
 
-    def __authorize(self) -> str:
-        if self.username:
-            auth_response = requests.post(self.login_endpoint, headers={'X-GraphDB-Password': self.password}, verify=False)
+    def __set_repository(self, repository_id: str):
+        self.repository_id = repository_id
+        self.query_endpoint = self.graphdb_endpoint + f'/repositories/{repository_id}'
+        self.update_endpoint = self.graphdb_endpoint + f'/repositories/{repository_id}/statements'
 
-            if auth_response.status_code < 400:
-                self.jwt_header = {'Authorization': auth_response.headers['Authorization']}
-            else:
-                raise DBSparqlApiException(f'Can not authenticate at {self.graphdb_endpoint}')
+    def __follow_repository_pointer(self):
+        if self.repository_pointer is None:
+            return
+
+        now = time.monotonic()
+
+        if (self._repository_pointer_checked_at is not None) and \
+                (now - self._repository_pointer_checked_at < self.repository_pointer_refresh_sec):
+            return
+
+        self._repository_pointer_checked_at = now
+
+        try:
+            active_repository_id = self.repository_pointer.get_active_repository_id()
+        except Exception:
+            self.logger.exception('Can not read active repository, keep using %s', self.repository_id)
+            return
+
+        if active_repository_id and (active_repository_id != self.repository_id):
+            self.logger.info('Switching from repository %s to active repository %s', self.repository_id, active_repository_id)
+            self.__set_repository(active_repository_id)
 
-            return auth_response.json()
+    def __authorize(self):
+        auth_response = self.session.post(
+            self.login_endpoint,
+            headers={'X-GraphDB-Password': self.password},
+            timeout=self.timeout
+        )
+
+        if auth_response.status_code < 400:
+            self.jwt_header = {'Authorization': auth_response.headers['Authorization']}
+            self._jwt_obtained_at = time.monotonic()
         else:
-            self.jwt_header = None
+            raise DBSparqlApiException(f'Can not authenticate at {self.graphdb_endpoint}')
+
+    def __get_jwt_header(self, rejected_header: Optional[dict] = None) -> Optional[dict]:
+        if not self.username:
             return None
 
-    def __do_authorized_call(self, func: Callable[..., Response], max_retries: int = 1, **kwargs) -> Response:
-        if not self.jwt_header:
-            return func(**kwargs)
-        else:
-            if 'headers' in kwargs:
-                kwargs['headers'].update(self.jwt_header)
-            else:
-                kwargs['headers'] = self.jwt_header
+        with self._jwt_lock:
+            is_expiring = (self._jwt_obtained_at is None) or \
+                (time.monotonic() - self._jwt_obtained_at >= self.token_refresh_sec)
+
+            # another thread may have logged in already while this one waited for the lock
+            if is_expiring or (rejected_header is not None and rejected_header == self.jwt_header):
+                self.__authorize()
+
+            return self.jwt_header
+
+    def __do_authorized_call(self, method: str, operation: str, max_retries: int = 1, **kwargs) -> Response:
+        jwt_header = self.__get_jwt_header()
+        headers = dict(kwargs.pop('headers', None) or {}, **(jwt_header or {}))
 
-            response = func(**kwargs, verify=False)
+        tic = time.perf_counter()
+        response = self.session.request(method, headers=headers, timeout=self.timeout, **kwargs)
 
-            if response.status_code == 401:
-                if max_retries > 0:
-                    self.__authorize()
-                    return self.__do_authorized_call(func=func, max_retries=max_retries-1, **kwargs)
-                else:
-                    request_info = {k: kwargs[k] for k in kwargs if (not self.jwt_header) or (k not in self.jwt_header)}
-                    raise DBSparqlApiException(f'Failed making authorized request using parameters {request_info}')
+        if self.latency_histogram is not None:
+            self.latency_histogram.observe(operation, time.perf_counter() - tic)
+
+        if (response.status_code == 401) and jwt_header:
+            response.close()
+
+            # GraphDB restarted or revoked the token earlier than expected
+            if max_retries > 0:
+                self.__get_jwt_header(rejected_header=jwt_header)
+                return self.__do_authorized_call(method, operation, max_retries=max_retries-1, headers=headers, **kwargs)
             else:
-                return response
+                raise DBSparqlApiException(f'Failed making authorized request to {kwargs.get("url", None)}')
+
+        return response
+
+    def query(self, sparql: str, accept: str = 'text/n3') -> dict:
+        self.__follow_repository_pointer()
 
-    def query(self, sparql: str) -> dict:
         response = self.__do_authorized_call(
-            func=requests.get,
+            'GET',
+            'query',
             url=self.query_endpoint,
             params={'query': sparql},
-            headers={'Accept': 'text/n3'}
+            headers={'Accept': accept}
         )
 
         if response.status_code < 400:
@@ -86,8 +162,31 @@ class DBSparqlApi:
             self.logger.error('Failed response [%s] from [%s]', response.text, response.url)
             raise DBSparqlQueryException(response.text)
 
+    def query_stream(self, sparql: str, accept: str = 'text/n3', chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """Yields the raw result as GraphDB sends it, large results are not held in memory."""
+        self.__follow_repository_pointer()
+
+        response = self.__do_authorized_call(
+            'GET',
+            'query',
+            url=self.query_endpoint,
+            params={'query': sparql},
+            headers={'Accept': accept},
+            stream=True
+        )
+
+        if response.status_code >= 400:
+            self.logger.error('Failed response [%s] from [%s]', response.text, response.url)
+            raise DBSparqlQueryException(response.text)
+
+        with response:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                yield chunk
+
     def update(self, sparql: str) -> None:
-        response = self.__do_authorized_call(func=requests.post, url=self.update_endpoint, params={'update': sparql})
+        self.__follow_repository_pointer()
+
+        response = self.__do_authorized_call('POST', 'update', url=self.update_endpoint, params={'update': sparql})
 
         if response.status_code >= 400:
             self.logger.error('Failed response [%s] from [%s]', response.text, response.url)
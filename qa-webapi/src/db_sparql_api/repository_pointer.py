@@ -0,0 +1,46 @@
+import csv
+import io
+import json
+import os
+
+from typing import Optional
+
+from .prefixes import declare_prefixes, TRIP
+
+
+class RepositoryPointer:
+    """Names the repository which currently serves QA traffic, the loader switches it after blue/green rebuilds."""
+
+    def get_active_repository_id(self) -> Optional[str]:
+        raise NotImplementedError()
+
+
+class GraphDBRepositoryPointer(RepositoryPointer):
+    def __init__(self, db_api):  # db_api: DBSparqlApi bound to the pointer repository
+        self.db_api = db_api
+
+    def get_active_repository_id(self) -> Optional[str]:
+        query = (
+            f"{declare_prefixes(TRIP)} "
+            "SELECT ?repositoryID "
+            "WHERE { "
+                f"{TRIP.abbr}:activeRepository {TRIP.abbr}:repositoryID ?repositoryID . "
+            "}"
+        )
+
+        result = self.db_api.query(sparql=query, accept='text/csv')
+        reader = list(csv.DictReader(io.StringIO(result['result'])))
+
+        return reader[0]['repositoryID'] if reader else None
+
+
+class FileRepositoryPointer(RepositoryPointer):
+    def __init__(self, path: str):
+        self.path = path
+
+    def get_active_repository_id(self) -> Optional[str]:
+        if not os.path.exists(self.path):
+            return None
+
+        with open(self.path, 'rt') as f:
+            return json.load(f)['repository_id']
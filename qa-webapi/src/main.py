@@ -6,6 +6,7 @@ from flask import request
 
 from qa_rest_api import mod as qa_rest_api_mod
 from utils import http
+from utils.compression import ResponseCompressor
 
 
 logger = logging.getLogger(__name__)
@@ -22,6 +23,16 @@ app.config.update(CONFIGURATION)
 app.register_blueprint(qa_rest_api_mod, url_prefix='/')
 
 
+COMPRESSION_CFG = CONFIGURATION.get('COMPRESSION', None) or {}
+
+COMPRESSOR = ResponseCompressor(
+    min_size=COMPRESSION_CFG.get('MIN_SIZE', 1024),
+    gzip_level=COMPRESSION_CFG.get('GZIP_LEVEL', 6),
+    brotli_quality=COMPRESSION_CFG.get('BROTLI_QUALITY', 4),
+    use_brotli=COMPRESSION_CFG.get('BROTLI', True)
+) if COMPRESSION_CFG else None
+
+
 @app.errorhandler(404)
 def handle_error(e):
     return http.response_error_404('not_found', 'Requested resource not found')
@@ -36,11 +47,17 @@ def handle_error(e):
 @app.after_request
 def after_request(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
+    # answer metadata of non JSON answers
+    response.headers['Access-Control-Expose-Headers'] = 'X-QA-Answer'
+    # answers and resources are sent in the format negotiated by the Accept header
+    response.vary.add('Accept')
     if request.method == 'OPTIONS':
         response.headers['Access-Control-Allow-Methods'] = 'DELETE, GET, POST, PUT'
         headers = request.headers.get('Access-Control-Request-Headers')
         if headers:
             response.headers['Access-Control-Allow-Headers'] = headers
+    if COMPRESSOR is not None:
+        response = COMPRESSOR.compress(response, request.headers.get('Accept-Encoding', ''))
     return response
 
 
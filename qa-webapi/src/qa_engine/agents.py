@@ -1,9 +1,16 @@
+import csv
+import io
+import itertools
 import logging
 
+from typing import Iterator, Optional
+
 from .nlu import IntentionEstimator
-from .intents import UnknownIntent
+from .intents import Intent, UnknownIntent, TripsListIntent
 from .answers import KnownAnswer, NotUnderstandAnswer, CanNotAnswer
 from .intents_logging import IntentsLogger, DefaultLogger
+from .pagination import TripsPaginator
+from db_sparql_api.answer_cache import SparqlAnswerCache
 from db_sparql_api.db_sparql_api import DBSparqlApi, DBSparqlApiException
 from utils.timer import create_elapsed_timer_str
 
@@ -13,25 +20,86 @@ class SparqlAgent:
                  data_graph_name: str,
                  db_api: DBSparqlApi,
                  intents_estimator: IntentionEstimator,
-                 intents_logger: IntentsLogger):
+                 intents_logger: IntentsLogger,
+                 answer_cache: Optional[SparqlAnswerCache] = None,
+                 paginator: Optional[TripsPaginator] = None):
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
 
         self.db_api = db_api
         self.intents_estimator = intents_estimator
         self.data_graph_name = data_graph_name
         self.intents_logger = intents_logger if intents_logger else DefaultLogger()
+        self.answer_cache = answer_cache
+        self.paginator = paginator
+
+    def __query(self, query: str, kind: str, accept: str = 'text/n3') -> dict:
+        if self.answer_cache is not None:
+            return self.answer_cache.query(sparql=query, accept=accept, kind=kind)
+        else:
+            return self.db_api.query(sparql=query, accept=accept)
+
+    def __query_stream(self, query: str, kind: str, accept: str = 'text/n3') -> Iterator[bytes]:
+        if self.answer_cache is not None:
+            chunks = self.answer_cache.query_stream(sparql=query, accept=accept, kind=kind)
+        else:
+            chunks = self.db_api.query_stream(sparql=query, accept=accept)
+
+        # GraphDB is called for the first chunk, its errors are raised here rather than while streaming
+        first_chunk = next(chunks, b'')
+
+        return itertools.chain([first_chunk], chunks)
+
+    def __ask_page(self,
+                   intent: TripsListIntent,
+                   page_size: Optional[int],
+                   cursor: Optional[str],
+                   accept: str) -> KnownAnswer:
+        kind = intent.__class__.__name__
+        list_query = intent.as_sparql(graph_name=self.data_graph_name)
+        after = self.paginator.decode_cursor(list_query, cursor) if cursor else None
+        page_size = self.paginator.get_page_size(page_size)
+
+        # one trip more than the page tells whether there is a next page
+        page_query = intent.as_sparql_page(graph_name=self.data_graph_name, limit=page_size + 1, after=after)
+        rows = list(csv.DictReader(io.StringIO(self.__query(page_query, kind=kind, accept='text/csv')['result'])))
+
+        page, has_next_page = rows[:page_size], len(rows) > page_size
+        next_cursor = self.paginator.encode_cursor(list_query, page[-1]['startTs'], page[-1]['trip']) if has_next_page else None
 
-    def ask(self, question: str):
+        response = self.__query(intent.trips_view_sparql([row['trip'] for row in page]), kind=kind, accept=accept)
+
+        return KnownAnswer(
+            intent=intent,
+            answer=response['result'],
+            answer_format=response['format'],
+            paginated=True,
+            next_cursor=next_cursor
+        )
+
+    def __ask_intent(self, intent: Intent, page_size: Optional[int], cursor: Optional[str], accept: str) -> KnownAnswer:
+        if isinstance(intent, TripsListIntent) and (self.paginator is not None):
+            return self.__ask_page(intent, page_size, cursor, accept)
+
+        query = intent.as_sparql(graph_name=self.data_graph_name)
+
+        return KnownAnswer(
+            intent=intent,
+            answer_format=accept,
+            answer_chunks=self.__query_stream(query, kind=intent.__class__.__name__, accept=accept)
+        )
+
+    def ask(self, question: str, page_size: Optional[int] = None, cursor: Optional[str] = None, accept: str = 'text/n3'):
+        """Answers in the `accept` format of GraphDB.
+
+        Raises InvalidCursorException when `cursor` does not continue the list asked by `question`.
+        """
         intent = self.intents_estimator.estimate(question)
 
         try:
             if type(intent) != UnknownIntent:
                 sw = create_elapsed_timer_str('sec')
-                query = intent.as_sparql(graph_name=self.data_graph_name)
-                response = self.db_api.query(sparql=query)
-                self.logger.debug('Got answer from GraphDB API in [%s]', sw())
-
-                answer = KnownAnswer(intent=intent, answer=response['result'], answer_format=response['format'])
+                answer = self.__ask_intent(intent, page_size, cursor, accept)
+                self.logger.debug('Got first bytes of answer from GraphDB API in [%s]', sw())
             else:
                 answer = NotUnderstandAnswer(intent=intent)
         except DBSparqlApiException:
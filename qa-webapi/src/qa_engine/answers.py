@@ -1,4 +1,4 @@
-from typing import Any, List, Dict, Optional
+from typing import Any, Iterator, List, Dict, Optional
 
 from .intents import IntentParam, Intent, UnknownIntent
 
@@ -92,9 +92,31 @@ class NotUnderstandAnswer(Answer):
 
 
 class KnownAnswer(Answer):
-    def __init__(self, intent: Intent, answer: str, answer_format: str = 'application/rdf+xml'):
+    def __init__(self,
+                 intent: Intent,
+                 answer: Optional[str] = None,
+                 answer_format: str = 'application/rdf+xml',
+                 answer_chunks: Optional[Iterator[bytes]] = None,
+                 paginated: bool = False,
+                 next_cursor: Optional[str] = None):
         super().__init__(intent=intent, answer=answer, answer_format=answer_format)
 
+        # the answer as GraphDB sends it, it is passed through to the client instead of `answer`
+        self.answer_chunks = answer_chunks
+        self.paginated = paginated
+        self.next_cursor = next_cursor
+
+    def get_details(self):
+        result = super().get_details()
+
+        if self.answer_chunks is not None:
+            result['answer_format'] = self.answer_format
+
+        if self.paginated:
+            result['next_cursor'] = self.next_cursor
+
+        return result
+
 
 class CanNotAnswer(Answer):
     def __init__(self, intent: Intent):
@@ -1,6 +1,6 @@
 import logging
 import uuid
-from typing import List, Dict, Callable, Optional, Any
+from typing import List, Dict, Callable, Optional, Any, Tuple
 import pathlib
 import os
 
@@ -230,30 +230,81 @@ class UnknownIntent(Intent):
         return self.probable_intent
 
 
-class ListTripsIntent(Intent):
-    def nl_description(self):
-        return 'question is about listing all known trips'
+class TripsListIntent(Intent):
+    """Lists trips matching `_trips_where`, the list can be read in pages ordered by trip start time."""
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
+    # trips without a start time come first
+    MISSING_START_TS = '0001-01-01T00:00:00Z'
+
+    def _trips_where(self) -> str:
+        raise NotImplementedError()
 
     def as_sparql(self, graph_name: Optional[str] = None) -> Optional[str]:
         return (
-            f"{declare_prefixes(TRIP, TRIPUI)} "
+            f"{declare_prefixes(TRIP, TRIPUI, XSD, TIME)} "
             "CONSTRUCT { "
                 f"{TRIPUI.abbr}:TripsSummaryList a {TRIPUI.abbr}:View ;"
                     f"{TRIPUI.abbr}:containsTrip ?trip . "
             "} "
             "WHERE { "
                f"{ignore_if_empty('GRAPH <{}> {{', graph_name)} "
-                    f"?trip a {TRIP.abbr}:Trip . "
-                    "FILTER (!isBlank(?trip)) "
+                   f"{self._trips_where()} "
                f"{ignore_if_empty('}}', graph_name)} "
             "}"
         )
 
+    def as_sparql_page(self, graph_name: Optional[str], limit: int, after: Optional[Tuple[str, str]] = None) -> str:
+        """Selects `?trip ?startTs` of at most `limit` trips following `after`, i.e. (start time, trip IRI)."""
+        after_expr = (
+            f"(?startTs > \"{after[0]}\"^^{XSD.abbr}:dateTime) || "
+            f"((?startTs = \"{after[0]}\"^^{XSD.abbr}:dateTime) && (STR(?trip) > \"{after[1]}\"))"
+        ) if after else None
 
-class TripsOnDateIntent(Intent):
+        return (
+            f"{declare_prefixes(TRIP, TRIPUI, XSD, TIME)} "
+            "SELECT DISTINCT ?trip ?startTs "
+            "WHERE { "
+               f"{ignore_if_empty('GRAPH <{}> {{', graph_name)} "
+                   f"{self._trips_where()} "
+                   f"OPTIONAL {{ ?trip {TIME.abbr}:hasBeginning/{TRIP.abbr}:hasTimestamp ?pageBeginTs . }} "
+                   f"BIND (COALESCE(?pageBeginTs, \"{self.MISSING_START_TS}\"^^{XSD.abbr}:dateTime) AS ?startTs) "
+                   f"{ignore_if_empty('FILTER ({}) ', after_expr)}"
+               f"{ignore_if_empty('}}', graph_name)} "
+            "} "
+            "ORDER BY ?startTs STR(?trip) "
+           f"LIMIT {int(limit)}"
+        )
+
+    @staticmethod
+    def trips_view_sparql(trip_iris: List[str]) -> str:
+        """Same view as `as_sparql` for the given trips, e.g. a page of them."""
+        return (
+            f"{declare_prefixes(TRIPUI)} "
+            "CONSTRUCT { "
+                f"{TRIPUI.abbr}:TripsSummaryList a {TRIPUI.abbr}:View ;"
+                    f"{TRIPUI.abbr}:containsTrip ?trip . "
+            "} "
+            "WHERE { "
+               f"VALUES ?trip {{ {' '.join(f'<{iri}>' for iri in trip_iris)} }} "
+            "}"
+        )
+
+
+class ListTripsIntent(TripsListIntent):
+    def nl_description(self):
+        return 'question is about listing all known trips'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    def _trips_where(self) -> str:
+        return (
+            f"?trip a {TRIP.abbr}:Trip . "
+            "FILTER (!isBlank(?trip)) "
+        )
+
+
+class TripsOnDateIntent(TripsListIntent):
     def nl_description(self):
         return 'question is about listing all known trips started at a specified date'
 
@@ -268,7 +319,7 @@ class TripsOnDateIntent(Intent):
 
         super().__init__(**kwargs)
 
-    def as_sparql(self, graph_name: Optional[str] = None) -> Optional[str]:
+    def _trips_where(self) -> str:
         interval = self.get_param('date').value
         start = interval['start']
         end = interval['end']
@@ -279,19 +330,10 @@ class TripsOnDateIntent(Intent):
         )
 
         return (
-            f"{declare_prefixes(TRIP, TRIPUI, XSD, TIME)} "
-            "CONSTRUCT { "
-                f"{TRIPUI.abbr}:TripsSummaryList a {TRIPUI.abbr}:View ;"
-                    f"{TRIPUI.abbr}:containsTrip ?trip . "
-            "} "
-            "WHERE { "
-               f"{ignore_if_empty('GRAPH <{}> {{', graph_name)} "
-                   f"?trip a {TRIP.abbr}:Trip ; "
-                         f"{TIME.abbr}:hasBeginning ?beg . "
-                   f"?beg {TRIP.abbr}:hasTimestamp ?ts . "
-                   f"FILTER ( !isBlank(?trip) && ({date_in_interval_expr}) ) "  
-               f"{ignore_if_empty('}}', graph_name)} "
-            "}"
+            f"?trip a {TRIP.abbr}:Trip ; "
+                  f"{TIME.abbr}:hasBeginning ?beg . "
+            f"?beg {TRIP.abbr}:hasTimestamp ?ts . "
+            f"FILTER ( !isBlank(?trip) && ({date_in_interval_expr}) ) "
         )
 
 
@@ -355,7 +397,7 @@ class TripRouteIntent(Intent):
         )
 
 
-class ListDriverTripsIntent(Intent):
+class ListDriverTripsIntent(TripsListIntent):
     def nl_description(self):
         return 'question is about getting all trips of a specified driver'
 
@@ -409,20 +451,11 @@ class ListDriverTripsIntent(Intent):
                f"FILTER ( !isBlank(?trip) && (({fn_and_ln_expr}) || ({ln_and_fn_expr})) )"
             )
 
-    def as_sparql(self, graph_name: Optional[str] = None) -> Optional[str]:
+    def _trips_where(self) -> str:
         return (
-            f"{declare_prefixes(TRIP, TRIPUI, TIME, XSD)} "
-             "CONSTRUCT { "
-                 f"{TRIPUI.abbr}:TripsSummaryList a {TRIPUI.abbr}:View ;"
-                     f"{TRIPUI.abbr}:containsTrip ?trip . "
-             "} "
-             "WHERE { "
-                f"{ignore_if_empty('GRAPH <{}> {{', graph_name)} "
-                    f"?trip a {TRIP.abbr}:Trip ; "
-                          f"{TRIP.abbr}:drivenBy ?driver . "
-                    f"{self._where_criteria()} "
-                f"{ignore_if_empty('}}', graph_name)} "
-             "}"
+            f"?trip a {TRIP.abbr}:Trip ; "
+                  f"{TRIP.abbr}:drivenBy ?driver . "
+            f"{self._where_criteria()} "
         )
 
 
@@ -541,7 +574,7 @@ class TripsWithEventOnDateIntent(Intent):
                     f"?mp a {TRIP.abbr}:{event_type} . "
                     # f"OPTIONAL {{ ?mp {GEOSPARQL.abbr}:asWKT ?mpPoint }} "
                     # f"OPTIONAL {{ ?mp {TRIP.abbr}:onRoadSegment ?mpRoadSeg }} "
-                    f"OPTIONAL {{ ?mp {TRIP.abbr}:hasShape ?aggrShape }} "
+                    f"OPTIONAL {{ ?mp {TRIP.abbr}:onRoadSegment/{TRIP.abbr}:hasShape ?aggrShape }} "
                     f"{self._where_criteria()} "
                 f"{ignore_if_empty('}}', graph_name)} "
              "}"
@@ -651,7 +684,7 @@ class TripEventLocationIntent(Intent):
                     f"OPTIONAL {{ ?roadSeg {TRIP.abbr}:hasRoadName ?roadName }} "
                     # f"OPTIONAL {{ ?roadSeg {TRIP.abbr}:hasShape ?segShape }} "
                     # f"OPTIONAL {{ ?mp {GEOSPARQL.abbr}:asWKT ?mpPoint }} "
-                    f"OPTIONAL {{ ?mp {TRIP.abbr}:hasShape ?aggrShape }} "
+                    f"OPTIONAL {{ ?roadSeg {TRIP.abbr}:hasShape ?aggrShape }} "
                 f"{ignore_if_empty('}}', graph_name)} "
              "}"
         )
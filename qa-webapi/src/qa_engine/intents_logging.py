@@ -1,11 +1,27 @@
+import atexit
 import logging
+import os
+import queue
+import threading
+import time
+
+from typing import List, Optional
 
 from .intents import Intent
 from utils.formatting import ignore_if_empty
-from db_sparql_api.db_sparql_api import DBSparqlApi, DBSparqlApiException
+from utils.metrics import format_counter
+from db_sparql_api.db_sparql_api import DBSparqlApi
 from db_sparql_api.prefixes import declare_prefixes, OWL, XSD, TRIPQA
 
 
+def escape_literal(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
+
+
+# wakes the worker up when the logger is closed
+_STOP = object()
+
+
 class DefaultLogger:
     def __init__(self):
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
@@ -15,11 +31,39 @@ class DefaultLogger:
 
 
 class IntentsLogger(DefaultLogger):
-    def __init__(self, data_graph_name: str, db_api: DBSparqlApi):
+    """Stores asked questions in the QA stats graph.
+
+    Questions are queued and a background thread inserts them with one `INSERT DATA` per `batch_size` questions
+    or `flush_interval_sec`, whichever comes first. When the queue holds `max_queue_size` questions, new ones are
+    dropped and counted as overflowed, questions of a failed insert are counted as dropped. When the process exits,
+    the thread is given `close_timeout_sec` to insert the batch it holds and the queue is flushed.
+    """
+
+    def __init__(self,
+                 data_graph_name: str,
+                 db_api: DBSparqlApi,
+                 batch_size: int = 100,
+                 flush_interval_sec: float = 5,
+                 max_queue_size: int = 10000,
+                 close_timeout_sec: float = 30):
         super().__init__()
 
         self.db_api = db_api
         self.data_graph_name = data_graph_name
+        self.batch_size = batch_size
+        self.flush_interval_sec = flush_interval_sec
+        self.close_timeout_sec = close_timeout_sec
+
+        self.questions = queue.Queue(maxsize=max_queue_size)
+        self.logged_count = 0
+        self.overflow_count = 0
+        self.dropped_count = 0
+
+        self._worker = None  # type: Optional[threading.Thread]
+        self._worker_pid = None  # type: Optional[int]
+        self._worker_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
 
     def log(self, intent: Intent):
         super().log(intent=intent)
@@ -27,21 +71,114 @@ class IntentsLogger(DefaultLogger):
         if intent and intent.get_natural_language_question():
             nl_question = intent.get_natural_language_question()
 
-            query = (
-                f"{declare_prefixes(OWL, XSD, TRIPQA)} "
-                 "INSERT DATA { "
-                    f"{ignore_if_empty('GRAPH <{}> {{', self.data_graph_name)} "
-                        f"{TRIPQA.abbr}:{intent.get_uuid()} a {TRIPQA.abbr}:Question, {OWL.abbr}:NamedIndividual ; "
-                                    f"{TRIPQA.abbr}:hasIntentId \"{intent.__class__.__name__}\"^^{XSD.abbr}:string ; "
-                                    f"{TRIPQA.abbr}:englishLanguage \"{nl_question}\"^^{XSD.abbr}:string . "
-                    f"{ignore_if_empty('}}', self.data_graph_name)} "
-                 "}"
+            question_definition = (
+                f"{TRIPQA.abbr}:{intent.get_uuid()} a {TRIPQA.abbr}:Question, {OWL.abbr}:NamedIndividual ; "
+                            f"{TRIPQA.abbr}:hasIntentId \"{intent.__class__.__name__}\"^^{XSD.abbr}:string ; "
+                            f"{TRIPQA.abbr}:englishLanguage \"{escape_literal(nl_question)}\"^^{XSD.abbr}:string . "
             )
 
+            self._ensure_worker()
+
+            try:
+                self.questions.put_nowait(question_definition)
+            except queue.Full:
+                self.overflow_count += 1
+
+    def _ensure_worker(self):
+        # uwsgi forks workers after the app is imported, every worker runs its own thread
+        if self._worker_pid == os.getpid():
+            return
+
+        with self._worker_lock:
+            if self._worker_pid == os.getpid():
+                return
+
+            self._worker_pid = os.getpid()
+            self._worker = threading.Thread(target=self._run, name='intents-logger', daemon=True)
+            self._worker.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        while not self._closed.is_set():
+            batch = self._take_batch(wait=True)
+            if batch:
+                self._insert(batch)
+
+    def _take_batch(self, wait: bool) -> List[str]:
+        batch = []  # type: List[str]
+        deadline = time.monotonic() + self.flush_interval_sec
+
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+
+            try:
+                if wait and (timeout > 0):
+                    question = self.questions.get(timeout=timeout)
+                else:
+                    question = self.questions.get_nowait()
+            except queue.Empty:
+                break
+
+            if question is _STOP:
+                if wait:
+                    break
+                continue
+
+            batch.append(question)
+
+        return batch
+
+    def _insert(self, batch: List[str]):
+        query = (
+            f"{declare_prefixes(OWL, XSD, TRIPQA)} "
+             "INSERT DATA { "
+                f"{ignore_if_empty('GRAPH <{}> {{', self.data_graph_name)} "
+                    f"{''.join(batch)}"
+                f"{ignore_if_empty('}}', self.data_graph_name)} "
+             "}"
+        )
+
+        with self._flush_lock:
             try:
                 self.db_api.update(query)
-            except DBSparqlApiException:
-                self.logger.exception('Error while inserting new question into knowledge base')
+                self.logged_count += len(batch)
+            except Exception:
+                self.dropped_count += len(batch)
+                self.logger.exception('Error while inserting %s new questions into knowledge base', len(batch))
+
+    def flush(self):
+        while True:
+            batch = self._take_batch(wait=False)
+            if not batch:
+                break
+            self._insert(batch)
+
+    def close(self):
+        self._closed.set()
+
+        # the worker inserts the batch it is collecting before it stops, the rest of the queue is flushed here
+        if (self._worker is not None) and (self._worker_pid == os.getpid()):
+            try:
+                self.questions.put_nowait(_STOP)
+            except queue.Full:
+                pass  # the worker stops after flush_interval_sec at the latest
+
+            self._worker.join(timeout=self.close_timeout_sec)
+
+            if self._worker.is_alive():
+                self.logger.warning('Questions logging thread did not stop in %s sec', self.close_timeout_sec)
+
+        self.flush()
+
+    def as_prometheus(self) -> str:
+        return (
+            format_counter('qa_questions_logged_total', 'Questions stored in the QA stats graph', self.logged_count) +
+            format_counter('qa_questions_overflow_total', 'Questions not queued because the queue was full', self.overflow_count) +
+            format_counter('qa_questions_dropped_total', 'Questions lost in failed inserts', self.dropped_count) +
+            f'# HELP qa_questions_queued Questions waiting to be stored\n'
+            f'# TYPE qa_questions_queued gauge\n'
+            f'qa_questions_queued {self.questions.qsize()}\n'
+        )
 
     def ignore_if_empty(self, template: str, param):
         return template.format(param) if param else ""
@@ -0,0 +1,206 @@
+import json
+import logging
+import math
+import re
+import zipfile
+
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .nlu_cache import SLOT_PATTERNS, mask_question
+
+
+MONTHS = {
+    m: i + 1 for i, m in enumerate([
+        'january', 'february', 'march', 'april', 'may', 'june',
+        'july', 'august', 'september', 'october', 'november', 'december'
+    ])
+}
+
+MONTH_NAMES_RE = '|'.join(MONTHS)
+MONTH_DAY_YEAR = re.compile(rf'\b({MONTH_NAMES_RE})\s+(\d{{1,2}})(?:st|nd|rd|th)?(?:,?\s+(\d{{4}}))?\b', re.IGNORECASE)
+DAY_MONTH_YEAR = re.compile(rf'\b(\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?({MONTH_NAMES_RE})(?:,?\s+(\d{{4}}))?\b', re.IGNORECASE)
+RELATIVE_DAYS = {'today': 0, 'yesterday': -1, 'tomorrow': 1}
+RELATIVE_DAY = re.compile(rf"\b({'|'.join(RELATIVE_DAYS)})\b", re.IGNORECASE)
+
+# words which start with a capital letter in questions but are not names
+NOT_NAME_WORDS = {'show', 'list', 'what', 'which', 'where', 'when', 'get', 'give', 'find', 'driver', 'trip', 'trips', 'on', 'by', 'of', 'the', 'all', 'i', 'did', 'does'} | set(MONTHS)
+PERSON = re.compile(r'\b([A-Z][a-z]+)\s+([A-Z][a-z]+)\b')
+
+
+class EntityExtractor:
+    """Finds intent parameters in questions the way the Dialogflow agent would, without calling it.
+
+    Trip IDs, driver IDs and ISO dates are matched by the regexes of the agent entities, month name dates and
+    'today'/'yesterday' are resolved to ISO dates in UTC, driver names are two capitalized words in a row and
+    enum entities (events, markers) are looked up among the synonyms in the agent export.
+    """
+
+    def __init__(self, synonyms: Optional[Dict[str, Dict[str, str]]] = None):
+        # parameter name -> synonym -> entity value
+        self.synonyms = synonyms if synonyms else {}
+
+    @staticmethod
+    def from_agent_export(agent_export_path: str) -> 'EntityExtractor':
+        synonyms = {}  # type: Dict[str, Dict[str, str]]
+
+        with zipfile.ZipFile(agent_export_path) as agent_export:
+            for name in agent_export.namelist():
+                if not (name.startswith('entities/') and name.endswith('_entries_en.json')):
+                    continue
+
+                entity_name = name[len('entities/'):-len('_entries_en.json')]
+                entity = json.loads(agent_export.read(f'entities/{entity_name}.json'))
+
+                if entity.get('isRegexp', False):
+                    continue
+
+                for entry in json.loads(agent_export.read(name)):
+                    for synonym in entry['synonyms'] + [entry['value']]:
+                        synonyms.setdefault(entity_name, {})[synonym.lower()] = entry['value']
+
+        return EntityExtractor(synonyms=synonyms)
+
+    def extract(self, question: str, now: Optional[datetime] = None) -> Dict[str, Any]:
+        params = {}  # type: Dict[str, Any]
+
+        for kind, pattern in SLOT_PATTERNS:
+            match = pattern.search(question)
+            if match:
+                params[kind] = match.group(0)
+
+        if 'date' not in params:
+            date = self._extract_date(question, now if now else datetime.now(timezone.utc))
+            if date:
+                params['date'] = date
+
+        person = self._extract_person(question)
+        if person:
+            params['driver_person'] = {'name': person}
+
+        lowered = f" {' '.join(question.lower().split())} "
+        for param_name, entity_synonyms in self.synonyms.items():
+            # the longest synonym wins, e.g. 'over speeding' over 'speeding'
+            for synonym in sorted(entity_synonyms, key=len, reverse=True):
+                if f' {synonym} ' in lowered or f' {synonym}?' in lowered:
+                    params[param_name] = entity_synonyms[synonym]
+                    break
+
+        return params
+
+    @staticmethod
+    def _extract_date(question: str, now: datetime) -> Optional[str]:
+        for pattern, month_group, day_group in ((MONTH_DAY_YEAR, 1, 2), (DAY_MONTH_YEAR, 2, 1)):
+            match = pattern.search(question)
+            if match:
+                year = int(match.group(3)) if match.group(3) else now.year
+                try:
+                    return datetime(year, MONTHS[match.group(month_group).lower()], int(match.group(day_group))).date().isoformat()
+                except ValueError:
+                    return None
+
+        match = RELATIVE_DAY.search(question)
+        if match:
+            return (now + timedelta(days=RELATIVE_DAYS[match.group(1).lower()])).date().isoformat()
+
+        return None
+
+    @staticmethod
+    def _extract_person(question: str) -> Optional[str]:
+        for match in PERSON.finditer(question):
+            if match.group(1).lower() not in NOT_NAME_WORDS and match.group(2).lower() not in NOT_NAME_WORDS:
+                return match.group(0)
+
+        return None
+
+
+def _char_ngrams(text: str, min_n: int = 2, max_n: int = 4) -> Counter:
+    template, _ = mask_question(text)
+    # dates are written in many ways, they say nothing about the intent except that there is a date
+    for pattern in (MONTH_DAY_YEAR, DAY_MONTH_YEAR, RELATIVE_DAY):
+        template = pattern.sub('<date>', template)
+
+    padded = f' {template} '
+    return Counter(padded[i:i + n] for n in range(min_n, max_n + 1) for i in range(len(padded) - n + 1))
+
+
+class LocalIntentClassifier:
+    """Char n-gram TF-IDF nearest centroid classifier, the confidence is the cosine similarity to the centroid.
+
+    Trip IDs, driver IDs and dates are masked before n-grams are counted, so questions differ by intent wording only.
+    """
+
+    def __init__(self, idf: Dict[str, float], centroids: Dict[str, Dict[str, float]]):
+        self.idf = idf
+        self.centroids = centroids
+
+    @staticmethod
+    def _normalize(vector: Dict[str, float]) -> Dict[str, float]:
+        norm = math.sqrt(sum(v * v for v in vector.values()))
+        return {k: v / norm for k, v in vector.items()} if norm > 0 else vector
+
+    def _vectorize(self, text: str) -> Dict[str, float]:
+        return self._normalize({
+            ngram: (1 + math.log(count)) * self.idf[ngram]
+            for ngram, count in _char_ngrams(text).items() if ngram in self.idf
+        })
+
+    @staticmethod
+    def train(samples: Iterable[Tuple[str, str]]) -> 'LocalIntentClassifier':
+        samples = list(samples)
+
+        document_frequency = Counter()
+        for text, _ in samples:
+            document_frequency.update(_char_ngrams(text).keys())
+
+        idf = {ngram: math.log((1 + len(samples)) / (1 + df)) + 1 for ngram, df in document_frequency.items()}
+        classifier = LocalIntentClassifier(idf=idf, centroids={})
+
+        sums = defaultdict(Counter)  # type: Dict[str, Counter]
+        for text, intent_name in samples:
+            sums[intent_name].update(classifier._vectorize(text))
+
+        classifier.centroids = {intent_name: classifier._normalize(dict(vector)) for intent_name, vector in sums.items()}
+
+        return classifier
+
+    def predict(self, text: str) -> Tuple[Optional[str], float]:
+        vector = self._vectorize(text)
+
+        best_intent, best_similarity = None, 0.0
+        for intent_name, centroid in self.centroids.items():
+            similarity = sum(weight * centroid.get(ngram, 0.0) for ngram, weight in vector.items())
+
+            if similarity > best_similarity:
+                best_intent, best_similarity = intent_name, similarity
+
+        return best_intent, best_similarity
+
+    def save(self, path: str):
+        with open(path, 'wt') as f:
+            json.dump({'idf': self.idf, 'centroids': self.centroids}, f)
+
+    @staticmethod
+    def load(path: str) -> 'LocalIntentClassifier':
+        with open(path, 'rt') as f:
+            model = json.load(f)
+
+        return LocalIntentClassifier(idf=model['idf'], centroids=model['centroids'])
+
+
+def read_agent_samples(agent_export_path: str) -> List[Tuple[str, str]]:
+    """Training phrases of the Dialogflow agent export as (question, intent name)."""
+    samples = []
+
+    with zipfile.ZipFile(agent_export_path) as agent_export:
+        for name in agent_export.namelist():
+            if name.startswith('intents/') and name.endswith('_usersays_en.json'):
+                intent_name = name[len('intents/'):-len('_usersays_en.json')]
+
+                for user_says in json.loads(agent_export.read(name)):
+                    samples.append((''.join(part['text'] for part in user_says['data']), intent_name))
+
+    logging.getLogger(__name__).info('Read %s training phrases from %s', len(samples), agent_export_path)
+
+    return samples
@@ -1,5 +1,8 @@
 import logging
 import uuid
+
+from typing import Optional
+
 import dialogflow_v2 as dialogflow
 
 from google.protobuf.json_format import MessageToDict
@@ -18,6 +21,8 @@ from .intents import (
     TripLocationsIntent
 )
 
+from .local_nlu import EntityExtractor, LocalIntentClassifier
+from .nlu_cache import DialogflowResultCache
 from utils.timer import create_elapsed_timer_str
 
 
@@ -36,16 +41,42 @@ INTENTS_MAPPING = {
 
 
 class IntentionEstimator:
-    def __init__(self, project_id: str):
+    """Recognizes intents of questions.
+
+    When a local classifier is given, questions it classifies with at least `local_confidence_threshold` into an
+    intent whose required parameters are all found by the entity extractor are answered without Dialogflow.
+    Other questions go to Dialogflow, in the `offline` mode they are unknown.
+    """
+
+    def __init__(self,
+                 project_id: str,
+                 result_cache: Optional[DialogflowResultCache] = None,
+                 local_classifier: Optional[LocalIntentClassifier] = None,
+                 entity_extractor: Optional[EntityExtractor] = None,
+                 local_confidence_threshold: float = 0.6,
+                 offline: bool = False):
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
 
         self.project_id = project_id
+        self.result_cache = result_cache
+        self.local_classifier = local_classifier
+        self.entity_extractor = entity_extractor if entity_extractor else EntityExtractor()
+        self.local_confidence_threshold = local_confidence_threshold
+        self.offline = offline
         self.session_id = str(uuid.uuid4())
 
-        self.session_client = dialogflow.SessionsClient()
-        self.session = self.session_client.session_path(project_id, self.session_id)
+        self.local_hits = 0
+        self.fallbacks = 0
+
+        if offline:
+            self.session_client = None
+            self.session = None
+            self.logger.info('Dialogflow is not used, unclear questions are unknown')
+        else:
+            self.session_client = dialogflow.SessionsClient()
+            self.session = self.session_client.session_path(project_id, self.session_id)
 
-        self.logger.info('created DialogFlow Session %s', self.session)
+            self.logger.info('created DialogFlow Session %s', self.session)
 
     def __ask_dialogflow(self, question: str):
         sw = create_elapsed_timer_str('sec')
@@ -59,10 +90,59 @@ class IntentionEstimator:
 
         return MessageToDict(response.query_result)
 
+    def __classify_locally(self, question: str) -> Optional[dict]:
+        if self.local_classifier is None:
+            return None
+
+        intent_name, confidence = self.local_classifier.predict(question)
+
+        if (confidence < self.local_confidence_threshold) or (INTENTS_MAPPING.get(intent_name, None) is None):
+            return None
+
+        params = self.entity_extractor.extract(question)
+        intent = INTENTS_MAPPING[intent_name](nl_question=question, confidence=confidence, params_values=params)
+
+        if intent.has_missed_params():
+            return None
+
+        # same shape as Dialogflow query results
+        return {
+            'queryText': question,
+            'intent': {'displayName': intent_name},
+            'intentDetectionConfidence': confidence,
+            'parameters': params
+        }
+
+    def __detect_intent(self, question: str) -> dict:
+        dlg_result = self.__classify_locally(question)
+
+        if dlg_result is not None:
+            self.local_hits += 1
+            self.logger.debug('Classified question locally')
+            return dlg_result
+
+        self.fallbacks += 1
+
+        if self.offline:
+            return {'queryText': question}
+
+        if self.result_cache is None:
+            return self.__ask_dialogflow(question)
+
+        dlg_result = self.result_cache.get(question)
+
+        if dlg_result is None:
+            dlg_result = self.__ask_dialogflow(question)
+            self.result_cache.put(question, dlg_result)
+        else:
+            self.logger.debug('Got cached Dialogflow result')
+
+        return dlg_result
+
     def estimate(self, question: str) -> Intent:
         intent = UnknownIntent(nl_question=question)
 
-        dlg_result = self.__ask_dialogflow(question)
+        dlg_result = self.__detect_intent(question)
 
         self.logger.debug('Dialogflow returned result [%s]', dlg_result)
 
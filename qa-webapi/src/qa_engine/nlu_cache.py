@@ -0,0 +1,176 @@
+import copy
+import hashlib
+import logging
+import re
+import threading
+import time
+
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# entities which can be found in questions without Dialogflow, see entities/*_entries_en.json of the agent export
+SLOT_PATTERNS = [
+    ('trip_id', re.compile(r'\b\d{1,15}[_-]\d{8}[_-]\d{1,10}\b')),
+    ('date', re.compile(r'\b\d{4}-(?:1[0-2]|0[1-9])-(?:3[01]|0[1-9]|[12]\d)(?:[Tt](?:2[0-3]|[01]\d):[0-5]\d:[0-5]\d(?:\.\d{0,6})?[Zz]?)?\b')),
+    ('driver_id', re.compile(r'\b(?=[A-Z]*\d)(?=\d*[A-Z])[A-Z0-9]{9}\b')),
+]
+
+
+def agent_export_version(agent_export_path: str) -> str:
+    """Hash of the Dialogflow agent export, cached results of other exports are not used."""
+    with open(agent_export_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def normalize_question(question: str) -> str:
+    return ' '.join(question.lower().split()).rstrip('?.! ')
+
+
+def mask_question(question: str) -> Tuple[str, List[Tuple[str, str]]]:
+    """Replaces locally recognized entities by numbered slots, returns the template and slots (kind, text)."""
+    slots = []  # type: List[Tuple[str, str]]
+
+    for kind, pattern in SLOT_PATTERNS:
+        def to_slot(match):
+            slots.append((kind, match.group(0)))
+            return f'<{kind}_{len(slots) - 1}>'
+
+        question = pattern.sub(to_slot, question)
+
+    return normalize_question(question), slots
+
+
+def _same_slot_value(kind: str, slot_text: str, param_value: Any) -> bool:
+    if not isinstance(param_value, str):
+        return False
+    elif kind == 'date':
+        # Dialogflow resolves dates to a full datetime in the agent time zone
+        return param_value[:10] == slot_text[:10]
+    else:
+        return param_value == slot_text
+
+
+def _fill_slot_value(kind: str, slot_text: str, cached_value: str) -> str:
+    return slot_text[:10] + cached_value[10:] if kind == 'date' else slot_text
+
+
+def _has_relative_date(dlg_result: dict, slot_params: Dict[str, int]) -> bool:
+    # e.g. 'today', Dialogflow resolves it to the current date, so the result is only good for that day
+    params = dlg_result.get('parameters', None) or {}
+    return any(v and (k == 'date') and (k not in slot_params) for k, v in params.items())
+
+
+class DialogflowResultCache:
+    """Two tier cache of Dialogflow query results.
+
+    The exact tier is keyed by the normalized question. The template tier is keyed by the question with trip IDs,
+    ISO dates and driver IDs masked, it keeps which intent parameter each masked entity went to and fills in the
+    entities of new questions. Driver names are not recognized locally, questions with them hit the exact tier only.
+    Keys contain the agent export version. Results with relative dates expire at the end of the UTC day.
+    """
+
+    def __init__(self,
+                 agent_version: str,
+                 exact_ttl_sec: float = 24 * 3600,
+                 template_ttl_sec: float = 24 * 3600,
+                 max_size: int = 10000):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.agent_version = agent_version
+        self.exact_ttl_sec = exact_ttl_sec
+        self.template_ttl_sec = template_ttl_sec
+        self.max_size = max_size
+
+        self._entries = OrderedDict()  # type: OrderedDict[str, Tuple[float, Any]]
+        self._lock = threading.Lock()
+
+        self.exact_hits = 0
+        self.template_hits = 0
+        self.misses = 0
+
+    def _exact_key(self, question: str) -> str:
+        return f'{self.agent_version}|exact|{normalize_question(question)}'
+
+    def _template_key(self, template: str) -> str:
+        return f'{self.agent_version}|template|{template}'
+
+    def _get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key, None)
+
+            if entry is None:
+                return None
+
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _put(self, key: str, ttl_sec: float, value: Any):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl_sec, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _until_day_end() -> float:
+        now = datetime.now(timezone.utc)
+        return (datetime(now.year, now.month, now.day, tzinfo=timezone.utc) + timedelta(days=1) - now).total_seconds()
+
+    def get(self, question: str) -> Optional[dict]:
+        dlg_result = self._get(self._exact_key(question))
+
+        if dlg_result is not None:
+            self.exact_hits += 1
+            return copy.deepcopy(dlg_result)
+
+        template, slots = mask_question(question)
+        cached = self._get(self._template_key(template)) if slots else None
+
+        if cached is None:
+            self.misses += 1
+            return None
+
+        cached_result, slot_params = cached
+        dlg_result = copy.deepcopy(cached_result)
+
+        for param_name, slot_idx in slot_params.items():
+            kind, slot_text = slots[slot_idx]
+            dlg_result['parameters'][param_name] = _fill_slot_value(kind, slot_text, dlg_result['parameters'][param_name])
+
+        self.template_hits += 1
+
+        return dlg_result
+
+    def put(self, question: str, dlg_result: dict):
+        template, slots = mask_question(question)
+
+        # which parameter every masked entity went to, ambiguous templates are not cached
+        slot_params = {}  # type: Dict[str, int]
+        params = dlg_result.get('parameters', None) or {}
+
+        for slot_idx, (kind, slot_text) in enumerate(slots):
+            matching_params = [k for k, v in params.items() if _same_slot_value(kind, slot_text, v)]
+
+            if len(matching_params) != 1 or matching_params[0] in slot_params:
+                slot_params = None
+                break
+
+            slot_params[matching_params[0]] = slot_idx
+
+        if _has_relative_date(dlg_result, slot_params or {}):
+            exact_ttl_sec = min(self.exact_ttl_sec, self._until_day_end())
+            template_ttl_sec = min(self.template_ttl_sec, self._until_day_end())
+        else:
+            exact_ttl_sec, template_ttl_sec = self.exact_ttl_sec, self.template_ttl_sec
+
+        self._put(self._exact_key(question), exact_ttl_sec, copy.deepcopy(dlg_result))
+
+        if slots and (slot_params is not None) and ('intent' in dlg_result):
+            self._put(self._template_key(template), template_ttl_sec, (copy.deepcopy(dlg_result), slot_params))
@@ -0,0 +1,71 @@
+import base64
+import hashlib
+import json
+import re
+
+from typing import Optional, Tuple
+
+from db_sparql_api.data_version import DataVersionPoller
+
+
+# cursor values are put into SPARQL, anything else is rejected
+ISO_DATETIME = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d{1,9})?(?:Z|[+-]\d{2}:\d{2})?$')
+IRI = re.compile(r'^[^<>"{}|^`\\\s]+$')
+
+
+class InvalidCursorException(Exception):
+    pass
+
+
+class TripsPaginator:
+    """Pages of trips lists and opaque cursors pointing after the last trip of a page.
+
+    A cursor is bound to the question it was returned for and pinned to the data version, see
+    `DataVersionPoller`. After the loader commits changes, cursors of older versions are rejected and the list
+    has to be read from its first page again.
+    """
+
+    def __init__(self,
+                 data_version: Optional[DataVersionPoller] = None,
+                 default_page_size: int = 100,
+                 max_page_size: int = 1000):
+        self.data_version = data_version
+        self.default_page_size = default_page_size
+        self.max_page_size = max_page_size
+
+    def get_page_size(self, page_size: Optional[int]) -> int:
+        return max(1, min(page_size if page_size else self.default_page_size, self.max_page_size))
+
+    def _get_data_version(self) -> Optional[str]:
+        return self.data_version.get_data_version() if self.data_version is not None else None
+
+    @staticmethod
+    def _query_key(query: str) -> str:
+        return hashlib.sha256(query.encode('utf-8')).hexdigest()[:16]
+
+    def encode_cursor(self, query: str, start_ts: str, trip_iri: str) -> str:
+        cursor = {'q': self._query_key(query), 'v': self._get_data_version(), 'ts': start_ts, 'trip': trip_iri}
+        return base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, query: str, cursor: str) -> Tuple[str, str]:
+        """Returns (start time, trip IRI) of the last trip of the previous page of the `query` list."""
+        try:
+            decoded = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            query_key, version, start_ts, trip_iri = decoded['q'], decoded['v'], decoded['ts'], decoded['trip']
+        except (KeyError, TypeError, ValueError):
+            raise InvalidCursorException('Malformed cursor')
+
+        if query_key != self._query_key(query):
+            raise InvalidCursorException('Cursor belongs to another question')
+
+        if not (isinstance(start_ts, str) and ISO_DATETIME.match(start_ts)):
+            raise InvalidCursorException('Malformed cursor')
+
+        if not (isinstance(trip_iri, str) and IRI.match(trip_iri)):
+            raise InvalidCursorException('Malformed cursor')
+
+        current_version = self._get_data_version()
+        if (version is not None) and (current_version is not None) and (version != current_version):
+            raise InvalidCursorException('Trips were loaded since the cursor was returned, read the list again')
+
+        return start_ts, trip_iri
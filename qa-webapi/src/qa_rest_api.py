@@ -1,17 +1,29 @@
 import logging
 import re
 
-from flask import Blueprint
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from flask import Blueprint, Response, request
 from flask import current_app as app
 from flask_restful import reqparse
 
 from qa_engine.agents import SparqlAgent
 from qa_engine.intents_logging import IntentsLogger
+from qa_engine.local_nlu import EntityExtractor, LocalIntentClassifier
 from qa_engine.nlu import IntentionEstimator
+from qa_engine.nlu_cache import DialogflowResultCache, agent_export_version
+from qa_engine.pagination import InvalidCursorException, TripsPaginator
+from db_columnar_api.db_columnar_api import DBColumnarApi, SPEED_GROUPS
+from db_sparql_api.answer_cache import SparqlAnswerCache
+from db_sparql_api.data_version import DataVersionPoller
 from db_sparql_api.db_sparql_api import DBSparqlApi
+from db_sparql_api.repository_pointer import RepositoryPointer, GraphDBRepositoryPointer, FileRepositoryPointer
 from db_sparql_api.prefixes import declare_prefixes, OWL, RDF, TRIP
-from utils import http
+from utils import http, rdf_formats
+from utils.date import to_utc
 from utils.formatting import ignore_if_empty
+from utils.metrics import LatencyHistogram, format_counter
 
 from config.config import CONFIGURATION
 
@@ -24,28 +36,150 @@ mod = Blueprint('qa_rest_api', __name__)
 logger = logging.getLogger(__name__)
 
 
+SHADOW_REBUILD_CFG = CONFIGURATION['GRAPHDB'].get('SHADOW_REBUILD', None) or {}
+
+SPARQL_LATENCY = LatencyHistogram(
+    name='qa_graphdb_request_duration_seconds',
+    description='GraphDB SPARQL request latency, until response headers are received'
+)
+
+
+def create_graphdb_connection_cfg() -> dict:
+    return dict(
+        graphdb_endpoint=CONFIGURATION['GRAPHDB']['ENDPOINT'],
+        username=CONFIGURATION['GRAPHDB']['USERNAME'],
+        password=CONFIGURATION['GRAPHDB']['PASSWORD'],
+        connect_timeout_sec=CONFIGURATION['GRAPHDB'].get('CONNECT_TIMEOUT_SEC', 5),
+        read_timeout_sec=CONFIGURATION['GRAPHDB'].get('READ_TIMEOUT_SEC', 60),
+        pool_size=CONFIGURATION['GRAPHDB'].get('POOL_SIZE', 16),
+        token_refresh_sec=CONFIGURATION['GRAPHDB'].get('TOKEN_REFRESH_SEC', 3600),
+        latency_histogram=SPARQL_LATENCY
+    )
+
+
+def create_repository_pointer(shadow_rebuild_cfg: dict) -> Optional[RepositoryPointer]:
+    if not shadow_rebuild_cfg:
+        return None
+    elif shadow_rebuild_cfg.get('POINTER_FILE', None):
+        return FileRepositoryPointer(path=shadow_rebuild_cfg['POINTER_FILE'])
+    else:
+        return GraphDBRepositoryPointer(db_api=DBSparqlApi(
+            repository_id=shadow_rebuild_cfg['POINTER_REPOSITORY_ID'],
+            **create_graphdb_connection_cfg()
+        ))
+
+
 DB_API = DBSparqlApi(
-    graphdb_endpoint=CONFIGURATION['GRAPHDB']['ENDPOINT'],
     repository_id=CONFIGURATION['GRAPHDB']['REPOSITORY_ID'],
-    username=CONFIGURATION['GRAPHDB']['USERNAME'],
-    password=CONFIGURATION['GRAPHDB']['PASSWORD']
+    repository_pointer=create_repository_pointer(SHADOW_REBUILD_CFG),
+    repository_pointer_refresh_sec=SHADOW_REBUILD_CFG.get('POINTER_REFRESH_SEC', 30),
+    **create_graphdb_connection_cfg()
+)
+
+# bumped by every commit of the loader
+DATA_VERSION = DataVersionPoller(
+    db_api=DB_API,
+    data_graph_name=CONFIGURATION['GRAPHDB']['MAIN_TRIPS_DATA_GRAPH'],
+    poll_sec=CONFIGURATION['GRAPHDB'].get('DATA_VERSION_POLL_SEC', 10)
 )
 
+# answers are served from memory until the loader commits changes
+ANSWER_CACHE_CFG = CONFIGURATION['GRAPHDB'].get('ANSWER_CACHE', None) or {}
+
+ANSWER_CACHE = SparqlAnswerCache(
+    db_api=DB_API,
+    data_version=DATA_VERSION,
+    ttl_sec=ANSWER_CACHE_CFG.get('TTL_SEC', 3600),
+    max_size=ANSWER_CACHE_CFG.get('MAX_SIZE', 1000),
+    max_entry_bytes=ANSWER_CACHE_CFG.get('MAX_ENTRY_BYTES', 1024 * 1024),
+    shared_cache_name=ANSWER_CACHE_CFG.get('UWSGI_CACHE', None)
+) if ANSWER_CACHE_CFG else None
+
+
+def query_trips_data(query: str, kind: str, accept: str = 'text/n3') -> dict:
+    if ANSWER_CACHE is not None:
+        return ANSWER_CACHE.query(sparql=query, accept=accept, kind=kind)
+    else:
+        return DB_API.query(query, accept=accept)
+
+
+def respond_trips_data(query: str, kind: str) -> Response:
+    mimetype = rdf_formats.negotiate(request.accept_mimetypes)
+    response = query_trips_data(query, kind=kind, accept=rdf_formats.GRAPHDB_FORMATS[mimetype])
+
+    if mimetype == rdf_formats.ENVELOPE:
+        return http.response_200(response)
+
+    return http.response_200_answer(mimetype, rdf_formats.to_response_format(mimetype, [response['result']]))
+
+
+NAMED_RESOURCES_CFG = CONFIGURATION['GRAPHDB'].get('NAMED_RESOURCES', None) or {}
+NAMED_RESOURCES_MAX_IDS = NAMED_RESOURCES_CFG.get('MAX_IDS', 200)
+NAMED_RESOURCES_CHUNK_SIZE = NAMED_RESOURCES_CFG.get('CHUNK_SIZE', 50)
+
+# threads are started on the first request, i.e. in every uwsgi worker after the fork
+NAMED_RESOURCES_EXECUTOR = ThreadPoolExecutor(
+    max_workers=NAMED_RESOURCES_CFG.get('PARALLELISM', 4),
+    thread_name_prefix='named-resources'
+)
+
+
+# Parquet export of the loader, aggregate analytics do not scan motion steps with SPARQL
+COLUMNAR_ANALYTICS_CFG = CONFIGURATION.get('COLUMNAR_ANALYTICS', None) or {}
+
+DB_COLUMNAR_API = DBColumnarApi(
+    dataset_dir=COLUMNAR_ANALYTICS_CFG['DIR']
+) if COLUMNAR_ANALYTICS_CFG else None
+
+INTENTS_LOGGING_CFG = CONFIGURATION.get('INTENTS_LOGGING', None) or {}
+
 INTENTS_LOGGER = IntentsLogger(
     data_graph_name=CONFIGURATION['GRAPHDB']['QA_STATS_DATA_GRAPH'],
-    db_api=DB_API
+    db_api=DB_API,
+    batch_size=INTENTS_LOGGING_CFG.get('BATCH_SIZE', 100),
+    flush_interval_sec=INTENTS_LOGGING_CFG.get('FLUSH_INTERVAL_SEC', 5),
+    max_queue_size=INTENTS_LOGGING_CFG.get('MAX_QUEUE_SIZE', 10000),
+    close_timeout_sec=INTENTS_LOGGING_CFG.get('CLOSE_TIMEOUT_SEC', 30)
 )
 
+DIALOGFLOW_CACHE_CFG = CONFIGURATION['DIALOGFLOW'].get('RESULT_CACHE', None) or {}
+
+DIALOGFLOW_CACHE = DialogflowResultCache(
+    agent_version=agent_export_version(DIALOGFLOW_CACHE_CFG['AGENT_EXPORT']),
+    exact_ttl_sec=DIALOGFLOW_CACHE_CFG.get('EXACT_TTL_SEC', 24 * 3600),
+    template_ttl_sec=DIALOGFLOW_CACHE_CFG.get('TEMPLATE_TTL_SEC', 24 * 3600),
+    max_size=DIALOGFLOW_CACHE_CFG.get('MAX_SIZE', 10000)
+) if DIALOGFLOW_CACHE_CFG else None
+
+# trained by train_intents.py, questions it is confident about are not sent to Dialogflow
+LOCAL_CLASSIFIER_CFG = CONFIGURATION['DIALOGFLOW'].get('LOCAL_CLASSIFIER', None) or {}
+
 INTENTION_ESTIMATOR = IntentionEstimator(
-    project_id=CONFIGURATION['DIALOGFLOW']['PROJECT_ID']
+    project_id=CONFIGURATION['DIALOGFLOW']['PROJECT_ID'],
+    result_cache=DIALOGFLOW_CACHE,
+    local_classifier=LocalIntentClassifier.load(LOCAL_CLASSIFIER_CFG['MODEL']) if LOCAL_CLASSIFIER_CFG else None,
+    entity_extractor=EntityExtractor.from_agent_export(
+        LOCAL_CLASSIFIER_CFG['AGENT_EXPORT']
+    ) if LOCAL_CLASSIFIER_CFG.get('AGENT_EXPORT', None) else None,
+    local_confidence_threshold=LOCAL_CLASSIFIER_CFG.get('CONFIDENCE_THRESHOLD', 0.6),
+    offline=LOCAL_CLASSIFIER_CFG.get('OFFLINE', False)
 )
 
 
+# lists of trips are answered in pages
+PAGINATION_CFG = CONFIGURATION.get('PAGINATION', None) or {}
+
 SPARQL_AGENT = SparqlAgent(
     data_graph_name=CONFIGURATION['GRAPHDB']['MAIN_TRIPS_DATA_GRAPH'],
     db_api=DB_API,
     intents_estimator=INTENTION_ESTIMATOR,
-    intents_logger=INTENTS_LOGGER
+    intents_logger=INTENTS_LOGGER,
+    answer_cache=ANSWER_CACHE,
+    paginator=TripsPaginator(
+        data_version=DATA_VERSION,
+        default_page_size=PAGINATION_CFG.get('DEFAULT_PAGE_SIZE', 100),
+        max_page_size=PAGINATION_CFG.get('MAX_PAGE_SIZE', 1000)
+    )
 )
 
 
@@ -54,9 +188,38 @@ SPARQL_AGENT = SparqlAgent(
 def ask_question():
     parser = reqparse.RequestParser()
     parser.add_argument('question', help='Question is required', required=True)
+    parser.add_argument('page_size', type=int, help='Trips per page of trips lists')
+    parser.add_argument('cursor', help='next_cursor of the previous page')
     args = parser.parse_args()
 
-    answer = SPARQL_AGENT.ask(args['question'])
+    mimetype = rdf_formats.negotiate(request.accept_mimetypes)
+
+    try:
+        answer = SPARQL_AGENT.ask(
+            args['question'],
+            page_size=args['page_size'],
+            cursor=args['cursor'],
+            accept=rdf_formats.GRAPHDB_FORMATS[mimetype]
+        )
+    except InvalidCursorException as ex:
+        return http.response_error_400('invalid_cursor', str(ex))
+
+    answer_chunks = getattr(answer, 'answer_chunks', None)
+
+    if (mimetype != rdf_formats.ENVELOPE) and ((answer_chunks is not None) or (answer.answer is not None)):
+        details = answer.get_details()
+        details.pop('answer', None)
+        details.pop('answer_format', None)
+
+        return http.response_200_answer(
+            mimetype,
+            rdf_formats.to_response_format(mimetype, answer_chunks if answer_chunks is not None else [answer.answer]),
+            metadata=details
+        )
+
+    # questions without answers, e.g. not understood ones, are always answered with the JSON envelope
+    if answer_chunks is not None:
+        return http.response_200_streamed(answer.get_details(), 'answer', answer_chunks)
 
     return http.response_200(answer.get_details())
 
@@ -92,7 +255,27 @@ def get_named_resource_details(fragment_identifier):
         "}"
     )
 
-    return http.response_200(DB_API.query(query))
+    return respond_trips_data(query, kind='named_resource')
+
+
+def named_resources_query(fragment_identifiers: List[str], graph_name: str) -> str:
+    # one pattern for all resources, separate patterns per resource are joined as a cartesian product
+    return (
+       f"{declare_prefixes(OWL, RDF, TRIP)} "
+        "CONSTRUCT { ?s ?prop ?value . } "
+        "WHERE { "
+            f"{ignore_if_empty('GRAPH <{}> {{', graph_name)} "
+                f"VALUES ?s {{ {' '.join(f'{TRIP.abbr}:{fr_id}' for fr_id in fragment_identifiers)} }} "
+                "?s ?prop ?value . "
+                "FILTER ( "
+                    "!isBlank(?prop) && "
+                   f"(?prop != {OWL.abbr}:topDataProperty) && "
+                   f"(?prop != {OWL.abbr}:topObjectProperty) && "
+                   f"!((?prop = {RDF.abbr}:type) && isBlank(?value)) "
+                ") "
+            f"{ignore_if_empty('}}', graph_name)} "
+        "}"
+    )
 
 
 @mod.route('/resources/named/', methods=['GET'])
@@ -108,7 +291,7 @@ def get_named_resources_details():
         required=True
     )
     args = parser.parse_args()
-    fragment_identifiers = args.get('fragment_identifiers', [])
+    fragment_identifiers = sorted(set(args.get('fragment_identifiers', [])))
 
     for frag_id in fragment_identifiers:
         if not is_valid_fragment_id(frag_id):
@@ -117,42 +300,49 @@ def get_named_resources_details():
                 'invalid_fragment_identifier'
             )
 
-    def construct():
-        definitions = ''
-        for i, fr_id in enumerate(fragment_identifiers):
-            definitions += f"{TRIP.abbr}:{fr_id} ?prop{i} ?value{i} ."
-
-        return definitions
-
-    def where():
-        definitions = ''
-
-        for i, fr_id in enumerate(fragment_identifiers):
-            definitions += (
-                f"{TRIP.abbr}:{fr_id} ?prop{i} ?value{i} . "
-                "FILTER ("
-                   f"!isBlank(?prop{i}) && "
-                   f"(?prop{i} != {OWL.abbr}:topDataProperty) && "
-                   f"(?prop{i} != {OWL.abbr}:topObjectProperty) && "
-                   f"!((?prop{i} = {RDF.abbr}:type) && isBlank(?value{i})) "
-                ")"
-            )
-
-        return definitions
+    if len(fragment_identifiers) > NAMED_RESOURCES_MAX_IDS:
+        return http.response_error_400(
+            'too_many_fragment_identifiers',
+            f'At most {NAMED_RESOURCES_MAX_IDS} fragment identifiers can be requested at once'
+        )
 
     graph_name = app.config['GRAPHDB']['MAIN_TRIPS_DATA_GRAPH']
-
-    query = (
-       f"{declare_prefixes(OWL, RDF, TRIP)} "
-       f"CONSTRUCT {{ {construct()} }}"
-        "WHERE { "
-            f"{ignore_if_empty('GRAPH <{}> {{', graph_name)} "
-                f"{where()}"
-            f"{ignore_if_empty('}}', graph_name)} "
-        "}"
+    mimetype = rdf_formats.negotiate(request.accept_mimetypes)
+    accept = rdf_formats.GRAPHDB_FORMATS[mimetype]
+
+    # sorted IDs give the same chunks for the same request, so they hit the answer cache
+    responses = NAMED_RESOURCES_EXECUTOR.map(
+        lambda chunk: query_trips_data(named_resources_query(chunk, graph_name), kind='named_resources', accept=accept),
+        [
+            fragment_identifiers[i:i + NAMED_RESOURCES_CHUNK_SIZE]
+            for i in range(0, len(fragment_identifiers), NAMED_RESOURCES_CHUNK_SIZE)
+        ]
     )
 
-    return http.response_200(DB_API.query(query))
+    # the first chunk is awaited here, so GraphDB errors still end up as error responses
+    first_response = next(responses)
+
+    if mimetype == rdf_formats.JSON_LD:
+        # JSON documents can not be concatenated
+        merged = rdf_formats.merge_jsonld([first_response['result']] + [response['result'] for response in responses])
+        return http.response_200_answer(mimetype, [merged])
+
+    def results():
+        # same document as a single query result, N3 and Turtle allow repeated prefix declarations
+        yield first_response['result']
+
+        try:
+            for response in responses:
+                yield '\n' + response['result']
+        except Exception:
+            # the status is already sent, the client gets a truncated document
+            logger.exception('Error while querying named resources %s', fragment_identifiers)
+            raise
+
+    if mimetype == rdf_formats.ENVELOPE:
+        return http.response_200_streamed({'format': first_response['format']}, 'result', results())
+
+    return http.response_200_answer(mimetype, rdf_formats.to_response_format(mimetype, results()))
 
 
 @mod.route('/resources/named/trip', methods=['GET'])
@@ -171,6 +361,8 @@ def get_trip_l1label_details():
 
     graph_name = app.config['GRAPHDB']['MAIN_TRIPS_DATA_GRAPH']
 
+    # label counts are materialized by the loader, the aggregation is only a fallback
+    # for trips loaded before trp:hasL1LabelCount was introduced
     query = (
        f'{declare_prefixes(OWL, RDF, TRIP)} '
        'CONSTRUCT { '
@@ -178,22 +370,55 @@ def get_trip_l1label_details():
                    f'{TRIP.abbr}:ofQuantity ?l1labelQnty . '
        '}'
        'WHERE { '
-          'SELECT ?l1label (COUNT(?l1label) AS ?l1labelQnty) '
-          'WHERE { ' 
+          '{ '
                f"{ignore_if_empty('GRAPH <{}> {{', graph_name)} "
-                   f'{TRIP.abbr}:{trip_id} a {TRIP.abbr}:Trip ;'
-                                f'{TRIP.abbr}:hasRoute ?route .'
-                   f'?route {TRIP.abbr}:hasMotionStep ?ms .'
-                   f'?ms a {TRIP.abbr}:MotionStep, {TRIP.abbr}:RoadMatchedMotionStep;'
-                       f'{TRIP.abbr}:hasL1Label ?l1label;'
-                       f'{TRIP.abbr}:onRoadSegment ?roadseg .'
+                   f'{TRIP.abbr}:{trip_id} {TRIP.abbr}:hasL1LabelCount ?l1labelCount .'
+                   f'?l1labelCount {TRIP.abbr}:ofL1Label ?l1label;'
+                       f'{TRIP.abbr}:ofQuantity ?l1labelQnty .'
                f"{ignore_if_empty('}}', graph_name)} "
           '}'
-          'GROUP BY ?l1label'
+          'UNION '
+          '{ '
+              'SELECT ?l1label (COUNT(?l1label) AS ?l1labelQnty) '
+              'WHERE { '
+                   f"{ignore_if_empty('GRAPH <{}> {{', graph_name)} "
+                       f'{TRIP.abbr}:{trip_id} a {TRIP.abbr}:Trip ;'
+                                    f'{TRIP.abbr}:hasRoute ?route .'
+                       f'FILTER NOT EXISTS {{ {TRIP.abbr}:{trip_id} {TRIP.abbr}:hasL1LabelCount ?anyL1labelCount }} '
+                       f'?route {TRIP.abbr}:hasMotionStep ?ms .'
+                       f'?ms a {TRIP.abbr}:MotionStep, {TRIP.abbr}:RoadMatchedMotionStep;'
+                           f'{TRIP.abbr}:hasL1Label ?l1label;'
+                           f'{TRIP.abbr}:onRoadSegment ?roadseg .'
+                   f"{ignore_if_empty('}}', graph_name)} "
+              '}'
+              'GROUP BY ?l1label'
+          '}'
        '}'
     )
 
-    return http.response_200(DB_API.query(query))
+    return respond_trips_data(query, kind='trip_l1labels')
+
+
+@mod.route('/analytics/speed', methods=['GET'])
+@auth.jwt_auth()
+def get_speed_distribution():
+    if DB_COLUMNAR_API is None:
+        return http.response_error_404('analytics_not_configured', 'Columnar analytics are not configured')
+
+    parser = reqparse.RequestParser()
+    parser.add_argument('group_by', choices=sorted(SPEED_GROUPS), location='args', required=True,
+                        help='One of ' + ', '.join(sorted(SPEED_GROUPS)))
+    parser.add_argument('since', type=to_utc, location='args', help='ISO datetime, inclusive')
+    parser.add_argument('until', type=to_utc, location='args', help='ISO datetime, exclusive')
+    parser.add_argument('driver_id', location='args')
+    args = parser.parse_args()
+
+    return http.response_200(DB_COLUMNAR_API.speed_distribution(
+        group_by=args['group_by'],
+        since=args['since'],
+        until=args['until'],
+        driver_id=args['driver_id']
+    ))
 
 
 @mod.route('/resource/anonym/', methods=['GET'])
@@ -207,6 +432,32 @@ def ping():
     return 'pong'
 
 
+@mod.route('/metrics', methods=['GET'])
+def metrics():
+    dialogflow_cache_metrics = (
+        format_counter('qa_dialogflow_cache_exact_hits_total', 'Questions answered by exact cache tier', DIALOGFLOW_CACHE.exact_hits) +
+        format_counter('qa_dialogflow_cache_template_hits_total', 'Questions answered by template cache tier', DIALOGFLOW_CACHE.template_hits) +
+        format_counter('qa_dialogflow_cache_misses_total', 'Questions sent to Dialogflow', DIALOGFLOW_CACHE.misses)
+    ) if DIALOGFLOW_CACHE is not None else ''
+
+    answer_cache_metrics = (
+        format_counter('qa_answer_cache_hits_total', 'SPARQL answers served from the answer cache', ANSWER_CACHE.hits) +
+        format_counter('qa_answer_cache_misses_total', 'SPARQL answers queried from GraphDB', ANSWER_CACHE.misses)
+    ) if ANSWER_CACHE is not None else ''
+
+    local_classifier_metrics = (
+        format_counter('qa_local_intents_total', 'Questions classified without Dialogflow', INTENTION_ESTIMATOR.local_hits) +
+        format_counter('qa_local_intents_fallbacks_total', 'Questions the local classifier was not confident about', INTENTION_ESTIMATOR.fallbacks)
+    ) if INTENTION_ESTIMATOR.local_classifier is not None else ''
+
+    return Response(
+        SPARQL_LATENCY.as_prometheus() + INTENTS_LOGGER.as_prometheus() +
+        dialogflow_cache_metrics + local_classifier_metrics + answer_cache_metrics,
+        status=200,
+        mimetype='text/plain; version=0.0.4'
+    )
+
+
 @mod.route('/version', methods=['GET'])
 def version():
     return app.config['VERSION']
@@ -3,15 +3,22 @@ from typing import Any, Dict, Optional
 import requests
 
 
-def authorize(base_url: str, jwt_token: str = None) -> Optional[Dict[str, Any]]:
+# connections to DMS are reused across requests
+SESSION = requests.Session()
+
+
+def authorize(base_url: str, jwt_token: str = None, timeout_sec: float = 5) -> Optional[Dict[str, Any]]:
     """Returns:
         `dict` containing User properties if token is valid, `None` otherwise.
+
+    Raises `requests.exceptions.Timeout` when DMS does not respond within `timeout_sec`.
     """
     token_validation_path = base_url + f'/auth/token/{jwt_token}'
 
-    r = requests.get(token_validation_path, headers={'Authorization': f'Bearer {jwt_token}'})
+    r = SESSION.get(token_validation_path, headers={'Authorization': f'Bearer {jwt_token}'}, timeout=timeout_sec)
 
-    if r.status_code == 400:
+    # rejected tokens, anything else failing is not a verdict on the token
+    if r.status_code in (400, 401, 403):
         return None
     r.raise_for_status()
 
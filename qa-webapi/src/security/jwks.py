@@ -0,0 +1,146 @@
+import logging
+import os
+import threading
+import time
+
+from typing import Any, Dict, List, Optional
+
+import requests
+
+
+class JWKSException(Exception):
+    pass
+
+
+class JWKSKeyStore:
+    """Public signing keys of DMS fetched from its JWKS endpoint.
+
+    Keys are refreshed every `refresh_sec` by a background thread and at once, at most every `min_refresh_sec`,
+    when a token is signed by an unknown key. Failed refreshes keep the previous keys, so tokens are verified
+    through DMS outages. The thread is started lazily in the process using the store, uwsgi forks workers
+    after the app is imported. PyJWT[crypto] is only required when local verification is configured.
+    """
+
+    def __init__(self, jwks_url: str, refresh_sec: float = 3600, min_refresh_sec: float = 60, timeout_sec: float = 5):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        import jwt
+
+        self.jwt = jwt
+        self.jwks_url = jwks_url
+        self.refresh_sec = refresh_sec
+        self.min_refresh_sec = min_refresh_sec
+        self.timeout_sec = timeout_sec
+
+        self._keys = {}  # type: Dict[str, Any]
+        self._refreshed_at = None  # type: Optional[float]
+        self._lock = threading.Lock()
+        self._refresh_thread_pid = None  # type: Optional[int]
+
+    def _fetch_keys(self) -> Dict[str, Any]:
+        r = requests.get(self.jwks_url, timeout=self.timeout_sec)
+        r.raise_for_status()
+
+        keys = {}
+        for jwk in r.json()['keys']:
+            if jwk.get('use', 'sig') == 'sig':
+                keys[jwk.get('kid', '')] = self.jwt.PyJWK(jwk).key
+
+        return keys
+
+    def refresh(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+
+            if (self._refreshed_at is not None) and (now - self._refreshed_at < self.min_refresh_sec):
+                return False
+
+            self._refreshed_at = now
+
+        try:
+            keys = self._fetch_keys()
+        except Exception:
+            self.logger.exception('Can not fetch signing keys from %s, keep %s known keys', self.jwks_url, len(self._keys))
+            return False
+
+        self._keys = keys
+        self.logger.info('Fetched %s signing keys from %s', len(keys), self.jwks_url)
+
+        return True
+
+    def _refresh_periodically(self):
+        while True:
+            time.sleep(self.refresh_sec)
+            self.refresh()
+
+    def _ensure_refresh_thread(self):
+        if self._refresh_thread_pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._refresh_thread_pid == os.getpid():
+                return
+
+            self._refresh_thread_pid = os.getpid()
+            threading.Thread(target=self._refresh_periodically, name='jwks-refresh', daemon=True).start()
+
+    def get_key(self, kid: Optional[str]) -> Any:
+        self._ensure_refresh_thread()
+
+        key = self._keys.get(kid or '', None)
+
+        if key is None:
+            # rotated keys or the first call of the process
+            self.refresh()
+            key = self._keys.get(kid or '', None)
+
+        if key is None:
+            raise JWKSException(f'Unknown signing key {kid}')
+
+        return key
+
+
+class LocalJwtVerifier:
+    """Verifies JWT signature, expiration and, when configured, audience and issuer without calling DMS."""
+
+    def __init__(self,
+                 key_store: JWKSKeyStore,
+                 algorithms: List[str],
+                 audience: Optional[str] = None,
+                 issuer: Optional[str] = None,
+                 leeway_sec: float = 0):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.key_store = key_store
+        self.algorithms = algorithms
+        self.audience = audience
+        self.issuer = issuer
+        self.leeway_sec = leeway_sec
+
+    def verify(self, jwt_token: str) -> Optional[Dict[str, Any]]:
+        """Returns token claims if it is valid, `None` otherwise.
+
+        Raises JWKSException when the signing key is not known, i.e. the token can not be verified locally.
+        """
+        jwt = self.key_store.jwt
+
+        try:
+            header = jwt.get_unverified_header(jwt_token)
+        except jwt.InvalidTokenError:
+            return None
+
+        key = self.key_store.get_key(header.get('kid', None))
+
+        try:
+            return jwt.decode(
+                jwt_token,
+                key=key,
+                algorithms=self.algorithms,
+                audience=self.audience,
+                issuer=self.issuer,
+                leeway=self.leeway_sec,
+                options={'verify_aud': self.audience is not None}
+            )
+        except jwt.InvalidTokenError as ex:
+            self.logger.debug('Rejected token: %s', ex)
+            return None
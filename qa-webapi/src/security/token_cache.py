@@ -0,0 +1,145 @@
+import base64
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+def get_token_expiration(jwt_token: str) -> Optional[float]:
+    """Returns `exp` claim of the token, the signature is not verified, DMS does it."""
+    try:
+        payload = jwt_token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenValidationCache:
+    """Caches DMS token validation results keyed by the token hash.
+
+    Valid tokens are kept until their `exp` claim but at most `max_ttl_sec`, rejected ones for `negative_ttl_sec`.
+    Entries live in a per process LRU of `max_size` items and, when the app runs under uwsgi with
+    `shared_cache_name` configured (see `cache2` in uwsgi.ini), in the uwsgi cache shared by all workers.
+    """
+
+    def __init__(self,
+                 max_size: int = 10000,
+                 max_ttl_sec: float = 3600,
+                 default_ttl_sec: float = 300,
+                 negative_ttl_sec: float = 30,
+                 shared_cache_name: Optional[str] = None):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.max_size = max_size
+        self.max_ttl_sec = max_ttl_sec
+        self.default_ttl_sec = default_ttl_sec
+        self.negative_ttl_sec = negative_ttl_sec
+
+        self._entries = OrderedDict()  # type: OrderedDict[str, Tuple[float, Optional[Dict[str, Any]]]]
+        self._lock = threading.Lock()
+
+        self._uwsgi = None
+        self.shared_cache_name = shared_cache_name
+
+        if shared_cache_name:
+            try:
+                import uwsgi
+                self._uwsgi = uwsgi
+            except ImportError:
+                self.logger.warning('Not running under uwsgi, token cache %s is not shared', shared_cache_name)
+
+    @staticmethod
+    def _key(jwt_token: str) -> str:
+        return hashlib.sha256(jwt_token.encode('utf-8')).hexdigest()
+
+    def _ttl(self, jwt_token: str, user: Optional[Dict[str, Any]]) -> float:
+        if not user:
+            return self.negative_ttl_sec
+
+        expires_at = get_token_expiration(jwt_token)
+        if expires_at is None:
+            return self.default_ttl_sec
+
+        return min(expires_at - time.time(), self.max_ttl_sec)
+
+    def get_or_validate(self, jwt_token: str, validate: Callable[[], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        """Returns the cached user of the token, calls `validate` on a miss. Errors of `validate` are not cached."""
+        key = self._key(jwt_token)
+        now = time.time()
+
+        found, user = self._get_local(key, now)
+        if not found:
+            found, user = self._get_shared(key, now)
+
+        if found:
+            return user
+
+        user = validate()
+        ttl = self._ttl(jwt_token, user)
+
+        if ttl > 0:
+            self._put_local(key, now + ttl, user)
+            self._put_shared(key, now + ttl, user)
+
+        return user
+
+    def _get_local(self, key: str, now: float) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        with self._lock:
+            entry = self._entries.get(key, None)
+
+            if entry is None:
+                return False, None
+
+            if entry[0] <= now:
+                del self._entries[key]
+                return False, None
+
+            self._entries.move_to_end(key)
+            return True, entry[1]
+
+    def _put_local(self, key: str, expires_at: float, user: Optional[Dict[str, Any]]):
+        with self._lock:
+            self._entries[key] = (expires_at, user)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _get_shared(self, key: str, now: float) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        if self._uwsgi is None:
+            return False, None
+
+        try:
+            value = self._uwsgi.cache_get(key, self.shared_cache_name)
+        except Exception:
+            self.logger.exception('Can not read shared token cache %s', self.shared_cache_name)
+            return False, None
+
+        if value is None:
+            return False, None
+
+        entry = json.loads(value)
+
+        # uwsgi expires entries with a second granularity, the exact expiration is kept in the entry
+        if entry['expires_at'] <= now:
+            return False, None
+
+        self._put_local(key, entry['expires_at'], entry['user'])
+
+        return True, entry['user']
+
+    def _put_shared(self, key: str, expires_at: float, user: Optional[Dict[str, Any]]):
+        if self._uwsgi is None:
+            return
+
+        value = json.dumps({'expires_at': expires_at, 'user': user}).encode('utf-8')
+
+        try:
+            self._uwsgi.cache_update(key, value, int(expires_at - time.time()) + 1, self.shared_cache_name)
+        except Exception:
+            self.logger.exception('Can not update shared token cache %s', self.shared_cache_name)
@@ -0,0 +1,108 @@
+import json
+import os
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+DMS_USER = {'id': 'user-1', 'source': 'dms'}
+
+
+class StandInServer:
+    """HTTP server on localhost answering GET requests by `respond(path) -> (status, body, delay_sec)`."""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(self.path)
+                status, body, delay_sec = server.respond(self.path)
+
+                # a blackholed server, the client gives up before the answer
+                time.sleep(delay_sec)
+
+                try:
+                    data = json.dumps(body).encode('utf-8')
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+        threading.Thread(target=self.httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class SigningKeys:
+    """RSA keys the stand-in JWKS endpoint publishes and tokens are signed with."""
+
+    def __init__(self):
+        self.jwt = pytest.importorskip('jwt')
+        rsa = pytest.importorskip('cryptography.hazmat.primitives.asymmetric.rsa')
+
+        self.private_keys = {}
+        self.published_kids = []
+
+        self._rsa = rsa
+
+    def add(self, kid: str, publish: bool = True):
+        self.private_keys[kid] = self._rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        if publish:
+            self.published_kids.append(kid)
+
+    def jwks(self) -> dict:
+        keys = []
+
+        for kid in self.published_kids:
+            jwk = json.loads(self.jwt.algorithms.RSAAlgorithm.to_jwk(self.private_keys[kid].public_key()))
+            jwk.update({'kid': kid, 'use': 'sig', 'alg': 'RS256'})
+            keys.append(jwk)
+
+        return {'keys': keys}
+
+    def token(self, kid: str, expires_in_sec: float = 600, **claims) -> str:
+        claims = dict({'sub': 'user-1', 'exp': int(time.time() + expires_in_sec)}, **claims)
+        return self.jwt.encode(claims, self.private_keys[kid], algorithm='RS256', headers={'kid': kid})
+
+
+@pytest.fixture
+def signing_keys():
+    keys = SigningKeys()
+    keys.add('key-1')
+    return keys
+
+
+@pytest.fixture
+def jwks_server(signing_keys):
+    server = StandInServer(lambda path: (200, signing_keys.jwks(), 0))
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def dms_server():
+    server = StandInServer(lambda path: (200, DMS_USER, 0))
+    yield server
+    server.close()
@@ -0,0 +1,112 @@
+import time
+
+import pytest
+
+from flask import Flask
+
+import auth
+
+from conftest import DMS_USER
+
+from security.jwks import JWKSKeyStore, LocalJwtVerifier
+from security.token_cache import TokenValidationCache
+
+
+DMS_TIMEOUT_SEC = 0.5
+
+
+def blackhole(server):
+    server.respond = lambda path: (200, DMS_USER, DMS_TIMEOUT_SEC * 4)
+
+
+@pytest.fixture
+def authenticate(monkeypatch, signing_keys, jwks_server, dms_server):
+    """Returns `authenticate(token, remote_validation)` of auth.py wired to the stand-in JWKS and DMS servers."""
+    verifier = LocalJwtVerifier(
+        key_store=JWKSKeyStore(jwks_url=jwks_server.url + '/jwks.json', timeout_sec=DMS_TIMEOUT_SEC),
+        algorithms=['RS256']
+    )
+
+    monkeypatch.setattr(auth, 'LOCAL_JWT_VERIFIER', verifier)
+    monkeypatch.setattr(auth, 'TOKEN_CACHE', TokenValidationCache())
+    monkeypatch.setattr(auth, 'DMS_TIMEOUT_SEC', DMS_TIMEOUT_SEC)
+
+    app = Flask(__name__)
+    app.config['DMS'] = {'ENDPOINT': dms_server.url}
+
+    def _authenticate(token: str, remote_validation: str):
+        monkeypatch.setattr(auth, 'REMOTE_VALIDATION', remote_validation)
+
+        with app.app_context():
+            return auth.authenticate(token)
+
+    return _authenticate
+
+
+def test_fallback_verifies_locally(signing_keys, dms_server, authenticate):
+    assert authenticate(signing_keys.token('key-1'), 'fallback')['sub'] == 'user-1'
+    assert dms_server.requests == []
+
+
+def test_fallback_rejects_expired_token_locally(signing_keys, dms_server, authenticate):
+    assert authenticate(signing_keys.token('key-1', expires_in_sec=-60), 'fallback') is None
+    assert dms_server.requests == []
+
+
+def test_fallback_asks_dms_about_unknown_kid(signing_keys, dms_server, authenticate):
+    signing_keys.add('key-2', publish=False)
+
+    assert authenticate(signing_keys.token('key-2'), 'fallback') == DMS_USER
+    assert len(dms_server.requests) == 1
+
+
+def test_fallback_rejects_unknown_kid_when_dms_times_out(signing_keys, dms_server, authenticate):
+    signing_keys.add('key-2', publish=False)
+    blackhole(dms_server)
+
+    started_at = time.monotonic()
+    assert authenticate(signing_keys.token('key-2'), 'fallback') is None
+    assert time.monotonic() - started_at < DMS_TIMEOUT_SEC * 3
+
+
+def test_always_asks_dms_about_valid_token(signing_keys, dms_server, authenticate):
+    assert authenticate(signing_keys.token('key-1'), 'always') == DMS_USER
+    assert len(dms_server.requests) == 1
+
+
+def test_always_rejects_token_revoked_in_dms(signing_keys, dms_server, authenticate):
+    dms_server.respond = lambda path: (401, {}, 0)
+
+    assert authenticate(signing_keys.token('key-1'), 'always') is None
+
+
+def test_always_does_not_ask_dms_about_invalid_token(signing_keys, dms_server, authenticate):
+    assert authenticate(signing_keys.token('key-1', expires_in_sec=-60), 'always') is None
+    assert dms_server.requests == []
+
+
+def test_always_accepts_locally_valid_token_when_dms_times_out(signing_keys, dms_server, authenticate):
+    blackhole(dms_server)
+
+    started_at = time.monotonic()
+    assert authenticate(signing_keys.token('key-1'), 'always')['sub'] == 'user-1'
+    assert time.monotonic() - started_at < DMS_TIMEOUT_SEC * 3
+
+
+def test_never_verifies_locally(signing_keys, dms_server, authenticate):
+    assert authenticate(signing_keys.token('key-1'), 'never')['sub'] == 'user-1'
+    assert dms_server.requests == []
+
+
+def test_never_rejects_unknown_kid_without_dms(signing_keys, dms_server, authenticate):
+    signing_keys.add('key-2', publish=False)
+
+    assert authenticate(signing_keys.token('key-2'), 'never') is None
+    assert dms_server.requests == []
+
+
+def test_malformed_token(dms_server, authenticate):
+    for remote_validation in ('never', 'fallback', 'always'):
+        assert authenticate('not-a-token', remote_validation) is None
+
+    assert dms_server.requests == []
@@ -0,0 +1,96 @@
+import pytest
+
+from security.jwks import JWKSException, JWKSKeyStore, LocalJwtVerifier
+
+
+def create_verifier(jwks_server, min_refresh_sec: float = 60, **kwargs) -> LocalJwtVerifier:
+    return LocalJwtVerifier(
+        key_store=JWKSKeyStore(jwks_url=jwks_server.url + '/jwks.json', min_refresh_sec=min_refresh_sec, timeout_sec=1),
+        algorithms=['RS256'],
+        **kwargs
+    )
+
+
+def test_valid_token(signing_keys, jwks_server):
+    verifier = create_verifier(jwks_server, audience='qa-webapi')
+
+    claims = verifier.verify(signing_keys.token('key-1', aud='qa-webapi'))
+
+    assert claims['sub'] == 'user-1'
+
+
+def test_expired_token(signing_keys, jwks_server):
+    verifier = create_verifier(jwks_server)
+
+    assert verifier.verify(signing_keys.token('key-1', expires_in_sec=-60)) is None
+
+
+def test_expired_token_within_leeway(signing_keys, jwks_server):
+    verifier = create_verifier(jwks_server, leeway_sec=120)
+
+    assert verifier.verify(signing_keys.token('key-1', expires_in_sec=-60))['sub'] == 'user-1'
+
+
+@pytest.mark.parametrize('token', ['', 'not-a-token', 'a.b.c', 'eyJhbGciOiJSUzI1NiIsImtpZCI6ImtleS0xIn0.e30.c2ln'])
+def test_malformed_token(jwks_server, token):
+    verifier = create_verifier(jwks_server)
+
+    assert verifier.verify(token) is None
+
+
+def test_token_signed_by_another_key_with_known_kid(signing_keys, jwks_server):
+    verifier = create_verifier(jwks_server)
+    signing_keys.add('key-2', publish=False)
+
+    # forged: signed by key-2, claims to be signed by key-1
+    token = signing_keys.jwt.encode(
+        {'sub': 'user-1'}, signing_keys.private_keys['key-2'], algorithm='RS256', headers={'kid': 'key-1'}
+    )
+
+    assert verifier.verify(token) is None
+
+
+def test_unknown_kid(signing_keys, jwks_server):
+    verifier = create_verifier(jwks_server)
+    signing_keys.add('key-2', publish=False)
+
+    with pytest.raises(JWKSException):
+        verifier.verify(signing_keys.token('key-2'))
+
+
+def test_unknown_kids_refresh_keys_at_most_every_min_refresh_sec(signing_keys, jwks_server):
+    verifier = create_verifier(jwks_server, min_refresh_sec=60)
+    signing_keys.add('key-2', publish=False)
+
+    for _ in range(5):
+        with pytest.raises(JWKSException):
+            verifier.verify(signing_keys.token('key-2'))
+
+    assert len(jwks_server.requests) == 1
+
+
+def test_key_rotation(signing_keys, jwks_server):
+    verifier = create_verifier(jwks_server, min_refresh_sec=60)
+    assert verifier.verify(signing_keys.token('key-1'))['sub'] == 'user-1'
+
+    signing_keys.add('key-2')
+    signing_keys.published_kids.remove('key-1')
+
+    # keys were fetched less than min_refresh_sec ago
+    with pytest.raises(JWKSException):
+        verifier.verify(signing_keys.token('key-2'))
+
+    verifier.key_store._refreshed_at -= 60
+
+    assert verifier.verify(signing_keys.token('key-2'))['sub'] == 'user-1'
+    assert len(jwks_server.requests) == 2
+
+
+def test_failed_refresh_keeps_known_keys(signing_keys, jwks_server):
+    verifier = create_verifier(jwks_server, min_refresh_sec=0)
+    assert verifier.verify(signing_keys.token('key-1'))['sub'] == 'user-1'
+
+    jwks_server.respond = lambda path: (503, {}, 0)
+
+    assert verifier.key_store.refresh() is False
+    assert verifier.verify(signing_keys.token('key-1'))['sub'] == 'user-1'
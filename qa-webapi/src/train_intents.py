@@ -0,0 +1,85 @@
+"""Trains the local intent classifier from asked questions and the Dialogflow agent training phrases.
+
+Questions are read from the QA stats graph, they are labelled with the intents they were answered by. Questions
+answered as unknown are skipped, they also contain well recognized questions with missing parameters.
+"""
+import argparse
+import csv
+import io
+import logging
+
+from collections import Counter
+from typing import List, Tuple
+
+from config.config import CONFIGURATION
+
+from db_sparql_api.db_sparql_api import DBSparqlApi
+from db_sparql_api.prefixes import declare_prefixes, TRIPQA
+from qa_engine.local_nlu import LocalIntentClassifier, read_agent_samples
+from qa_engine.nlu import INTENTS_MAPPING
+
+
+logger = logging.getLogger(__name__)
+
+
+def read_asked_questions(db_api: DBSparqlApi, data_graph_name: str) -> List[Tuple[str, str]]:
+    intent_names = {intent_cls.__name__: name for name, intent_cls in INTENTS_MAPPING.items() if intent_cls is not None}
+
+    query = (
+        f"{declare_prefixes(TRIPQA)} "
+         "SELECT ?question ?intentId "
+         "WHERE { "
+            f"GRAPH <{data_graph_name}> {{ "
+                f"?q a {TRIPQA.abbr}:Question ; "
+                   f"{TRIPQA.abbr}:hasIntentId ?intentId ; "
+                   f"{TRIPQA.abbr}:englishLanguage ?question . "
+             "} "
+         "}"
+    )
+
+    result = db_api.query(sparql=query, accept='text/csv')
+
+    return [
+        (row['question'], intent_names[row['intentId']])
+        for row in csv.DictReader(io.StringIO(result['result']))
+        if row['intentId'] in intent_names
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the local intent classifier')
+    parser.add_argument('--model', required=True, help='Path of the trained model, JSON')
+    parser.add_argument('--agent_export', help='Dialogflow agent export, its training phrases are added to questions')
+    parser.add_argument('--no_asked_questions', action='store_true', help='Do not read questions from the QA stats graph')
+    args = parser.parse_args()
+
+    samples = []  # type: List[Tuple[str, str]]
+
+    if not args.no_asked_questions:
+        db_api = DBSparqlApi(
+            graphdb_endpoint=CONFIGURATION['GRAPHDB']['ENDPOINT'],
+            repository_id=CONFIGURATION['GRAPHDB']['REPOSITORY_ID'],
+            username=CONFIGURATION['GRAPHDB']['USERNAME'],
+            password=CONFIGURATION['GRAPHDB']['PASSWORD']
+        )
+        asked = read_asked_questions(db_api, CONFIGURATION['GRAPHDB']['QA_STATS_DATA_GRAPH'])
+        logger.info('Read %s labelled questions from the QA stats graph', len(asked))
+        samples.extend(asked)
+
+    if args.agent_export:
+        samples.extend(read_agent_samples(args.agent_export))
+
+    if not samples:
+        parser.error('No training questions')
+
+    classifier = LocalIntentClassifier.train(samples)
+    classifier.save(args.model)
+
+    correct = sum(1 for text, intent_name in samples if classifier.predict(text)[0] == intent_name)
+
+    logger.info('Questions per intent %s', dict(Counter(intent_name for _, intent_name in samples)))
+    logger.info('Saved model to %s, %s of %s training questions are classified correctly', args.model, correct, len(samples))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import logging
+import zlib
+
+from typing import Callable, Iterable, Optional
+
+from flask import Response
+
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/ld+json',
+    'application/sparql-results+json',
+    'text/turtle',
+    'text/n3',
+    'text/plain',
+}
+
+
+class ResponseCompressor:
+    """Compresses responses with brotli or gzip, whichever the client accepts, brotli is preferred.
+
+    Streamed responses are compressed chunk by chunk, others only when they have at least `min_size` bytes.
+    brotli is only used when the brotli package is installed.
+    """
+
+    def __init__(self, min_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4, use_brotli: bool = True):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+        self.brotli = None
+
+        if use_brotli:
+            try:
+                import brotli
+                self.brotli = brotli
+            except ImportError:
+                self.logger.warning('brotli is not installed, responses are compressed with gzip only')
+
+    @staticmethod
+    def _accepts(accept_encoding: str, encoding: str) -> bool:
+        for value in accept_encoding.split(','):
+            name, _, params = value.strip().partition(';')
+            if name.strip().lower() == encoding:
+                return params.replace(' ', '').lower() not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+
+        return False
+
+    def _create_compressor(self, encoding: str) -> Callable[[Optional[bytes]], bytes]:
+        """Returns a function which compresses the next chunk, `None` finishes the stream."""
+        if encoding == 'br':
+            compressor = self.brotli.Compressor(quality=self.brotli_quality)
+            return lambda chunk: compressor.process(chunk) + compressor.flush() if chunk is not None else compressor.finish()
+        else:
+            # wbits 31 writes the gzip header and trailer
+            compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31)
+            return lambda chunk: compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH) if chunk is not None else compressor.flush()
+
+    @staticmethod
+    def _compress_stream(chunks: Iterable[bytes], compress: Callable[[Optional[bytes]], bytes]):
+        for chunk in chunks:
+            if chunk:
+                # every chunk is flushed, so clients get the first bytes as early as without compression
+                yield compress(chunk)
+
+        yield compress(None)
+
+    def compress(self, response: Response, accept_encoding: str) -> Response:
+        if (response.status_code < 200) or (response.status_code >= 300) or ('Content-Encoding' in response.headers):
+            return response
+
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+
+        response.vary.add('Accept-Encoding')
+
+        if (self.brotli is not None) and self._accepts(accept_encoding, 'br'):
+            encoding = 'br'
+        elif self._accepts(accept_encoding, 'gzip'):
+            encoding = 'gzip'
+        else:
+            return response
+
+        compress = self._create_compressor(encoding)
+
+        if response.is_streamed:
+            chunks = response.response
+            response.response = self._compress_stream(
+                (chunk.encode('utf-8') if isinstance(chunk, str) else chunk for chunk in chunks),
+                compress
+            )
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+
+            if len(data) < self.min_size:
+                return response
+
+            response.set_data(compress(data) + compress(None))
+
+        response.headers['Content-Encoding'] = encoding
+
+        return response
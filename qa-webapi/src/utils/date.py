@@ -3,6 +3,10 @@ from dateutil.parser import isoparse
 from dateutil.tz import UTC
 
 
+def to_utc(datetime_str: str) -> datetime:
+    return isoparse(datetime_str).astimezone(UTC)
+
+
 def to_utc_at_day_start(datetime_str: str) -> datetime:
     return isoparse(datetime_str).astimezone(UTC).replace(hour=0, minute=0, second=0, microsecond=0)
 
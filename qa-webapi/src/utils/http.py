@@ -1,9 +1,10 @@
+import codecs
 import logging
 import json
 import time
 
 from logging import Logger
-from typing import Callable, Tuple, Type, Union
+from typing import Callable, Iterable, Optional, Tuple, Type, Union
 from functools import wraps
 from flask import Response
 
@@ -38,6 +39,33 @@ def response_200(data) -> Response:
     return Response(json.dumps(data), status=200, mimetype='application/json')
 
 
+def response_200_streamed(data: dict, field: str, chunks: Iterable[Union[bytes, str]]) -> Response:
+    """Sends `data` with `field` set to the concatenated chunks as a JSON string, chunks are sent as they come."""
+    def generate():
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        head = json.dumps(data)
+
+        yield (f'{head[:-1]}, ' if data else '{') + f'{json.dumps(field)}: "'
+
+        for chunk in chunks:
+            yield json.dumps(decoder.decode(chunk) if isinstance(chunk, bytes) else chunk)[1:-1]
+
+        yield json.dumps(decoder.decode(b'', final=True))[1:-1] + '"}'
+
+    return Response(generate(), status=200, mimetype='application/json')
+
+
+def response_200_answer(mimetype: str, chunks: Iterable[Union[bytes, str]], metadata: Optional[dict] = None) -> Response:
+    """Sends the answer itself in its format, the answer metadata goes to the X-QA-Answer header as JSON."""
+    response = Response(chunks, status=200, mimetype=mimetype)
+
+    if metadata:
+        # ASCII only JSON without line breaks is a valid header value
+        response.headers['X-QA-Answer'] = json.dumps(metadata, ensure_ascii=True)
+
+    return response
+
+
 def retry(exception: Union[Type[Exception], Tuple[Type[Exception]]],
           num_tries: int = 3,
           delay: float = 1,
@@ -0,0 +1,68 @@
+import bisect
+import threading
+
+from typing import Dict, List, Sequence, Tuple
+
+
+DEFAULT_LATENCY_BUCKETS_SEC = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def format_counter(name: str, description: str, value: float) -> str:
+    return (
+        f'# HELP {name} {description}\n'
+        f'# TYPE {name} counter\n'
+        f'{name} {value}\n'
+    )
+
+
+class LatencyHistogram:
+    """Cumulative latency histogram per label, exposed in the Prometheus text format.
+
+    Counts are kept per process, every uwsgi worker reports its own ones.
+    """
+
+    def __init__(self, name: str, description: str, buckets_sec: Sequence[float] = DEFAULT_LATENCY_BUCKETS_SEC):
+        self.name = name
+        self.description = description
+        self.buckets_sec = sorted(buckets_sec)
+
+        self._counts = {}  # type: Dict[str, List[int]]
+        self._sums = {}  # type: Dict[str, float]
+        self._lock = threading.Lock()
+
+    def observe(self, label: str, elapsed_sec: float) -> None:
+        bucket_idx = bisect.bisect_left(self.buckets_sec, elapsed_sec)
+
+        with self._lock:
+            counts = self._counts.get(label, None)
+
+            if counts is None:
+                # the last one counts observations over the largest bucket, i.e. +Inf
+                counts = [0] * (len(self.buckets_sec) + 1)
+                self._counts[label] = counts
+                self._sums[label] = 0.0
+
+            counts[bucket_idx] += 1
+            self._sums[label] += elapsed_sec
+
+    def snapshot(self) -> Dict[str, Tuple[List[int], float]]:
+        with self._lock:
+            return {label: (list(counts), self._sums[label]) for label, counts in self._counts.items()}
+
+    def as_prometheus(self) -> str:
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} histogram'
+        ]
+
+        for label, (counts, total_sec) in sorted(self.snapshot().items()):
+            cumulative = 0
+
+            for upper_bound, count in zip(list(self.buckets_sec) + ['+Inf'], counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{operation="{label}",le="{upper_bound}"}} {cumulative}')
+
+            lines.append(f'{self.name}_sum{{operation="{label}"}} {total_sec}')
+            lines.append(f'{self.name}_count{{operation="{label}"}} {cumulative}')
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,120 @@
+import codecs
+import itertools
+import json
+import re
+
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+
+# the answer as a JSON string inside the answer JSON document, kept for compatibility
+ENVELOPE = 'application/json'
+JSON_LD = 'application/ld+json'
+TURTLE = 'text/turtle'
+N3 = 'text/n3'
+SPARQL_RESULTS_JSON = 'application/sparql-results+json'
+
+# response format -> format requested from GraphDB, the first one is the default
+GRAPHDB_FORMATS = {
+    ENVELOPE: N3,
+    JSON_LD: 'application/ld+json;profile="http://www.w3.org/ns/json-ld#compacted"',
+    TURTLE: TURTLE,
+    N3: N3,
+    # CONSTRUCT results have no SPARQL results serialization, their triples are converted to bindings
+    SPARQL_RESULTS_JSON: 'application/n-triples',
+}
+
+NT_TERM = re.compile(r'\s*(<[^>]*>|_:\S+|"(?:[^"\\]|\\.)*"(?:@[a-zA-Z][a-zA-Z0-9-]*|\^\^<[^>]*>)?)')
+NT_ESCAPE = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+NT_ESCAPED_CHARS = {'t': '\t', 'b': '\b', 'n': '\n', 'r': '\r', 'f': '\f', '"': '"', "'": "'", '\\': '\\'}
+
+
+def negotiate(accept_mimetypes) -> str:
+    """Picks the response format for the request Accept header (werkzeug MIMEAccept)."""
+    return accept_mimetypes.best_match(list(GRAPHDB_FORMATS), default=ENVELOPE)
+
+
+def _unescape(text: str) -> str:
+    def unescape(match):
+        code = match.group(1) or match.group(2)
+        return chr(int(code, 16)) if code else NT_ESCAPED_CHARS.get(match.group(3), match.group(3))
+
+    return NT_ESCAPE.sub(unescape, text)
+
+
+def _to_binding(term: str) -> Dict[str, str]:
+    if term.startswith('<'):
+        return {'type': 'uri', 'value': _unescape(term[1:-1])}
+    elif term.startswith('_:'):
+        return {'type': 'bnode', 'value': term[2:]}
+
+    end = term.rindex('"')
+    binding = {'type': 'literal', 'value': _unescape(term[1:end])}
+    suffix = term[end + 1:]
+
+    if suffix.startswith('@'):
+        binding['xml:lang'] = suffix[1:]
+    elif suffix.startswith('^^'):
+        binding['datatype'] = suffix[3:-1]
+
+    return binding
+
+
+def _parse_ntriple(line: str) -> Optional[List[str]]:
+    terms = []
+    position = 0
+
+    for _ in range(3):
+        match = NT_TERM.match(line, position)
+        if not match:
+            return None
+
+        terms.append(match.group(1))
+        position = match.end()
+
+    return terms
+
+
+def ntriples_to_sparql_results(chunks: Iterable[Union[bytes, str]]) -> Iterator[str]:
+    """Converts N-Triples to SPARQL results JSON with `subject`, `predicate` and `object` bindings, line by line."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    rest = ''
+    separator = ''
+
+    yield '{"head": {"vars": ["subject", "predicate", "object"]}, "results": {"bindings": ['
+
+    # None marks the end, the last line may not end with a line break
+    for chunk in itertools.chain(chunks, [None]):
+        if chunk is None:
+            lines, rest = [rest + decoder.decode(b'', final=True)], ''
+        else:
+            *lines, rest = (rest + (decoder.decode(chunk) if isinstance(chunk, bytes) else chunk)).split('\n')
+
+        for line in lines:
+            terms = _parse_ntriple(line) if line.strip() and not line.lstrip().startswith('#') else None
+
+            if terms:
+                subject, predicate, obj = (_to_binding(term) for term in terms)
+                yield separator + json.dumps({'subject': subject, 'predicate': predicate, 'object': obj})
+                separator = ', '
+
+    yield ']}}'
+
+
+def merge_jsonld(documents: Iterable[str]) -> str:
+    """Merges compacted JSON-LD documents of the same query with different VALUES into a single one."""
+    context = None
+    graph = []  # type: List[dict]
+
+    for document in documents:
+        parsed = json.loads(document) if document.strip() else []
+
+        for node in parsed if isinstance(parsed, list) else [parsed]:
+            context = node.pop('@context', context)
+            graph.extend(node['@graph'] if '@graph' in node else [node] if node else [])
+
+    return json.dumps({'@context': context, '@graph': graph} if context is not None else graph)
+
+
+def to_response_format(mimetype: str, chunks: Iterable[Union[bytes, str]]) -> Iterable[Union[bytes, str]]:
+    """The answer in the response format, GraphDB results of GRAPHDB_FORMATS[mimetype] are passed as they are."""
+    return ntriples_to_sparql_results(chunks) if mimetype == SPARQL_RESULTS_JSON else chunks